@@ -0,0 +1,415 @@
+"""
+Offline performance benchmarks for ShakeFetch.
+
+    python benchmarks.py smoothing --windows 48
+    python benchmarks.py store data/Survey
+    python benchmarks.py suite --latency-ms 50 --bandwidth 500 -o before.json
+    python benchmarks.py compare before.json after.json
+
+The suite needs no Shake: it fetches from a SyntheticWaveServer on localhost and runs MHVSR
+on a synthetic project, so results from two checkouts on the same machine can be compared.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best_of(func, repeats):
+    """
+    Returns the shortest wall time of repeats calls to func and the last result.
+    """
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure(func, repeats=1, memory=True):
+    """
+    Returns {"seconds": best wall time of repeats calls, "peak_mb": peak traced allocations}
+    and the last result.
+
+    Peak memory comes from one more call under tracemalloc, kept apart from the timed calls
+    because tracing slows Python code down.
+    """
+    seconds, result = best_of(func, repeats)
+    measurement = {"seconds": seconds}
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            result = func()
+            measurement["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return measurement, result
+
+
+def bench_fetch(server, start_time, window_seconds, repeats=3, memory=True):
+    """
+    Times fetch_waveforms of one three-component window from a wave server, over a new
+    connection each time.
+    """
+    from data_acquisition import ConnectionPool, fetch_waveforms
+    params = dict(server.params, start_time=start_time, end_time=start_time + window_seconds)
+    bytes_before, calls = server.stats["bytes_sent"], repeats + memory
+
+    def fetch():
+        pool = ConnectionPool()
+        try:
+            return fetch_waveforms(params, pool=pool)
+        finally:
+            pool.close_all()
+
+    result, stream = measure(fetch, repeats, memory)
+    samples = sum(trace.stats.npts for trace in stream)
+    nbytes = (server.stats["bytes_sent"] - bytes_before) / calls
+    result.update(window_seconds=window_seconds, traces=len(stream), samples=samples, bytes=nbytes,
+                  samples_per_second=samples / result["seconds"],
+                  megabytes_per_second=nbytes / 1e6 / result["seconds"])
+    return result
+
+
+def bench_multifetch(server, start_time, stations, window_seconds, max_per_host=4, chunk_seconds=None,
+                     repeats=1, memory=True, work_dir=None):
+    """
+    Times run_project_fetch, the Multifetch tab's fetch path, for stations consecutive windows
+    into a new project directory each time.
+    """
+    from data_acquisition import get_connection_pool
+    from fetch_scheduler import run_project_fetch
+    all_params = [dict(server.params, station_num=station_num,
+                       start_time=start_time + (station_num - 1) * window_seconds,
+                       end_time=start_time + station_num * window_seconds)
+                  for station_num in range(1, stations + 1)]
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+
+    def multifetch():
+        with tempfile.TemporaryDirectory(dir=work_dir) as project_dir:
+            stats, _ = run_project_fetch("Benchmark", os.path.join(project_dir, "Benchmark"),
+                                         [dict(params) for params in all_params], lambda text: None,
+                                         max_per_host=max_per_host, chunk_seconds=chunk_seconds)
+        return stats
+
+    try:
+        result, stats = measure(multifetch, repeats, memory)
+    finally:
+        get_connection_pool().close_all()
+    result.update(stations=stations, window_seconds=window_seconds, max_per_host=max_per_host,
+                  chunk_seconds=chunk_seconds, windows_ok=stats.windows_ok, windows_failed=stats.windows_failed,
+                  bytes=stats.bytes, windows_per_second=stats.windows_ok / result["seconds"],
+                  megabytes_per_second=stats.bytes / 1e6 / result["seconds"])
+    return result
+
+
+def bench_mhvsr(project_path, repeats=1, memory=True, window_length=150, bandwidth=40):
+    """
+    Times process_mhvsr, without the spectral cache or project store, on every station of a project.
+    """
+    from mhvsr_logic import process_mhvsr, group_project_files
+    from mhvsr_logic import get_default_preprocessing_settings, get_default_processing_settings
+    station_files = group_project_files(project_path)
+    preprocessing_settings = get_default_preprocessing_settings(window_length)
+    processing_settings = get_default_processing_settings(bandwidth)
+
+    def mhvsr():
+        return [process_mhvsr(file_paths, preprocessing_settings, processing_settings)
+                for file_paths in station_files.values()]
+
+    result, hvsrs = measure(mhvsr, repeats, memory)
+    windows = sum(hvsr.n_curves for hvsr in hvsrs)
+    result.update(stations=len(station_files), windows=windows, window_length=window_length,
+                  seconds_per_station=result["seconds"] / max(len(station_files), 1),
+                  peak_frequency_hz=float(hvsrs[0].mean_fn_frequency()) if hvsrs else None)
+    return result
+
+
+def environment():
+    """Returns the machine, Python, package versions and git commit a run was made with."""
+    import platform
+    import subprocess
+    from importlib import metadata
+    versions = {}
+    for package in ("numpy", "scipy", "obspy", "hvsrpy"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "packages": versions, "commit": commit}
+
+
+def run_suite(stations=8, window_minutes=30, fetch_minutes=60, latency_ms=20.0, bandwidth_kb=0,
+              packet_samples=100, max_per_host=4, repeats=3, memory=True, skip=(), work_dir=None):
+    """
+    Runs the fetch, Multifetch and MHVSR benchmarks against a SyntheticWaveServer and a synthetic
+    project, and returns the results as a JSON-ready dict.
+
+    latency_ms is added to every wave server reply and bandwidth_kb (kB/s, 0 for unlimited) is
+    shared by all connections to it. MHVSR runs on a project of stations windows of
+    window_minutes written straight to disk.
+    """
+    from obspy import UTCDateTime
+    from synthetic_wave_server import SyntheticWaveServer, write_synthetic_project
+
+    window_seconds = window_minutes * 60
+    span = max(fetch_minutes * 60, stations * window_seconds)
+    # Leave an hour after the windows so they are all well inside what the server holds.
+    start_time = UTCDateTime(int(time.time()) - span - 3600)
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+    config = {"stations": stations, "window_minutes": window_minutes, "fetch_minutes": fetch_minutes,
+              "latency_ms": latency_ms, "bandwidth_kb": bandwidth_kb, "packet_samples": packet_samples,
+              "max_per_host": max_per_host, "repeats": repeats}
+    results = {"version": 1, "created": UTCDateTime().isoformat(), "environment": environment(),
+               "config": config, "results": {}}
+
+    server = SyntheticWaveServer(latency=latency_ms / 1000, bandwidth=bandwidth_kb * 1000 or None,
+                                 packet_samples=packet_samples, retention_seconds=span + 2 * 3600)
+    with server:
+        if "fetch" not in skip:
+            results["results"]["fetch"] = bench_fetch(server, start_time, fetch_minutes * 60, repeats, memory)
+        if "multifetch" not in skip:
+            results["results"]["multifetch"] = bench_multifetch(server, start_time, stations, window_seconds,
+                                                                max_per_host, repeats=repeats, memory=memory,
+                                                                work_dir=work_dir)
+    if "mhvsr" not in skip:
+        with tempfile.TemporaryDirectory(dir=work_dir) as project_path:
+            write_synthetic_project(project_path, "Benchmark", stations, window_seconds, start_time,
+                                    signal=server.signal)
+            results["results"]["mhvsr"] = bench_mhvsr(project_path, repeats, memory)
+    return results
+
+
+def format_results(results):
+    """Returns human readable lines for run_suite results."""
+    config, stages = results["config"], results["results"]
+    link = (f"{config['latency_ms']:g} ms latency, "
+            + (f"{config['bandwidth_kb']:g} kB/s" if config["bandwidth_kb"] else "unlimited bandwidth"))
+    lines = [f"Synthetic wave server: {link}, {config['packet_samples']} samples per packet"]
+    peak = lambda stage: f", peak {stage['peak_mb']:.1f} MB" if "peak_mb" in stage else ""
+    if "fetch" in stages:
+        fetch = stages["fetch"]
+        lines.append(f"  fetch {fetch['window_seconds'] / 60:g} min x {fetch['traces']} traces: "
+                     f"{fetch['seconds']:.2f} s, {fetch['samples_per_second'] / 1e3:.0f} k samples/s, "
+                     f"{fetch['megabytes_per_second']:.2f} MB/s{peak(fetch)}")
+    if "multifetch" in stages:
+        multifetch = stages["multifetch"]
+        lines.append(f"  multifetch {multifetch['stations']} x {multifetch['window_seconds'] / 60:g} min: "
+                     f"{multifetch['seconds']:.2f} s, {multifetch['windows_per_second']:.2f} windows/s, "
+                     f"{multifetch['windows_failed']} failed{peak(multifetch)}")
+    if "mhvsr" in stages:
+        mhvsr = stages["mhvsr"]
+        lines.append(f"  mhvsr {mhvsr['stations']} stations, {mhvsr['windows']} windows: "
+                     f"{mhvsr['seconds']:.2f} s ({mhvsr['seconds_per_station']:.2f} s/station){peak(mhvsr)}")
+    return lines
+
+
+def compare_results(baseline, candidate):
+    """
+    Returns lines comparing the timings and peak memory of two run_suite results.
+
+    Ratios are candidate / baseline, so below 1.0 is faster or smaller.
+    """
+    lines = []
+    if baseline["config"] != candidate["config"]:
+        changed = sorted(key for key in set(baseline["config"]) | set(candidate["config"])
+                         if baseline["config"].get(key) != candidate["config"].get(key))
+        lines.append(f"Warning: runs used different settings ({', '.join(changed)})")
+    for stage in sorted(set(baseline["results"]) & set(candidate["results"])):
+        for key in ("seconds", "peak_mb"):
+            before = baseline["results"][stage].get(key)
+            after = candidate["results"][stage].get(key)
+            if before and after is not None:
+                lines.append(f"  {stage + ' ' + key:<20} {before:10.3f} -> {after:10.3f}  ({after / before:.2f}x)")
+    return lines
+
+
+def cmd_suite(args):
+    results = run_suite(args.stations, args.window_minutes, args.fetch_minutes, args.latency_ms, args.bandwidth,
+                        args.packet_samples, args.parallel, args.repeats, not args.no_memory, args.skip,
+                        args.work_dir)
+    print("\n".join(format_results(results)))
+    output = args.output or f"benchmark-{time.strftime('%Y%m%dT%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f"{args.baseline} ({baseline['environment'].get('commit')}) -> "
+          f"{args.candidate} ({candidate['environment'].get('commit')})")
+    print("\n".join(compare_results(baseline, candidate)))
+
+
+def cmd_project(args):
+    from synthetic_wave_server import write_synthetic_project
+    files = write_synthetic_project(os.path.join(args.project_dir, args.project_name), args.project_name,
+                                    args.stations, args.window_minutes * 60)
+    print(f"Wrote {len(files)} synthetic windows to {os.path.join(args.project_dir, args.project_name)}")
+
+
+def cmd_serve(args):
+    from synthetic_wave_server import SyntheticWaveServer
+    server = SyntheticWaveServer(args.host, args.port, latency=args.latency_ms / 1000,
+                                 bandwidth=args.bandwidth * 1000 or None, packet_samples=args.packet_samples)
+    with server:
+        params = server.params
+        print(f"Serving {params['net']}.{params['sta']}.{params['loc']}.{params['cha']} on "
+              f"{params['host']}:{params['port']}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+def add_link_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Delay added to every wave server reply.")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="Wave server bandwidth in kB/s shared by all connections, 0 for unlimited.")
+    parser.add_argument("--packet-samples", type=int, default=100, help="Samples per TraceBuf2 packet.")
+
+
+def bench_smoothing(windows=48, window_length=150, sampling_rate=100.0, bandwidth=40, repeats=3):
+    """
+    Compares hvsrpy's per-center-frequency Konno and Ohmachi smoothing with the cached
+    sparse operator on spectra the size of MHVSR windows.
+    """
+    import numpy as np
+    from hvsrpy.processing import nextpow2
+    from hvsrpy.smoothing import konno_and_ohmachi
+    from mhvsr_logic import SmoothingOperatorCache, build_konno_ohmachi_operator
+    from mhvsr_logic import get_default_processing_settings
+
+    # hvsrpy splits windows with a shared boundary sample and pads the FFT to at least 2**15.
+    nfft = nextpow2(int(window_length * sampling_rate) + 1)
+    frequencies = np.fft.rfftfreq(nfft, 1 / sampling_rate)
+    smoothing = get_default_processing_settings(bandwidth=bandwidth).smoothing
+    fcs = np.array(smoothing["center_frequencies_in_hz"], dtype=float)
+    # Horizontal and vertical spectra are smoothed together, as in combine_component_spectra.
+    rng = np.random.default_rng(0)
+    spectra = np.abs(rng.normal(size=(2 * windows, frequencies.size)))
+
+    konno_and_ohmachi(frequencies, spectra[:1], fcs, bandwidth)  # JIT warm-up
+    hvsrpy_time, expected = best_of(lambda: konno_and_ohmachi(frequencies, spectra, fcs, bandwidth), repeats)
+
+    build_time, operator = best_of(lambda: build_konno_ohmachi_operator(frequencies, fcs, bandwidth), repeats)
+    cache = SmoothingOperatorCache()
+    cache.get(frequencies, fcs, bandwidth)
+    apply_time, smoothed = best_of(
+        lambda: np.asarray((cache.get(frequencies, fcs, bandwidth) @ spectra.T).T), repeats)
+
+    print(f"{windows} windows of {window_length} s at {sampling_rate:g} Hz: "
+          f"{frequencies.size} frequencies, {fcs.size} center frequencies, {operator.nnz} operator weights")
+    print(f"  hvsrpy konno_and_ohmachi:   {hvsrpy_time * 1000:8.1f} ms")
+    print(f"  sparse operator (build):    {build_time * 1000:8.1f} ms, once per frequency grid")
+    print(f"  sparse operator (cached):   {apply_time * 1000:8.1f} ms "
+          f"({hvsrpy_time / apply_time:.1f}x)")
+    print(f"  max relative difference:    {np.max(np.abs(smoothed - expected) / np.abs(expected)):.2e}")
+
+
+def bench_store(project_path, repeats=3):
+    """
+    Compares reading a Multifetch project's records with hvsrpy.read against the memory-mapped
+    project store, building the store first if needed.
+    """
+    import hvsrpy
+    from mhvsr_logic import group_project_files
+    from project_store import ProjectStore
+
+    station_files = group_project_files(project_path)
+    file_paths = [path for paths in station_files.values() for path in paths]
+    if not file_paths:
+        print(f"No Multifetch miniSEED files found in {project_path}")
+        return
+    store = ProjectStore(project_path)
+    build_start = time.perf_counter()
+    added = store.add_project(station_files)
+    build_time = time.perf_counter() - build_start
+
+    mseed_time, _ = best_of(lambda: hvsrpy.read(file_paths), repeats)
+    store_time, records = best_of(lambda: store.read(file_paths), repeats)
+    samples = sum(record.vt.n_samples for record in records)
+
+    print(f"{len(file_paths)} files, {len(station_files)} stations, {samples} samples per component in total")
+    print(f"  store build:                {build_time * 1000:8.1f} ms ({added} files added)")
+    print(f"  hvsrpy.read (miniSEED):     {mseed_time * 1000:8.1f} ms")
+    print(f"  project store (mmap):       {store_time * 1000:8.1f} ms ({mseed_time / store_time:.1f}x)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ShakeFetch performance benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    smoothing_parser = subparsers.add_parser("smoothing", help="Konno and Ohmachi smoothing of MHVSR windows.")
+    smoothing_parser.add_argument("--windows", type=int, default=48)
+    smoothing_parser.add_argument("--window-length", type=int, default=150)
+    smoothing_parser.add_argument("--sampling-rate", type=float, default=100.0)
+    smoothing_parser.add_argument("--bandwidth", type=int, default=40)
+    smoothing_parser.add_argument("--repeats", type=int, default=3)
+    smoothing_parser.set_defaults(func=lambda args: bench_smoothing(
+        args.windows, args.window_length, args.sampling_rate, args.bandwidth, args.repeats))
+
+    store_parser = subparsers.add_parser("store", help="Record reload from miniSEED versus the project store.")
+    store_parser.add_argument("project_path", help="Directory holding a Multifetch project's miniSEED files")
+    store_parser.add_argument("--repeats", type=int, default=3)
+    store_parser.set_defaults(func=lambda args: bench_store(args.project_path, args.repeats))
+
+    suite_parser = subparsers.add_parser("suite", help="Fetch, Multifetch and MHVSR against a synthetic wave server.")
+    add_link_arguments(suite_parser)
+    suite_parser.add_argument("--stations", type=int, default=8, help="Multifetch and MHVSR windows.")
+    suite_parser.add_argument("--window-minutes", type=int, default=30)
+    suite_parser.add_argument("--fetch-minutes", type=int, default=60, help="Length of the single fetch window.")
+    suite_parser.add_argument("--parallel", type=int, default=4, help="Multifetch parallel fetches per host.")
+    suite_parser.add_argument("--repeats", type=int, default=3)
+    suite_parser.add_argument("--no-memory", action="store_true", help="Skip the traced peak memory runs.")
+    suite_parser.add_argument("--skip", nargs="*", default=[], choices=["fetch", "multifetch", "mhvsr"])
+    suite_parser.add_argument("--work-dir", default=None, help="Where temporary projects are written.")
+    suite_parser.add_argument("-o", "--output", default=None, help="JSON results file.")
+    suite_parser.set_defaults(func=cmd_suite)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two suite results files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    project_parser = subparsers.add_parser("project", help="Write a synthetic Multifetch project.")
+    project_parser.add_argument("--project-name", default="Synthetic")
+    project_parser.add_argument("--project-dir", default=".")
+    project_parser.add_argument("--stations", type=int, default=8)
+    project_parser.add_argument("--window-minutes", type=int, default=30)
+    project_parser.set_defaults(func=cmd_project)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the synthetic wave server for the GUI or CLI.")
+    add_link_arguments(serve_parser)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=16032)
+    serve_parser.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Headless command-line entry point for ShakeFetch.
+
+Runs single fetches, Multifetch-style batches from a schedule file and MHVSR analysis
+without Tk. Each subcommand imports only the modules it needs, so e.g. a cron fetch
+never pays for hvsrpy.
+
+    python cli.py fetch --start 2024-01-01T00:00:00 --end 2024-01-01T01:00:00 -o out.mseed
+    python cli.py multifetch --schedule windows.csv --project-name Survey --project-dir data
+    python cli.py continuous --output-dir data/continuous --rotate hour
+    python cli.py mhvsr data/Survey/*.mseed -o results.csv
+    python cli.py --metrics run.prom --profile multifetch ...
+"""
+import argparse
+import logging
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CONNECTION = {
+    "host": "rs.local", "port": 16032,
+    "net": "AM", "sta": "R1E3F", "loc": "00", "cha": "EH*",
+}
+
+
+def add_connection_arguments(parser):
+    parser.add_argument("--host", default=DEFAULT_CONNECTION["host"])
+    parser.add_argument("--port", type=int, default=DEFAULT_CONNECTION["port"])
+    parser.add_argument("--net", default=DEFAULT_CONNECTION["net"])
+    parser.add_argument("--sta", default=DEFAULT_CONNECTION["sta"])
+    parser.add_argument("--loc", default=DEFAULT_CONNECTION["loc"])
+    parser.add_argument("--cha", default=DEFAULT_CONNECTION["cha"])
+    parser.add_argument("--chunk-minutes", type=int, default=None,
+                        help="Stream each window to disk in chunks of this many minutes.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Use a local waveform cache in this directory.")
+
+
+def connection_params(args):
+    return {"host": args.host, "port": args.port, "net": args.net,
+            "sta": args.sta, "loc": args.loc, "cha": args.cha}
+
+
+def open_cache(args):
+    if not args.cache_dir:
+        return None
+    from waveform_cache import WaveformCache
+    return WaveformCache(args.cache_dir)
+
+
+def load_schedule(path, base_params):
+    """
+    Reads station windows from a CSV or JSON schedule file into Multifetch params.
+
+    See station_schedule.load_schedule for the file format. Duplicate and overlapping
+    windows are reported on stderr; inverted windows and repeated station numbers raise
+    ValueError.
+    """
+    from station_schedule import load_schedule as read_schedule
+
+    schedule = read_schedule(path)
+    report = schedule.validate(base_params)
+    for line in report.lines():
+        print(line, file=sys.stderr)
+    if not report.ok:
+        raise ValueError(f"Schedule {path} has windows that end before they start or repeat a station number "
+                         f"({report.summary()})")
+    return schedule.all_params(base_params)
+
+
+def fetch_from_archive(args, params):
+    import getpass
+    from time_sync import ShakeCommunicator
+    from sftp_archive import ArchiveFetcher
+
+    password = os.environ.get("SHAKE_SSH_PASSWORD") or getpass.getpass(f"SSH password for {args.ssh_user}@{args.host}: ")
+    shake = ShakeCommunicator(args.host, args.ssh_user, password)
+    result = shake.connect()
+    if "successful" not in result:
+        raise ConnectionError(result)
+    try:
+        fetcher = ArchiveFetcher.from_communicator(shake, max_transfers=args.parallel)
+        summary = fetcher.fetch_to_file(params, args.output)
+        logging.info(f"Archive transfer stats: {fetcher.stats}")
+        return summary
+    finally:
+        shake.disconnect()
+
+
+def cmd_fetch(args):
+    from obspy import UTCDateTime
+    from data_acquisition import fetch_waveforms, fetch_waveforms_to_file
+    from gap_refill import GapRefiller
+
+    params = connection_params(args)
+    params["start_time"] = UTCDateTime(args.start)
+    params["end_time"] = UTCDateTime(args.end)
+    cache = open_cache(args)
+    refiller = GapRefiller(max_attempts=args.refill_attempts)
+
+    if args.archive:
+        summary = fetch_from_archive(args, params)
+        print(f"Wrote {summary['traces']} traces from the Shake archive to {args.output}")
+    elif args.chunk_minutes:
+        summary = fetch_waveforms_to_file(params, args.output, chunk_seconds=args.chunk_minutes * 60, cache=cache,
+                                          refiller=refiller)
+        print(f"Streamed {summary['traces']} traces in {summary['chunks']} chunks to {args.output}, "
+              f"{100 * summary['completeness']:.1f}% complete")
+    else:
+        stream, report = refiller.refill(params, fetch_waveforms(params, cache=cache),
+                                         lambda gap_params: fetch_waveforms(gap_params, cache=cache))
+        print(stream)
+        print(report.summary())
+        stream.write(args.output, format="MSEED")
+        print(f"Stream saved to {args.output}")
+    return 0
+
+
+def cmd_multifetch(args):
+    from fetch_scheduler import run_project_fetch
+    from gap_refill import GapRefiller
+
+    all_params = load_schedule(args.schedule, connection_params(args))
+    project_path = os.path.join(args.project_dir, args.project_name)
+    print(f"Starting multifetch for project: {args.project_name} ({len(all_params)} windows)")
+
+    def log(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    chunk_seconds = args.chunk_minutes * 60 if args.chunk_minutes else None
+    store = None
+    if args.store:
+        from project_store import ProjectStore
+        store = ProjectStore(project_path)
+    stats, manifest = run_project_fetch(args.project_name, project_path, all_params, log,
+                                        max_per_host=args.parallel, chunk_seconds=chunk_seconds,
+                                        cache=open_cache(args), store=store,
+                                        refiller=GapRefiller(max_attempts=args.refill_attempts))
+    print(f"\n--- Multifetch complete! ---\n{stats.summary()}")
+    print("Manifest: " + ", ".join(f"{count} {status}" for status, count in sorted(manifest.summary().items())))
+    return 0 if stats.windows_failed == 0 else 1
+
+
+def cmd_continuous(args):
+    import time
+    from continuous_acquisition import ContinuousAcquisition, AcquisitionStats
+
+    def on_update(snapshot):
+        print(AcquisitionStats.format(snapshot), flush=True)
+
+    def on_error(e):
+        print(f"Poll failed: {e}", file=sys.stderr, flush=True)
+
+    acquisition = ContinuousAcquisition(connection_params(args), args.output_dir, rotation=args.rotate,
+                                        poll_interval=args.poll_interval, on_update=on_update, on_error=on_error)
+    print(f"Continuous acquisition into {args.output_dir}, one file per {args.rotate}. Press Ctrl+C to stop.")
+    acquisition.start()
+    try:
+        while acquisition.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.stop()
+    print(AcquisitionStats.format(acquisition.stats.snapshot()))
+    return 0
+
+
+def cmd_mhvsr(args):
+    import hvsrpy
+    from mhvsr_logic import process_mhvsr, get_default_preprocessing_settings, get_default_processing_settings
+
+    preprocessing_settings = get_default_preprocessing_settings(window_length=args.window_length)
+    processing_settings = get_default_processing_settings(bandwidth=args.bandwidth, combine_method=args.combine)
+
+    from project_store import open_store_for
+    file_paths = [list(args.files)]
+    hvsr = process_mhvsr(file_paths, preprocessing_settings, processing_settings, store=open_store_for(file_paths))
+    hvsr.update_peaks_bounded(search_range_in_hz=(None, None))
+    print(f"Valid windows: {int(hvsr.valid_window_boolean_mask.sum())} of {len(hvsr.valid_window_boolean_mask)}")
+    print(f"Peak frequency (lognormal median): {hvsr.mean_fn_frequency(distribution='lognormal'):.3f} Hz "
+          f"(lognormal std {hvsr.std_fn_frequency(distribution='lognormal'):.3f})")
+    print(f"Peak amplitude (lognormal median): {hvsr.mean_fn_amplitude(distribution='lognormal'):.3f} "
+          f"(lognormal std {hvsr.std_fn_amplitude(distribution='lognormal'):.3f})")
+    if args.output:
+        hvsrpy.object_io.write_hvsr_object_to_file(hvsr, args.output)
+        print(f"Results saved to {args.output}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="shakefetch", description="Headless ShakeFetch acquisition and processing.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log progress to stderr.")
+    parser.add_argument("--metrics", default=None,
+                        help="Write per-stage timings to this file when done (.prom for Prometheus text, else JSON).")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run the command under cProfile and save the profile in logs/profiles.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Fetch one waveform window to a miniSEED file.")
+    add_connection_arguments(fetch_parser)
+    fetch_parser.add_argument("--start", required=True, help="Start time (UTC), e.g. 2024-01-01T00:00:00")
+    fetch_parser.add_argument("--end", required=True, help="End time (UTC)")
+    fetch_parser.add_argument("-o", "--output", required=True, help="Output miniSEED file")
+    fetch_parser.add_argument("--archive", action="store_true",
+                              help="Read the Shake's on-device archive over SFTP instead of the wave server.")
+    fetch_parser.add_argument("--ssh-user", default="myshake",
+                              help="SSH user for --archive; the password is read from SHAKE_SSH_PASSWORD or prompted for.")
+    fetch_parser.add_argument("--parallel", type=int, default=4, help="Parallel SFTP transfers for --archive")
+    fetch_parser.add_argument("--refill-attempts", type=int, default=3,
+                              help="Rounds of refetching the window's gaps (0 only reports them).")
+    fetch_parser.set_defaults(func=cmd_fetch)
+
+    mf_parser = subparsers.add_parser("multifetch", help="Fetch every window of a schedule file into a project.")
+    add_connection_arguments(mf_parser)
+    mf_parser.add_argument("--schedule", required=True, help="CSV or JSON schedule of station windows")
+    mf_parser.add_argument("--project-name", required=True)
+    mf_parser.add_argument("--project-dir", required=True)
+    mf_parser.add_argument("--parallel", type=int, default=4, help="Parallel fetches per host")
+    mf_parser.add_argument("--store", action="store_true",
+                           help="Also keep decoded samples in a memory-mapped project store.")
+    mf_parser.add_argument("--refill-attempts", type=int, default=3,
+                           help="Rounds of refetching each window's gaps (0 only reports them).")
+    mf_parser.set_defaults(func=cmd_multifetch)
+
+    cont_parser = subparsers.add_parser("continuous", help="Poll the wave server and append to rolling miniSEED files.")
+    add_connection_arguments(cont_parser)
+    cont_parser.add_argument("--output-dir", required=True)
+    cont_parser.add_argument("--rotate", default="day", choices=["hour", "day"], help="Start a new file every hour or day")
+    cont_parser.add_argument("--poll-interval", type=float, default=10.0, help="Seconds between polls")
+    cont_parser.set_defaults(func=cmd_continuous)
+
+    mhvsr_parser = subparsers.add_parser("mhvsr", help="Run MHVSR analysis on miniSEED files.")
+    mhvsr_parser.add_argument("files", nargs="+")
+    mhvsr_parser.add_argument("--window-length", type=int, default=150)
+    mhvsr_parser.add_argument("--bandwidth", type=int, default=40)
+    mhvsr_parser.add_argument("--combine", default="geometric_mean",
+                              choices=["geometric_mean", "squared_average", "azimuth", "single_azimuth"])
+    mhvsr_parser.add_argument("-o", "--output", help="Save results to this CSV file")
+    mhvsr_parser.set_defaults(func=cmd_mhvsr)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        if args.profile:
+            from metrics import profile_call
+            return profile_call(args.func, args, name=args.command)
+        return args.func(args)
+    except Exception as e:
+        logging.error(f"{args.command} failed: {e}", exc_info=args.verbose)
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.metrics:
+            from metrics import get_metrics
+            get_metrics().write(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from obspy import Stream, UTCDateTime
+from data_acquisition import fetch_waveforms
+
+DEFAULT_POLL_INTERVAL = 10.0
+DEFAULT_LATENCY = 5.0
+DEFAULT_MAX_REQUEST_SECONDS = 600.0
+DEFAULT_LATE_TOLERANCE = 60.0
+RATE_POLLS = 30
+
+ROTATIONS = {"hour": (3600, "%Y%m%dT%H"), "day": (86400, "%Y%m%d")}
+
+
+class RollingMiniSeedWriter:
+    """
+    Appends streams to miniSEED files that rotate every hour or day.
+
+    Files are named NET.STA.LOC.<period>.mseed in output_dir and hold every channel of the
+    period. Traces that cross a period boundary are split between the two files. Only the
+    current period's file is kept open.
+    """
+    def __init__(self, output_dir, net, sta, loc, rotation="day", reclen=512):
+        if rotation not in ROTATIONS:
+            raise ValueError(f"rotation must be one of {', '.join(ROTATIONS)}")
+        self.output_dir = output_dir
+        self.prefix = f"{net}.{sta}.{loc}"
+        self.period_seconds, self.label_format = ROTATIONS[rotation]
+        # Polls deliver a few seconds at a time, so small records waste less of each write.
+        self.reclen = reclen
+        self.period = None
+        self.file = None
+        self.path = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def period_start(self, timestamp):
+        """Returns the POSIX time the period holding timestamp starts at, as a float for use as a key."""
+        return float(timestamp) // self.period_seconds * self.period_seconds
+
+    def path_for(self, period):
+        label = UTCDateTime(period).strftime(self.label_format)
+        return os.path.join(self.output_dir, f"{self.prefix}.{label}.mseed")
+
+    def _open(self, period):
+        if period == self.period:
+            return
+        self.close()
+        self.period = period
+        self.path = self.path_for(period)
+        self.file = open(self.path, "ab")
+        logging.info(f"Continuous acquisition writing to {self.path}")
+
+    def write(self, stream):
+        """Appends a stream, splitting it at period boundaries. Returns the number of bytes written."""
+        pieces = {}
+        for trace in stream:
+            start = trace.stats.starttime
+            while start <= trace.stats.endtime:
+                period = self.period_start(start)
+                boundary = UTCDateTime(period + self.period_seconds)
+                piece = trace.slice(start, boundary - trace.stats.delta / 2, nearest_sample=False)
+                if piece.stats.npts:
+                    pieces.setdefault(period, Stream()).append(piece)
+                start = boundary
+
+        written = 0
+        for period in sorted(pieces):
+            self._open(period)
+            before = self.file.tell()
+            # miniSEED records are self-contained, so appending record by record is a valid file.
+            pieces[period].write(self.file, format="MSEED", reclen=self.reclen)
+            self.file.flush()
+            written += self.file.tell() - before
+        return written
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.period = None
+
+
+class AcquisitionStats:
+    """
+    Counters for a continuous acquisition run.
+
+    Samples per second is averaged over the last RATE_POLLS polls, so the counters use the
+    same memory on day five as on day one.
+    """
+    def __init__(self):
+        self.polls = 0
+        self.failed_polls = 0
+        self.samples = 0
+        self.bytes = 0
+        self.gaps = 0
+        self.gap_seconds = 0.0
+        self.last_sample_time = None
+        self.last_poll_seconds = 0.0
+        self._recent = deque(maxlen=RATE_POLLS)
+        self._lock = threading.Lock()
+
+    def record_poll(self, samples, nbytes, elapsed, last_sample_time):
+        with self._lock:
+            self.polls += 1
+            self.samples += samples
+            self.bytes += nbytes
+            self.last_poll_seconds = elapsed
+            if last_sample_time is not None:
+                self.last_sample_time = last_sample_time
+            self._recent.append((time.monotonic(), samples))
+
+    def record_gap(self, seconds):
+        with self._lock:
+            self.gaps += 1
+            self.gap_seconds += seconds
+
+    def record_failure(self):
+        with self._lock:
+            self.failed_polls += 1
+
+    def samples_per_second(self):
+        with self._lock:
+            if len(self._recent) < 2:
+                return 0.0
+            elapsed = self._recent[-1][0] - self._recent[0][0]
+            # The first poll's samples arrived before the measured interval started.
+            samples = sum(count for _, count in self._recent) - self._recent[0][1]
+        return samples / elapsed if elapsed > 0 else 0.0
+
+    def lag(self, now=None):
+        """Returns how many seconds the last received sample is behind real time."""
+        if self.last_sample_time is None:
+            return None
+        return (now or UTCDateTime()) - self.last_sample_time
+
+    def snapshot(self):
+        """Returns a copy of the counters that is safe to hand to another thread."""
+        lag = self.lag()
+        rate = self.samples_per_second()
+        with self._lock:
+            return {
+                "polls": self.polls,
+                "failed_polls": self.failed_polls,
+                "samples": self.samples,
+                "bytes": self.bytes,
+                "gaps": self.gaps,
+                "gap_seconds": self.gap_seconds,
+                "samples_per_second": rate,
+                "lag": lag,
+                "last_poll_seconds": self.last_poll_seconds,
+            }
+
+    @staticmethod
+    def format(snapshot):
+        """Returns a one-line human readable status for a snapshot."""
+        lag = f"{snapshot['lag']:.1f} s" if snapshot["lag"] is not None else "n/a"
+        return (f"{snapshot['samples_per_second']:.1f} samples/s, {snapshot['samples']} samples, "
+                f"{snapshot['bytes'] / 1e6:.2f} MB, {snapshot['gaps']} gaps ({snapshot['gap_seconds']:.1f} s), "
+                f"lag {lag}, last poll {snapshot['last_poll_seconds'] * 1000:.0f} ms")
+
+
+class ContinuousAcquisition:
+    """
+    Polls a wave server and appends the data received since the last poll to rolling miniSEED files.
+
+    Each poll asks only for data after the last sample received, at most max_request_seconds
+    at a time, so a poll costs the same however long the run has been going. Data that has not
+    arrived within late_tolerance seconds is given up on and counted as a gap once later data
+    arrives. on_update(snapshot) is called from the acquisition thread after each poll and
+    on_error(exception) when a poll fails; polling carries on after errors.
+    """
+    def __init__(self, params, output_dir, rotation="day", on_update=None, on_error=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, latency=DEFAULT_LATENCY,
+                 max_request_seconds=DEFAULT_MAX_REQUEST_SECONDS, late_tolerance=DEFAULT_LATE_TOLERANCE, pool=None):
+        self.params = dict(params)
+        self.writer = RollingMiniSeedWriter(output_dir, params["net"], params["sta"], params["loc"], rotation)
+        self.on_update = on_update
+        self.on_error = on_error
+        self.poll_interval = poll_interval
+        self.latency = latency
+        self.max_request_seconds = max_request_seconds
+        self.late_tolerance = late_tolerance
+        self.pool = pool
+        self.stats = AcquisitionStats()
+        self.cursor = None
+        self.next_sample = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, start_time=None):
+        """Starts polling in a background thread, from now unless start_time is given."""
+        self.cursor = start_time or UTCDateTime() - self.latency
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="continuous-acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        if not self.running:
+            self.writer.close()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.stats.record_failure()
+                    logging.error(f"Continuous acquisition poll failed: {e}")
+                    if self.on_error:
+                        self.on_error(e)
+                    # A failing poll does not move the cursor, so never retry it in a tight loop.
+                    self._stop.wait(self.poll_interval)
+                    continue
+                # Poll again straight away while catching up on a backlog.
+                behind = UTCDateTime() - self.latency - self.cursor > self.max_request_seconds
+                self._stop.wait(0 if behind else self.poll_interval)
+        finally:
+            self.writer.close()
+
+    def _new_data(self, stream):
+        """Drops samples already written and counts gaps, per channel."""
+        new = Stream()
+        for trace in sorted(stream.split(), key=lambda trace: (trace.id, trace.stats.starttime)):
+            expected = self.next_sample.get(trace.id)
+            if expected is not None:
+                if trace.stats.endtime < expected - trace.stats.delta / 2:
+                    continue
+                trace = trace.slice(expected - trace.stats.delta / 2, nearest_sample=False)
+                if not trace.stats.npts:
+                    continue
+                missing = trace.stats.starttime - expected
+                if missing > trace.stats.delta * 1.5:
+                    self.stats.record_gap(missing)
+            self.next_sample[trace.id] = trace.stats.endtime + trace.stats.delta
+            new.append(trace)
+        return new
+
+    def poll(self, now=None):
+        """
+        Fetches and writes the data received since the last poll.
+
+        Returns the number of new samples written.
+        """
+        start = time.perf_counter()
+        end = min((now or UTCDateTime()) - self.latency, self.cursor + self.max_request_seconds)
+        if end <= self.cursor:
+            return 0
+        stream = fetch_waveforms(dict(self.params, start_time=self.cursor, end_time=end), pool=self.pool)
+        stream = self._new_data(stream)
+        nbytes = self.writer.write(stream) if len(stream) else 0
+        samples = sum(trace.stats.npts for trace in stream)
+
+        # Resume after the channel that is furthest behind, but stop waiting for data that is
+        # late by more than late_tolerance.
+        oldest = min(self.next_sample.values()) if self.next_sample else self.cursor
+        self.cursor = max(self.cursor, end - self.late_tolerance, oldest)
+        last_sample_time = max(trace.stats.endtime for trace in stream) if len(stream) else None
+        self.stats.record_poll(samples, nbytes, time.perf_counter() - start, last_sample_time)
+        if self.on_update:
+            self.on_update(self.stats.snapshot())
+        return samples
@@ -1,21 +1,376 @@
-from obspy.clients.earthworm import Client
-from obspy import UTCDateTime
-
-def fetch_waveforms(params):
-    """
-    Fetches seismic waveforms using an Earthworm client.
-    """
-    client = Client(params['host'], params['port'])
-    stream = client.get_waveforms(
-        params['net'],
-        params['sta'],
-        params['loc'],
-        params['cha'],
-        params['start_time'],
-        params['end_time']
-    )
+import fnmatch
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from obspy.clients.earthworm.waveserver import DATATYPE_KEY, TraceBuf2, get_sock_char_line, get_sock_bytes
+from obspy import Stream
+from metrics import get_metrics, stage
+from task_executor import current_task, held, raise_if_cancelled, report_progress, run_in_task
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_CHUNK_SECONDS = 3600
+
+
+class WaveServerConnection:
+    """
+    A persistent socket to an Earthworm wave server.
+
+    Speaks the same GETSCNLRAW protocol as obspy's Client, but keeps the socket
+    open between requests instead of reconnecting for every channel and window.
+    """
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.reconnects = 0
+
+    def connect(self):
+        self.close()
+        with stage("connect"):
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def abort(self):
+        """Unblocks a read in progress on another thread; the connection cannot be used again."""
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def is_alive(self):
+        """Checks whether the server has closed the socket since it was last used."""
+        if self.sock is None:
+            return False
+        try:
+            self.sock.setblocking(False)
+            try:
+                self.sock.recv(1, socket.MSG_PEEK)
+            finally:
+                self.sock.settimeout(self.timeout)
+            # Nothing should be readable between requests: either the server hung up
+            # (empty read) or the stream is out of sync, and neither is reusable.
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _request(self, request, *args):
+        """Sends one request, reconnecting once if the socket died underneath us."""
+        try:
+            return request(*args)
+        except (ConnectionError, OSError):
+            # A cancelled task aborted the socket; don't reconnect behind its back.
+            raise_if_cancelled()
+            self.reconnects += 1
+            self.connect()
+            return request(*args)
+
+    def _request_tracebufs(self, scnl, start, end):
+        return self._request(self._request_tracebufs_once, scnl, start, end)
+
+    def _request_menu_once(self):
+        self.sock.sendall(b'MENU: rwserv SCNL\n')
+        reply = get_sock_char_line(self.sock, timeout=self.timeout)
+        if not reply:
+            raise ConnectionError(f"No reply from wave server {self.host}:{self.port}")
+        tokens = reply.decode().split()[1:]
+        if len(tokens) < 7:
+            return []
+        # Servers leave out the location code of SCN tanks.
+        size = 8 if len(tokens) >= 8 and tokens[7].encode() in DATATYPE_KEY else 7
+        menu = []
+        for p in range(0, len(tokens) - size + 1, size):
+            entry = tokens[p:p + size]
+            station, channel, network = entry[1:4]
+            location = entry[4] if size == 8 else '--'
+            menu.append((network, station, '' if location == '--' else location, channel,
+                         float(entry[size - 3]), float(entry[size - 2])))
+        return menu
+
+    def get_menu(self):
+        """
+        Returns the server's tanks as (network, station, location, channel, start, end) tuples,
+        start and end being the POSIX times of the data each tank holds.
+        """
+        return self._request(self._request_menu_once)
+
+    def _request_tracebufs_once(self, scnl, start, end):
+        request = 'GETSCNLRAW: rwserv %s %s %s %s %f %f\n' % (scnl + (start, end))
+        self.sock.sendall(request.encode('ascii', 'strict'))
+        header = get_sock_char_line(self.sock, timeout=self.timeout)
+        if not header:
+            raise ConnectionError(f"No reply from wave server {self.host}:{self.port}")
+        tokens = header.decode().split()
+        if tokens[6] != 'F':
+            # No data for this channel/window; the connection is still usable.
+            return []
+        nbytes = int(tokens[-1])
+        data = get_sock_bytes(self.sock, nbytes, timeout=self.timeout)
+        if data is None or len(data) < nbytes:
+            raise ConnectionError(f"Short read from wave server {self.host}:{self.port}")
+        get_metrics().add("fetch", nbytes=len(header) + nbytes)
+
+        tracebufs = []
+        p = 0
+        while p < len(data):
+            tracebuf = TraceBuf2()
+            bytes_read = tracebuf.read_tb2(data[p:])
+            if not bytes_read:
+                break
+            tracebufs.append(tracebuf)
+            p += bytes_read
+        return tracebufs
+
+    def get_waveforms(self, network, station, location, channel, starttime, endtime, cleanup=True):
+        """
+        Retrieves waveforms with the same semantics as obspy's Earthworm Client.get_waveforms.
+        """
+        if channel[-1] in "?*":
+            stream = Stream()
+            for comp in ("Z", "N", "E"):
+                stream += self.get_waveforms(network, station, location, channel[:-1] + comp,
+                                             starttime, endtime, cleanup=cleanup)
+            return stream
+        if location == '':
+            location = '--'
+        scnl = (station, channel, network, location)
+        tracebufs = self._request_tracebufs(scnl, float(starttime), float(endtime))
+        stream = Stream([tb.get_obspy_trace() for tb in tracebufs])
+        if cleanup:
+            stream._cleanup()
+        stream.trim(starttime, endtime)
+        return stream
+
+
+class ConnectionPool:
+    """
+    Keeps idle wave server connections per (host, port) for reuse across fetches.
+    """
+    def __init__(self, max_idle_per_host=8, timeout=DEFAULT_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def acquire(self, host, port):
+        """Returns a live connection, reusing an idle one when possible."""
+        while True:
+            with self._lock:
+                idle = self._idle.get((host, port))
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            if conn.is_alive():
+                with self._lock:
+                    self.hits += 1
+                return conn
+            conn.close()
+        with self._lock:
+            self.misses += 1
+        conn = WaveServerConnection(host, port, timeout=self.timeout)
+        conn.connect()
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault((conn.host, conn.port), [])
+            if conn.sock is not None and len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _call(self, host, port, method, *args, **kwargs):
+        conn = self.acquire(host, port)
+        reconnects_before = conn.reconnects
+        try:
+            # Cancelling the task shuts the socket down, so a hung read returns at once.
+            with held(conn.abort):
+                return getattr(conn, method)(*args, **kwargs)
+        except Exception:
+            conn.close()
+            raise_if_cancelled()
+            raise
+        finally:
+            with self._lock:
+                self.reconnects += conn.reconnects - reconnects_before
+            self.release(conn)
+
+    def get_waveforms(self, host, port, *args, **kwargs):
+        """
+        Fetches through a pooled connection and returns the connection to the pool.
+        """
+        return self._call(host, port, "get_waveforms", *args, **kwargs)
+
+    def get_menu(self, host, port):
+        """Returns the tanks of a wave server through a pooled connection, as WaveServerConnection.get_menu."""
+        return self._call(host, port, "get_menu")
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def stats(self):
+        """Returns the pool hit/miss counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconnects": self.reconnects,
+                "idle": sum(len(conns) for conns in self._idle.values()),
+            }
+
+
+_pool = ConnectionPool()
+
+
+def get_connection_pool():
+    """
+    Returns the process-wide connection pool shared by Single Fetch and Multifetch.
+    """
+    return _pool
+
+
+def fetch_waveforms(params, pool=None, cache=None):
+    """
+    Fetches seismic waveforms from an Earthworm wave server over a pooled connection.
+
+    If a WaveformCache is given, only the parts of the window it does not hold are
+    requested from the server.
+    """
+    if cache is not None:
+        return cache.fetch(params, lambda gap_params: fetch_waveforms(gap_params, pool=pool),
+                           lambda channel_params: list_channels(channel_params, pool=pool))
+    pool = pool or _pool
+    with stage("fetch") as timer:
+        stream = pool.get_waveforms(
+            params['host'],
+            params['port'],
+            params['net'],
+            params['sta'],
+            params['loc'],
+            params['cha'],
+            params['start_time'],
+            params['end_time']
+        )
+        timer.items = sum(trace.stats.npts for trace in stream)
     return stream
-    '''client = Client('IRIS')
-    T = UTCDateTime("2020-01-01T00:00:00")
-    stream = client.get_waveforms("IU", "ANMO", "00", "B HZ", T, T + 60)
-    return stream'''
+
+
+def list_channels(params, pool=None):
+    """
+    Returns the sorted channel codes the wave server holds for params' station that match
+    params['cha'], which may end in a ? or * wildcard.
+    """
+    pool = pool or _pool
+    menu = pool.get_menu(params['host'], params['port'])
+    location = '' if params['loc'] == '--' else params['loc']
+    return sorted({channel for network, station, loc, channel, _, _ in menu
+                   if (network, station, loc) == (params['net'], params['sta'], location)
+                   and fnmatch.fnmatchcase(channel, params['cha'])})
+
+
+def split_time_window(start_time, end_time, chunk_seconds):
+    """
+    Splits [start_time, end_time] into consecutive (start, end) chunks of at most chunk_seconds.
+    """
+    if chunk_seconds <= 0:
+        raise ValueError("chunk_seconds must be positive")
+    chunks = []
+    chunk_start = start_time
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + chunk_seconds, end_time)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def _fetch_chunk(params, chunk_start, chunk_end, is_last, pool, cache, refiller):
+    chunk_params = dict(params, start_time=chunk_start, end_time=chunk_end)
+    stream = fetch_waveforms(chunk_params, pool=pool, cache=cache)
+    report = None
+    if refiller is not None:
+        stream, report = refiller.refill(chunk_params, stream,
+                                         lambda gap_params: fetch_waveforms(gap_params, pool=pool, cache=cache))
+    if not is_last:
+        # Trimming is inclusive at both ends, so drop the sample on the shared
+        # boundary; the next chunk starts with it.
+        for trace in stream:
+            trace.trim(endtime=chunk_end - trace.stats.delta / 2, nearest_sample=False)
+        stream.traces = [trace for trace in stream if trace.stats.npts > 0]
+    return stream, report
+
+
+def fetch_waveforms_to_file(params, output_file, chunk_seconds=DEFAULT_CHUNK_SECONDS, max_workers=1,
+                            progress_callback=None, pool=None, cache=None, refiller=None):
+    """
+    Fetches a long window in fixed-size time chunks and appends each chunk to a miniSEED file.
+
+    Chunks are written in time order as they arrive, and at most max_workers chunks
+    are held in memory at once, so peak memory does not grow with the window length.
+    progress_callback(chunk_index, chunk_count, stream) is called after each chunk is written,
+    and the progress is also reported to the current task. If a GapRefiller is given, each
+    chunk's gaps are refilled before it is written, and the summary also holds the window's
+    completeness (0 to 1) and the channel-seconds still missing.
+    Returns a summary dict with the chunk, trace and byte counts.
+    """
+    task = current_task()
+    chunks = split_time_window(params['start_time'], params['end_time'], chunk_seconds)
+    summary = {"chunks": len(chunks), "traces": 0, "bytes": 0}
+    covered_seconds = 0.0
+    if refiller is not None:
+        summary["missing_seconds"] = 0.0
+    pending = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor, open(output_file, "wb") as f:
+        next_chunk = 0
+        for index in range(len(chunks)):
+            while next_chunk < len(chunks) and len(pending) < max(1, max_workers):
+                chunk_start, chunk_end = chunks[next_chunk]
+                is_last = next_chunk == len(chunks) - 1
+                pending.append(executor.submit(run_in_task, task, _fetch_chunk, params, chunk_start, chunk_end,
+                                               is_last, pool, cache, refiller))
+                next_chunk += 1
+            try:
+                stream, report = pending.pop(0).result()
+                raise_if_cancelled()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+            if len(stream):
+                with stage("write") as timer:
+                    before = f.tell()
+                    # miniSEED records are self-contained, so appending record by record is a valid file.
+                    stream.write(f, format="MSEED")
+                    f.flush()
+                    timer.bytes = f.tell() - before
+                summary["traces"] += len(stream)
+            if report is not None:
+                covered_seconds += report.completeness * (report.end - report.start)
+                summary["missing_seconds"] += report.missing_seconds
+            report_progress((index + 1) / len(chunks), f"chunk {index + 1}/{len(chunks)}")
+            if progress_callback:
+                progress_callback(index + 1, len(chunks), stream)
+            del stream
+    summary["bytes"] = os.path.getsize(output_file)
+    if refiller is not None:
+        duration = float(params['end_time']) - float(params['start_time'])
+        summary["completeness"] = covered_seconds / duration if duration > 0 else 1.0
+    return summary
@@ -0,0 +1,203 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from obspy import read
+from data_acquisition import fetch_waveforms, fetch_waveforms_to_file
+from gap_refill import GapRefiller
+from metrics import stage
+from task_executor import current_task, report_progress, run_in_task
+from project_manifest import ProjectManifest, STATUS_COMPLETE, STATUS_PARTIAL, window_filename
+
+
+class FetchStats:
+    """
+    Aggregate counters for a batch of fetch jobs.
+    """
+    def __init__(self):
+        self.windows_ok = 0
+        self.windows_failed = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, nbytes=0):
+        with self._lock:
+            if ok:
+                self.windows_ok += 1
+                self.bytes += nbytes or 0
+            else:
+                self.windows_failed += 1
+
+    @property
+    def windows_per_second(self):
+        return self.windows_ok / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes / 1e6 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        """Returns a one-line human readable throughput summary."""
+        return (f"{self.windows_ok} windows fetched, {self.windows_failed} failed, "
+                f"{self.bytes / 1e6:.2f} MB in {self.elapsed:.1f} s "
+                f"({self.windows_per_second:.2f} windows/s, {self.megabytes_per_second:.2f} MB/s)")
+
+
+class FetchScheduler:
+    """
+    Runs fetch jobs concurrently with a bounded number of in-flight requests per host.
+
+    Each (host, port) pair gets its own worker pool of `max_per_host` threads so a
+    slow wave server cannot starve requests going to another one.
+    """
+    def __init__(self, max_per_host=4):
+        if max_per_host < 1:
+            raise ValueError("max_per_host must be at least 1")
+        self.max_per_host = max_per_host
+
+    def run(self, all_params, job, on_success=None, on_error=None):
+        """
+        Calls job(params) for every entry in all_params and blocks until all are done.
+
+        job should return the number of bytes it moved. on_success(params, nbytes) and
+        on_error(params, exception) are called from the calling thread as jobs finish.
+        Jobs run as part of the calling thread's task, so cancelling it stops them and
+        drops the jobs not yet started. Returns a FetchStats instance.
+        """
+        task = current_task()
+        stats = FetchStats()
+        executors = {}
+        futures = {}
+        start = time.perf_counter()
+        try:
+            for params in all_params:
+                key = (params['host'], params['port'])
+                if key not in executors:
+                    executors[key] = ThreadPoolExecutor(max_workers=self.max_per_host,
+                                                        thread_name_prefix=f"fetch-{params['host']}")
+                futures[executors[key].submit(run_in_task, task, job, params)] = params
+
+            for future in as_completed(futures):
+                params = futures[future]
+                try:
+                    nbytes = future.result()
+                except Exception as e:
+                    stats.record(False)
+                    if on_error:
+                        on_error(params, e)
+                else:
+                    stats.record(True, nbytes)
+                    if on_success:
+                        on_success(params, nbytes)
+        finally:
+            for executor in executors.values():
+                # Every job has finished unless the task was cancelled, so only cancelled runs drop any.
+                executor.shutdown(wait=True, cancel_futures=True)
+            stats.elapsed = time.perf_counter() - start
+        return stats
+
+
+def run_project_fetch(project_name, project_path, all_params, log, max_per_host=4, chunk_seconds=None, cache=None,
+                      store=None, refiller=None):
+    """
+    Fetches every window of a Multifetch project into project_path.
+
+    Windows the project manifest already records as complete are skipped. log(text) receives
+    per-station progress lines. If chunk_seconds is set, windows are streamed to disk in chunks.
+    If a ProjectStore is given, each saved window is also added to it.
+
+    Every window is checked for gaps and its missing stretches refetched by refiller (a
+    default GapRefiller if None) before it is written. The manifest records each window's
+    completeness, and windows that still have gaps are saved as partial. On the next run a
+    partial window's file is read back and only its gaps are fetched.
+    Returns the FetchStats of the run and the project manifest.
+    """
+    if refiller is None:
+        refiller = GapRefiller()
+    filenames = [window_filename(project_name, params) for params in all_params]
+    if len(set(filenames)) < len(filenames):
+        # Two jobs would write the same file and manifest entry at once.
+        repeated = sorted({name for name in filenames if filenames.count(name) > 1})
+        raise ValueError(f"Windows repeat a station number and time: {', '.join(repeated[:5])}")
+    os.makedirs(project_path, exist_ok=True)
+    manifest = ProjectManifest(project_path, project_name)
+    manifest.add_windows(all_params)
+
+    to_fetch = manifest.windows_to_fetch(all_params)
+    skipped = len(all_params) - len(to_fetch)
+    if skipped:
+        log(f"Skipping {skipped} windows already complete in the project manifest.\n")
+        if store is not None:
+            pending = {id(params) for params in to_fetch}
+            for params in all_params:
+                if id(params) not in pending:
+                    store.add_file(os.path.join(project_path, window_filename(project_name, params)),
+                                   params["station_num"], save=False)
+            store.save()
+
+    def fetch_station(params):
+        station_num = params["station_num"]
+        log(f"\n--- Fetching Station {station_num} ---\n")
+        was_partial = manifest.status(params) == STATUS_PARTIAL
+        manifest.mark_running(params)
+
+        filename = window_filename(project_name, params)
+        output_file = os.path.join(project_path, filename)
+
+        if chunk_seconds:
+            summary = fetch_waveforms_to_file(params, output_file, chunk_seconds=chunk_seconds, cache=cache,
+                                              refiller=refiller)
+            log(f"  Station {station_num}: streamed {summary['traces']} traces in {summary['chunks']} chunks to {filename}, "
+                f"{100 * summary['completeness']:.1f}% complete\n")
+            logging.info(f"Streamed station {station_num} to {output_file}")
+            coverage = {"completeness": round(100 * summary["completeness"], 3),
+                        "missing_seconds": round(summary["missing_seconds"], 3)}
+            manifest.mark_complete(params, STATUS_PARTIAL if summary["missing_seconds"] else STATUS_COMPLETE,
+                                   coverage)
+            if store is not None:
+                store.add_file(output_file, station_num)
+            return summary["bytes"]
+
+        stream = None
+        if was_partial and os.path.exists(output_file):
+            try:
+                stream = read(output_file, format="MSEED")
+                log(f"  Station {station_num}: refilling the gaps of the partial file {filename}.\n")
+            except Exception as e:
+                logging.warning(f"Could not read partial window {output_file}, fetching it again: {e}")
+        if stream is None:
+            stream = fetch_waveforms(params, cache=cache)
+            log(f"  Station {station_num}: successfully fetched {len(stream)} traces.\n")
+
+        stream, report = refiller.refill(params, stream, lambda gap_params: fetch_waveforms(gap_params, cache=cache))
+        log(f"  Station {station_num}: {report.summary()}\n")
+
+        with stage("write") as timer:
+            stream.write(output_file, format="MSEED")
+            timer.bytes = os.path.getsize(output_file)
+        log(f"  Station {station_num}: saved stream to {filename}\n")
+        logging.info(f"Saved stream for station {station_num} to {output_file}")
+        manifest.mark_complete(params, STATUS_COMPLETE if report.complete else STATUS_PARTIAL, report.as_dict())
+        if store is not None:
+            store.add_file(output_file, station_num)
+        return os.path.getsize(output_file)
+
+    finished = [0]
+
+    def report(params):
+        finished[0] += 1
+        report_progress(finished[0] / len(to_fetch), f"{finished[0]}/{len(to_fetch)} windows")
+
+    def on_station_error(params, e):
+        station_num = params["station_num"]
+        log(f"  Error for station {station_num}: {e}\n")
+        logging.error(f"Error fetching/saving station {station_num}: {e}", exc_info=e)
+        manifest.mark_failed(params, e)
+        report(params)
+
+    scheduler = FetchScheduler(max_per_host=max_per_host)
+    stats = scheduler.run(to_fetch, fetch_station, on_success=lambda params, nbytes: report(params),
+                          on_error=on_station_error)
+    return stats, manifest
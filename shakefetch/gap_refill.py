@@ -0,0 +1,249 @@
+import logging
+import threading
+from obspy import UTCDateTime
+from metrics import stage
+from task_executor import raise_if_cancelled, sleep
+from data_acquisition import list_channels as list_server_channels
+from waveform_cache import subtract_intervals, trace_intervals
+
+DEFAULT_REFILL_ATTEMPTS = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 30.0
+# Missing stretches up to this many samples long are rounding at the window edges, not gaps.
+DEFAULT_TOLERANCE_SAMPLES = 1.5
+
+
+def merge_stream(stream):
+    """
+    Merges refilled pieces into one trace per channel and contiguous run, like WaveformCache.read.
+
+    Overlapping samples are taken from the later piece, and gaps still left split the trace,
+    since miniSEED cannot store masked arrays.
+    """
+    if len(stream) < 2:
+        return stream
+    try:
+        stream.merge(method=1)
+    except Exception as e:
+        # Pieces at different sampling rates cannot be merged; write them as they are.
+        logging.warning(f"Could not merge refilled stream: {e}")
+        return stream
+    return stream.split()
+
+
+class ChannelCoverage:
+    """How much of a requested window one channel covers, with the stretches it misses."""
+    __slots__ = ("channel", "missing", "overlaps", "overlap_seconds", "completeness")
+
+    def __init__(self, channel, missing, overlaps, overlap_seconds, completeness):
+        self.channel = channel
+        self.missing = missing
+        self.overlaps = overlaps
+        self.overlap_seconds = overlap_seconds
+        self.completeness = completeness
+
+    @property
+    def missing_seconds(self):
+        return sum(end - start for start, end in self.missing)
+
+
+class CoverageReport:
+    """
+    Gaps, overlaps and missing coverage of a fetched stream against the window it was fetched for.
+
+    completeness is the fraction of the window's channel-seconds present, averaged over the
+    expected channels, so a window missing one of three channels is 67 % complete, and
+    missing_seconds likewise adds up the seconds each channel misses.
+    attempts counts the refill rounds that went into the stream.
+    """
+    def __init__(self, start, end, channels):
+        self.start = start
+        self.end = end
+        self.channels = channels
+        self.attempts = 0
+
+    @classmethod
+    def check(cls, stream, channel, start_time, end_time, tolerance_samples=DEFAULT_TOLERANCE_SAMPLES,
+              channels=None):
+        """
+        Checks stream against the window [start_time, end_time] requested for channel.
+
+        A channel code ending in ? or * expects the given channels, e.g. those the wave server
+        lists for the station, as well as every channel the stream holds, or the whole request
+        to be missing if there are none.
+        """
+        start, end = float(start_time), float(end_time)
+        by_channel = {}
+        for trace in stream:
+            by_channel.setdefault(trace.stats.channel, []).append(trace)
+        if channel[-1:] not in "?*":
+            expected = [channel]
+        else:
+            expected = sorted(set(by_channel).union(channels or ())) or [channel]
+
+        duration = end - start
+        channels = {}
+        for name in expected:
+            traces = by_channel.get(name, [])
+            intervals = trace_intervals(traces)
+            delta = min((tr.stats.delta for tr in traces), default=0.0)
+            tolerance = tolerance_samples * delta
+
+            overlaps, overlap_seconds, covered_to = 0, 0.0, None
+            for interval_start, interval_end in intervals:
+                if covered_to is not None and interval_start < covered_to - delta / 2:
+                    overlaps += 1
+                    overlap_seconds += min(covered_to, interval_end) - interval_start
+                covered_to = interval_end if covered_to is None else max(covered_to, interval_end)
+
+            missing = [(gap_start, gap_end) for gap_start, gap_end in subtract_intervals(start, end, intervals)
+                       if gap_end - gap_start > tolerance]
+            missing_seconds = sum(gap_end - gap_start for gap_start, gap_end in missing)
+            completeness = 1.0 - missing_seconds / duration if duration > 0 else float(bool(intervals))
+            channels[name] = ChannelCoverage(name, missing, overlaps, overlap_seconds, max(completeness, 0.0))
+        return cls(start, end, channels)
+
+    @property
+    def completeness(self):
+        if not self.channels:
+            return 0.0
+        return sum(coverage.completeness for coverage in self.channels.values()) / len(self.channels)
+
+    @property
+    def percent(self):
+        return 100.0 * self.completeness
+
+    @property
+    def complete(self):
+        return not self.missing
+
+    @property
+    def missing(self):
+        """Returns (channel, start, end) for every stretch of the window a channel is missing."""
+        return [(name, start, end) for name, coverage in self.channels.items() for start, end in coverage.missing]
+
+    @property
+    def missing_seconds(self):
+        return sum(coverage.missing_seconds for coverage in self.channels.values())
+
+    @property
+    def overlaps(self):
+        return sum(coverage.overlaps for coverage in self.channels.values())
+
+    def summary(self):
+        """Returns a one-line human readable summary, e.g. "98.5% complete, 2 gaps (27.0 s missing)"."""
+        text = f"{self.percent:.1f}% complete"
+        missing = self.missing
+        if missing:
+            text += f", {len(missing)} gaps ({self.missing_seconds:.1f} s missing)"
+        if self.overlaps:
+            text += f", {self.overlaps} overlaps"
+        if self.attempts:
+            text += f" after {self.attempts} refill attempts"
+        return text
+
+    def as_dict(self):
+        """Returns the report in the JSON-ready form the project manifest records."""
+        return {
+            "completeness": round(self.percent, 3),
+            "missing_seconds": round(self.missing_seconds, 3),
+            "missing": [[name, str(UTCDateTime(start)), str(UTCDateTime(end))] for name, start, end in self.missing],
+            "overlaps": self.overlaps,
+            "refill_attempts": self.attempts,
+        }
+
+
+class GapRefiller:
+    """
+    Checks fetched streams for gaps and refetches only the stretches they are missing.
+
+    Each round requests every missing (channel, start, end) stretch on its own and merges
+    what comes back into the stream. Rounds wait backoff seconds first, doubling each time up
+    to max_backoff, so data the wave server had not yet received or was still writing gets
+    time to arrive. Refilling stops after max_attempts rounds or once nothing is missing;
+    max_attempts=0 only checks.
+
+    A request for a wildcard channel such as EH? expects every matching channel that
+    list_channels(params) returns (data_acquisition.list_channels by default, asking the wave
+    server once per station), so a channel missing from the whole window is refetched too.
+    If the server cannot list its channels, the channels seen in earlier windows of the
+    station are expected instead.
+    """
+    def __init__(self, max_attempts=DEFAULT_REFILL_ATTEMPTS, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 tolerance_samples=DEFAULT_TOLERANCE_SAMPLES, list_channels=None):
+        if max_attempts < 0:
+            raise ValueError("max_attempts cannot be negative")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tolerance_samples = tolerance_samples
+        self.list_channels = list_channels or list_server_channels
+        self._channels = {}
+        self._listed = set()
+        self._lock = threading.Lock()
+
+    def expected_channels(self, params, stream):
+        """Returns the channels a window fetched for params should hold, given the stream fetched for it."""
+        if params['cha'][-1:] not in "?*":
+            return [params['cha']]
+        key = tuple(params[name] for name in ('host', 'port', 'net', 'sta', 'loc', 'cha'))
+        with self._lock:
+            listed = key in self._listed
+        channels = ()
+        if not listed:
+            try:
+                channels = self.list_channels(params)
+            except Exception as e:
+                # Try again with the next window; until then go by what the station has sent.
+                logging.warning(f"Could not list the channels of {params['net']}.{params['sta']} "
+                                f"on {params['host']}:{params['port']}: {e}")
+            else:
+                with self._lock:
+                    self._listed.add(key)
+        with self._lock:
+            known = self._channels.setdefault(key, set())
+            known.update(channels)
+            known.update(trace.stats.channel for trace in stream)
+            return sorted(known)
+
+    def check(self, params, stream, channels=None):
+        return CoverageReport.check(stream, params['cha'], params['start_time'], params['end_time'],
+                                    self.tolerance_samples, channels)
+
+    def delay(self, attempt):
+        """Returns the seconds to wait before refill round attempt (counted from 1)."""
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def refill(self, params, stream, fetch_func):
+        """
+        Refills the gaps of a stream fetched for params, calling fetch_func(gap_params) per gap.
+
+        A failing gap request is logged and retried in the next round rather than failing the
+        window, since the stream already holds the rest of it. Returns the merged stream and
+        its CoverageReport.
+        """
+        channels = self.expected_channels(params, stream)
+        report = self.check(params, stream, channels)
+        attempt = 0
+        while report.missing and attempt < self.max_attempts:
+            attempt += 1
+            sleep(self.delay(attempt))
+            with stage("refill") as timer:
+                for channel, gap_start, gap_end in report.missing:
+                    raise_if_cancelled()
+                    gap_params = dict(params, cha=channel, start_time=UTCDateTime(gap_start),
+                                      end_time=UTCDateTime(gap_end))
+                    try:
+                        piece = fetch_func(gap_params)
+                    except Exception as e:
+                        logging.warning(f"Refill of {channel} {gap_params['start_time']} to "
+                                        f"{gap_params['end_time']} failed: {e}")
+                        continue
+                    timer.items += sum(trace.stats.npts for trace in piece)
+                    stream += piece
+            stream = merge_stream(stream)
+            report = self.check(params, stream, channels)
+            logging.info(f"Refill round {attempt} of {params['net']}.{params['sta']}.{params['loc']}."
+                         f"{params['cha']}: {report.summary()}")
+        report.attempts = attempt
+        return stream, report
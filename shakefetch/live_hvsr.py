@@ -0,0 +1,317 @@
+import copy
+import logging
+import threading
+import time
+from collections import deque
+import hvsrpy
+import numpy as np
+from numpy.fft import rfft
+from obspy import UTCDateTime
+from hvsrpy.processing import COMBINE_HORIZONTAL_REGISTER, nextpow2
+from data_acquisition import fetch_waveforms
+from mhvsr_logic import smooth_spectra, supports_spectral_cache
+
+DEFAULT_POLL_INTERVAL = 10.0
+DEFAULT_LATENCY = 5.0
+DEFAULT_BUFFER_WINDOWS = 3
+STABILITY_WINDOWS = 5
+STABILITY_TOLERANCE = 0.02
+
+COMPONENTS = ("ns", "ew", "vt")
+COMPONENT_CODES = {"N": 0, "1": 0, "E": 1, "2": 1, "Z": 2}
+
+
+class SampleRingBuffer:
+    """
+    Fixed-size ring of three-component samples addressed by absolute sample index.
+
+    Each component keeps its own write position. Samples skipped over by a later write
+    are filled with NaN, so a gap in the data shows up in any window read across it.
+    """
+    def __init__(self, capacity, ncomponents=len(COMPONENTS)):
+        self.capacity = capacity
+        self.data = np.full((ncomponents, capacity), np.nan)
+        self.end = np.zeros(ncomponents, dtype=np.int64)
+
+    def _fill(self, component, start, stop):
+        start = max(start, stop - self.capacity)
+        if stop > start:
+            self.data[component, np.arange(start, stop) % self.capacity] = np.nan
+
+    def write(self, component, start_index, samples):
+        """Writes samples for one component starting at an absolute sample index."""
+        samples = np.asarray(samples, dtype=float)
+        if len(samples) > self.capacity:
+            start_index += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        stop_index = start_index + len(samples)
+        if stop_index <= self.end[component] - self.capacity:
+            return
+        if start_index > self.end[component]:
+            self._fill(component, self.end[component], start_index)
+        self.data[component, np.arange(start_index, stop_index) % self.capacity] = samples
+        self.end[component] = max(self.end[component], stop_index)
+
+    def extend_to(self, index):
+        """Marks every component as received up to index, filling anything missing with NaN."""
+        for component in range(len(self.end)):
+            if index > self.end[component]:
+                self._fill(component, self.end[component], index)
+                self.end[component] = index
+
+    def available(self):
+        """Returns the absolute index up to which every component has been received."""
+        return int(self.end.min())
+
+    def oldest(self):
+        """Returns the oldest absolute index still held for every component."""
+        return max(0, int(self.end.max()) - self.capacity)
+
+    def read(self, start_index, count):
+        """Returns a (ncomponents, count) copy of the samples starting at start_index."""
+        if start_index < self.oldest() or start_index + count > self.available():
+            raise IndexError("Requested samples are not in the ring buffer")
+        return self.data[:, np.arange(start_index, start_index + count) % self.capacity]
+
+
+class RunningHvsrStatistics:
+    """
+    Running lognormal statistics of HVSR windows, updated one window at a time.
+
+    Uses Welford's algorithm on the log amplitudes, so the mean and standard deviation
+    curves match hvsrpy's lognormal mean_curve and std_curve without keeping past windows.
+    """
+    def __init__(self, frequency, stability_windows=STABILITY_WINDOWS):
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.count = 0
+        self.rejected = 0
+        self._mean = np.zeros(len(self.frequency))
+        self._m2 = np.zeros(len(self.frequency))
+        self._fn_mean = 0.0
+        self._fn_m2 = 0.0
+        self.peak_history = deque(maxlen=stability_windows)
+
+    def update(self, amplitude):
+        """Adds one window's HVSR amplitude curve."""
+        log_amplitude = np.log(amplitude)
+        self.count += 1
+        delta = log_amplitude - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (log_amplitude - self._mean)
+
+        log_fn = np.log(self.frequency[np.argmax(amplitude)])
+        fn_delta = log_fn - self._fn_mean
+        self._fn_mean += fn_delta / self.count
+        self._fn_m2 += fn_delta * (log_fn - self._fn_mean)
+
+        self.peak_history.append(self.peak_frequency())
+
+    def mean_curve(self):
+        return np.exp(self._mean)
+
+    def std_curve(self):
+        if self.count < 2:
+            return np.zeros(len(self.frequency))
+        return np.sqrt(self._m2 / (self.count - 1))
+
+    def peak_frequency(self):
+        """Returns the frequency of the peak of the mean curve."""
+        return float(self.frequency[np.argmax(self._mean)])
+
+    def peak_amplitude(self):
+        return float(np.exp(self._mean.max()))
+
+    def fn_mean(self):
+        """Returns the lognormal median of the frequencies at which each window peaks."""
+        return float(np.exp(self._fn_mean))
+
+    def fn_std(self):
+        return float(np.sqrt(self._fn_m2 / (self.count - 1))) if self.count > 1 else 0.0
+
+    def is_stable(self, tolerance=STABILITY_TOLERANCE):
+        """
+        Checks whether the mean-curve peak frequency moved less than tolerance (relative)
+        over the last stability_windows windows.
+        """
+        if len(self.peak_history) < self.peak_history.maxlen:
+            return False
+        peaks = np.array(self.peak_history)
+        return (peaks.max() - peaks.min()) / peaks.mean() <= tolerance
+
+    def snapshot(self):
+        """Returns a copy of the current statistics that is safe to hand to another thread."""
+        return {
+            "windows": self.count,
+            "rejected": self.rejected,
+            "frequency": self.frequency.copy(),
+            "mean_curve": self.mean_curve(),
+            "std_curve": self.std_curve(),
+            "peak_frequency": self.peak_frequency() if self.count else None,
+            "peak_amplitude": self.peak_amplitude() if self.count else None,
+            "fn_mean": self.fn_mean() if self.count else None,
+            "fn_std": self.fn_std(),
+            "stable": self.is_stable(),
+        }
+
+
+def window_hvsr(ns, ew, vt, dt, preprocessing_settings, processing_settings):
+    """
+    Returns the smoothed HVSR amplitude of one time window at the processing center frequencies.
+
+    Applies the same detrend, taper, FFT, horizontal combination and smoothing as
+    process_mhvsr does for each window of a saved record.
+    """
+    preprocessing_settings = copy.deepcopy(preprocessing_settings)
+    preprocessing_settings.window_length_in_seconds = None
+    settings = copy.deepcopy(processing_settings)
+
+    record = hvsrpy.SeismicRecording3C(hvsrpy.TimeSeries(ns, dt), hvsrpy.TimeSeries(ew, dt),
+                                       hvsrpy.TimeSeries(vt, dt))
+    record = hvsrpy.preprocess(record, preprocessing_settings)[0]
+    record.window(*settings.window_type_and_width)
+
+    # Same FFT length rule as hvsrpy's prepare_fft_settings.
+    fft_settings = dict(settings.fft_settings or {})
+    fft_settings["n"] = max(fft_settings.get("n") or 0, nextpow2(record.vt.n_samples))
+    settings.fft_settings = fft_settings
+    frequencies = np.fft.rfftfreq(fft_settings["n"], dt)
+    spectra = [np.abs(rfft(getattr(record, component).amplitude, **fft_settings))[np.newaxis]
+               for component in COMPONENTS]
+
+    combine = COMBINE_HORIZONTAL_REGISTER[settings.method_to_combine_horizontals]
+    fcs = np.array(settings.smoothing["center_frequencies_in_hz"], dtype=float)
+    raw_spectra = np.vstack((combine(spectra[0], spectra[1], settings), spectra[2]))
+    smoothed = smooth_spectra(frequencies, raw_spectra, fcs,
+                              settings.smoothing["operator"], settings.smoothing["bandwidth"])
+    return smoothed[0] / smoothed[1]
+
+
+class LiveHvsrMonitor:
+    """
+    Polls a wave server and updates running HVSR statistics as each window completes.
+
+    New samples are written into a fixed-size ring buffer. Every complete window is processed
+    once and folded into the running statistics, so past windows are never recomputed.
+    on_update(snapshot) is called from the monitor thread after each window and
+    on_error(exception) when a poll fails; polling carries on after errors.
+    """
+    def __init__(self, params, preprocessing_settings, processing_settings, on_update=None, on_error=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, latency=DEFAULT_LATENCY,
+                 buffer_windows=DEFAULT_BUFFER_WINDOWS, pool=None):
+        if not supports_spectral_cache(processing_settings):
+            raise ValueError("Live HVSR needs traditional processing with a frequency-domain horizontal combination")
+        self.params = dict(params)
+        self.preprocessing_settings = preprocessing_settings
+        self.processing_settings = processing_settings
+        self.window_length = preprocessing_settings.window_length_in_seconds
+        self.on_update = on_update
+        self.on_error = on_error
+        self.poll_interval = poll_interval
+        self.latency = latency
+        self.buffer_windows = buffer_windows
+        self.pool = pool
+        self.statistics = RunningHvsrStatistics(processing_settings.smoothing["center_frequencies_in_hz"])
+        self.buffer = None
+        self.sampling_rate = None
+        self.t0 = None
+        self.next_window = 0
+        self.dropped_windows = 0
+        self.cursor = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, start_time=None):
+        """
+        Starts polling in a background thread.
+
+        By default the monitor starts one window back, so the first curve appears on the first poll.
+        """
+        self.cursor = start_time or UTCDateTime() - self.latency - self.window_length
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="live-hvsr", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Live HVSR poll failed: {e}")
+                if self.on_error:
+                    self.on_error(e)
+            self._stop.wait(self.poll_interval)
+
+    def _window_samples(self):
+        # Same as hvsrpy's TimeSeries.split: windows share their boundary sample.
+        return int(self.window_length / (1 / self.sampling_rate)) + 1
+
+    def _index(self, time):
+        return int(round((time - self.t0) * self.sampling_rate))
+
+    def _ingest(self, trace):
+        component = COMPONENT_CODES.get(trace.stats.channel[-1:])
+        if component is None:
+            return
+        if self.buffer is None:
+            self.sampling_rate = trace.stats.sampling_rate
+            self.t0 = trace.stats.starttime
+            self.buffer = SampleRingBuffer(self._window_samples() * self.buffer_windows)
+        elif trace.stats.sampling_rate != self.sampling_rate:
+            raise ValueError(f"Sampling rate changed from {self.sampling_rate} to {trace.stats.sampling_rate} Hz")
+        self.buffer.write(component, self._index(trace.stats.starttime), trace.data)
+
+    def poll(self, now=None):
+        """
+        Fetches the data received since the last poll and processes every window it completes.
+
+        Returns the number of windows processed.
+        """
+        end = (now or UTCDateTime()) - self.latency
+        if end <= self.cursor:
+            return 0
+        stream = fetch_waveforms(dict(self.params, start_time=self.cursor, end_time=end), pool=self.pool)
+        for trace in stream.split():
+            self._ingest(trace)
+        self.cursor = end
+        if self.buffer is None:
+            return 0
+        # Anything still missing up to the end of this request is a gap; it will not be asked for again.
+        self.buffer.extend_to(self._index(end))
+        return self._process_windows()
+
+    def _process_windows(self):
+        npts = self._window_samples()
+        stride = npts - 1
+        processed = 0
+        while self.next_window + npts <= self.buffer.available():
+            if self.next_window < self.buffer.oldest():
+                # Fell more than the buffer behind; skip windows that were already overwritten.
+                skipped = -(-(self.buffer.oldest() - self.next_window) // stride)
+                self.dropped_windows += skipped
+                self.next_window += skipped * stride
+                continue
+            ns, ew, vt = self.buffer.read(self.next_window, npts)
+            self.next_window += stride
+            if np.isnan(vt).any() or np.isnan(ns).any() or np.isnan(ew).any():
+                self.statistics.rejected += 1
+                continue
+            start = time.perf_counter()
+            amplitude = window_hvsr(ns, ew, vt, 1 / self.sampling_rate,
+                                    self.preprocessing_settings, self.processing_settings)
+            self.statistics.update(amplitude)
+            processed += 1
+            logging.info(f"Live HVSR window {self.statistics.count} processed in "
+                         f"{(time.perf_counter() - start) * 1000:.0f} ms, "
+                         f"peak {self.statistics.peak_frequency():.3f} Hz")
+            if self.on_update:
+                self.on_update(self.statistics.snapshot())
+        return processed
@@ -0,0 +1,194 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = "shakefetch"
+PROFILE_DIR = os.path.join("logs", "profiles")
+PROFILE_TOP = 25
+
+
+class StageStats:
+    """Totals for one named stage: calls, failed calls, time, and bytes and items moved."""
+    __slots__ = ("calls", "errors", "seconds", "max_seconds", "bytes", "items")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.items = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class StageTimer:
+    """Handed out by Metrics.stage so the timed code can add the bytes and items it moved."""
+    __slots__ = ("bytes", "items")
+
+    def __init__(self):
+        self.bytes = 0
+        self.items = 0
+
+
+class Metrics:
+    """
+    Per-stage durations, bytes and counts, shared by every thread of the process.
+
+    Stages are free-form names such as "connect", "fetch", "write", "read", "preprocess",
+    "process" or "sesame". Recording one costs a lock and two perf_counter calls, so
+    instrumentation stays on all the time. Export with to_json or to_prometheus.
+    """
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the with block as one call of stage name; an exception counts it as an error.
+
+        Set or add to .bytes and .items on the yielded StageTimer to record what it moved.
+        """
+        timer = StageTimer()
+        start = time.perf_counter()
+        try:
+            yield timer
+        except BaseException:
+            self.record(name, time.perf_counter() - start, timer.bytes, timer.items, error=True)
+            raise
+        self.record(name, time.perf_counter() - start, timer.bytes, timer.items)
+
+    def record(self, name, seconds, nbytes=0, items=0, error=False):
+        """Records one call of a stage that was timed elsewhere."""
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = StageStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += nbytes or 0
+            stats.items += items or 0
+
+    def add(self, name, nbytes=0, items=0):
+        """Adds bytes and items to a stage without counting a call, e.g. from inside a timed call."""
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = StageStats()
+            stats.bytes += nbytes or 0
+            stats.items += items or 0
+
+    def merge(self, snapshot):
+        """Adds the stages of another process' snapshot(), e.g. from a process pool worker."""
+        with self._lock:
+            for name, values in snapshot.get("stages", {}).items():
+                stats = self._stages.get(name)
+                if stats is None:
+                    stats = self._stages[name] = StageStats()
+                for field in ("calls", "errors", "seconds", "bytes", "items"):
+                    setattr(stats, field, getattr(stats, field) + values[field])
+                stats.max_seconds = max(stats.max_seconds, values["max_seconds"])
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Returns a JSON-ready copy of every stage's totals."""
+        with self._lock:
+            stages = {name: stats.as_dict() for name, stats in sorted(self._stages.items())}
+        return {"started": self.started, "created": time.time(), "stages": stages}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """Returns the stage totals in the Prometheus text exposition format, labelled by stage."""
+        stages = self.snapshot()["stages"]
+        families = (
+            ("stage_calls_total", "counter", "calls", "Completed calls of a stage."),
+            ("stage_errors_total", "counter", "errors", "Calls of a stage that raised."),
+            ("stage_seconds_total", "counter", "seconds", "Wall time spent in a stage."),
+            ("stage_seconds_max", "gauge", "max_seconds", "Longest single call of a stage."),
+            ("stage_bytes_total", "counter", "bytes", "Bytes moved by a stage."),
+            ("stage_items_total", "counter", "items", "Samples, records or packets handled by a stage."),
+        )
+        lines = []
+        for suffix, kind, field, help_text in families:
+            metric = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, values in stages.items():
+                label = name.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{stage="{label}"}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the metrics to path, as Prometheus text if it ends in .prom and as JSON otherwise."""
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def summary_lines(self):
+        """Returns one human readable line per stage, slowest first."""
+        stages = self.snapshot()["stages"]
+        lines = []
+        for name, values in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+            line = f"{name}: {values['calls']} calls, {values['seconds']:.2f} s (max {values['max_seconds']:.2f} s)"
+            if values["bytes"]:
+                line += f", {values['bytes'] / 1e6:.2f} MB"
+            if values["items"]:
+                line += f", {values['items']} items"
+            if values["errors"]:
+                line += f", {values['errors']} errors"
+            lines.append(line)
+        return lines
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """
+    Returns the process-wide Metrics that data_acquisition, mhvsr_logic, time_sync and the
+    app's workers record into.
+    """
+    return _metrics
+
+
+def stage(name):
+    """Shorthand for get_metrics().stage(name)."""
+    return _metrics.stage(name)
+
+
+def profile_call(func, *args, name=None, output_dir=PROFILE_DIR, **kwargs):
+    """
+    Runs func(*args, **kwargs) under cProfile and returns its result.
+
+    The profile is saved to output_dir as <name>-<time>.prof for snakeviz or pstats, and the
+    top functions by cumulative time are logged. Only the calling thread is profiled, so work
+    a task hands to its own thread or process pools shows up as time spent waiting.
+    """
+    name = name or getattr(func, "__name__", "task")
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        logging.info(f"Profile of {name} saved to {path}:\n{report.getvalue()}")
@@ -1,13 +1,344 @@
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import hvsrpy
 import numpy as np
+from numpy.fft import rfft
+from hvsrpy.hvsr_traditional import HvsrTraditional
+from hvsrpy.processing import (COMBINE_HORIZONTAL_REGISTER, check_nyquist_frequency,
+                               prepare_fft_settings, prepare_records_with_inconsistent_dt)
+from hvsrpy.smoothing import SMOOTHING_OPERATORS
+from scipy import sparse
+from metrics import get_metrics, stage
+from task_executor import held, raise_if_cancelled, report_progress
 
-def process_mhvsr(file_paths, preprocessing_settings, processing_settings):
+SPECTRAL_CACHE_ENTRIES = 4
+SMOOTHING_OPERATOR_ENTRIES = 16
+
+
+class ComponentSpectra:
+    """
+    Amplitude spectra of every windowed, tapered record, grouped by time step.
+
+    groups holds (dt, frequencies, ns, ew, vt) tuples where each component array has one
+    row per window. order maps the grouped rows back to the original record order.
+    """
+    def __init__(self, groups, order, meta, fft_settings):
+        self.groups = groups
+        self.order = order
+        self.meta = meta
+        self.fft_settings = fft_settings
+
+    @property
+    def nbytes(self):
+        return sum(ns.nbytes + ew.nbytes + vt.nbytes for _, _, ns, ew, vt in self.groups)
+
+
+def _file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def spectra_cache_key(file_paths, preprocessing_settings, processing_settings):
+    """
+    Returns a key for the component spectra of file_paths.
+
+    Only file contents and the settings that change the spectra take part, so smoothing
+    and combine settings can change without invalidating the entry.
+    """
+    def digests(entry):
+        if isinstance(entry, (list, tuple)):
+            return [digests(item) for item in entry]
+        return _file_digest(entry)
+
+    spectra_settings = {
+        "preprocessing": preprocessing_settings.attr_dict,
+        "window_type_and_width": processing_settings.window_type_and_width,
+        "fft_settings": processing_settings.fft_settings,
+        "handle_dissimilar_time_steps_by": processing_settings.handle_dissimilar_time_steps_by,
+    }
+    payload = json.dumps([digests(list(file_paths)), spectra_settings], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def supports_spectral_cache(processing_settings):
+    """Checks whether the settings use the traditional frequency-domain combine path."""
+    return (processing_settings.processing_method == "traditional"
+            and processing_settings.method_to_combine_horizontals in COMBINE_HORIZONTAL_REGISTER)
+
+
+def read_records(file_paths, store=None):
+    """
+    Reads hvsrpy records from miniSEED, or from a ProjectStore's memory-mapped samples if given.
+
+    Files the store cannot return as one trace per component, such as partial windows with
+    gaps, are read from miniSEED instead.
+    """
+    with stage("read") as timer:
+        records = None
+        if store is not None:
+            try:
+                records = store.read(file_paths)
+            except ValueError as e:
+                logging.warning(f"Reading {file_paths} from miniSEED, not the project store: {e}")
+        if records is None:
+            records = hvsrpy.read(file_paths)
+        timer.items = len(records)
+    return records
+
+
+def compute_component_spectra(file_paths, preprocessing_settings, processing_settings, store=None):
+    """
+    Reads, preprocesses, windows and Fourier transforms the records, stopping before
+    horizontals are combined and spectra are smoothed.
+    """
+    settings = copy.deepcopy(processing_settings)
+    records = read_records(file_paths, store)
+    raise_if_cancelled()
+    with stage("preprocess"):
+        records = hvsrpy.preprocess(records, preprocessing_settings)
+    raise_if_cancelled()
+    with stage("spectra") as timer:
+        timer.items = len(records)
+        return _window_spectra(records, settings)
+
+
+def _window_spectra(records, settings):
+    """Windows and Fourier transforms preprocessed records into ComponentSpectra."""
+    prepare_fft_settings(records, settings)
+    records, dt_with_count = prepare_records_with_inconsistent_dt(records, settings)
+
+    # Same grouping and ordering as hvsrpy's traditional processing.
+    groups = []
+    order = np.empty(len(records), dtype=int)
+    cur_idx = 0
+    for dt, count in dt_with_count.items():
+        frequencies = np.fft.rfftfreq(settings.fft_settings["n"], dt)
+        ns = np.empty((count, len(frequencies)))
+        ew = np.empty((count, len(frequencies)))
+        vt = np.empty((count, len(frequencies)))
+        row = 0
+        for org_idx, record in enumerate(records):
+            if record.ns.dt_in_seconds != dt:
+                continue
+            order[org_idx] = cur_idx
+            cur_idx += 1
+            record.window(*settings.window_type_and_width)
+            ns[row] = np.abs(rfft(record.ns.amplitude, **settings.fft_settings))
+            ew[row] = np.abs(rfft(record.ew.amplitude, **settings.fft_settings))
+            vt[row] = np.abs(rfft(record.vt.amplitude, **settings.fft_settings))
+            row += 1
+        groups.append((dt, frequencies, ns, ew, vt))
+    return ComponentSpectra(groups, order, dict(records[0].meta), dict(settings.fft_settings))
+
+
+def combine_component_spectra(spectra, processing_settings):
+    """
+    Combines horizontals, smooths and forms the H/V ratio from precomputed component spectra.
+    """
+    settings = copy.deepcopy(processing_settings)
+    settings.fft_settings = dict(spectra.fft_settings)
+    fcs = np.array(settings.smoothing["center_frequencies_in_hz"], dtype=float)
+    check_nyquist_frequency(max(dt for dt, *_ in spectra.groups), fcs)
+
+    combine = COMBINE_HORIZONTAL_REGISTER[settings.method_to_combine_horizontals]
+    operator_name = settings.smoothing["operator"]
+    bandwidth = settings.smoothing["bandwidth"]
+
+    hvsr_spectra = np.empty((len(spectra.order), len(fcs)))
+    hvsr_idx = 0
+    for dt, frequencies, ns, ew, vt in spectra.groups:
+        count = len(ns)
+        raw_spectra = np.vstack((combine(ns, ew, settings), vt))
+        smoothed = smooth_spectra(frequencies, raw_spectra, fcs, operator_name, bandwidth)
+        hvsr_spectra[hvsr_idx:hvsr_idx + count] = smoothed[:count] / smoothed[count:]
+        hvsr_idx += count
+    hvsr_spectra = hvsr_spectra[spectra.order]
+    return HvsrTraditional(fcs, hvsr_spectra, meta={**spectra.meta, **settings.attr_dict})
+
+
+def build_konno_ohmachi_operator(frequencies, fcs, bandwidth):
+    """
+    Builds a sparse (len(fcs), len(frequencies)) Konno and Ohmachi (1998) smoothing matrix.
+
+    Row i holds the normalized window weights for center frequency fcs[i], using the same
+    window, support and zero-frequency rules as hvsrpy.smoothing.konno_and_ohmachi, so
+    operator @ spectrum.T reproduces it.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    upper_limit = np.power(10, +3 / bandwidth)
+    lower_limit = np.power(10, -3 / bandwidth)
+
+    rows, cols, weights = [], [], []
+    for fc_index, fc in enumerate(fcs):
+        if fc < 1E-6:
+            continue
+        # Widen the search slightly, then apply hvsrpy's exact f/fc test at the edges.
+        lo = np.searchsorted(frequencies, fc * lower_limit * (1 - 1E-9), side="left")
+        hi = np.searchsorted(frequencies, fc * upper_limit * (1 + 1E-9), side="right")
+        f = frequencies[lo:hi]
+        f_on_fc = f / fc
+        keep = (f >= 1E-6) & (f_on_fc <= upper_limit) & (f_on_fc >= lower_limit)
+        f, f_on_fc = f[keep], f_on_fc[keep]
+        if f.size == 0:
+            continue
+        with np.errstate(divide="ignore", invalid="ignore"):
+            window = bandwidth * np.log10(f_on_fc)
+            window = np.sin(window) / window
+        window = np.where(np.abs(f - fc) < 1E-6, 1., window) ** 4
+        total = window.sum()
+        if total <= 0:
+            continue
+        rows.append(np.full(f.size, fc_index))
+        cols.append(np.arange(lo, hi)[keep])
+        weights.append(window / total)
+
+    if rows:
+        rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+    return sparse.csr_matrix((weights, (rows, cols)), shape=(len(fcs), len(frequencies)))
+
+
+class SmoothingOperatorCache:
+    """
+    Keeps smoothing operators per (frequency grid, center frequencies, bandwidth).
+
+    Every window of every run on the same FFT grid shares one operator, so the weights
+    are computed once rather than per window.
+    """
+    def __init__(self, max_entries=SMOOTHING_OPERATOR_ENTRIES):
+        self.max_entries = max_entries
+        self._operators = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(frequencies, fcs, bandwidth):
+        digest = hashlib.sha1(np.ascontiguousarray(frequencies, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(fcs, dtype=float).tobytes())
+        return digest.hexdigest(), float(bandwidth)
+
+    def get(self, frequencies, fcs, bandwidth):
+        key = self.key(frequencies, fcs, bandwidth)
+        with self._lock:
+            operator = self._operators.get(key)
+            if operator is not None:
+                self._operators.move_to_end(key)
+                self.hits += 1
+                return operator
+            self.misses += 1
+        operator = build_konno_ohmachi_operator(frequencies, fcs, bandwidth)
+        with self._lock:
+            self._operators[key] = operator
+            while len(self._operators) > self.max_entries:
+                self._operators.popitem(last=False)
+        return operator
+
+
+_smoothing_operators = SmoothingOperatorCache()
+
+
+def smooth_spectra(frequencies, spectra, fcs, operator_name, bandwidth):
+    """
+    Smooths a (nspectrum, nfrequency) array at the center frequencies fcs.
+
+    Konno and Ohmachi smoothing is applied to all spectra as one sparse matrix product
+    with a cached operator; other operators fall back to hvsrpy.
+    """
+    if operator_name == "konno_and_ohmachi":
+        operator = _smoothing_operators.get(frequencies, fcs, bandwidth)
+        return np.asarray((operator @ spectra.T).T)
+    return SMOOTHING_OPERATORS[operator_name](frequencies, spectra, fcs, bandwidth)
+
+
+class SpectralCache:
+    """
+    Keeps the component spectra of recently analysed files in memory.
+
+    A change to smoothing or to how horizontals are combined reuses the cached spectra
+    and only redoes the combine and smoothing steps.
+    """
+    def __init__(self, max_entries=SPECTRAL_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, file_paths, preprocessing_settings, processing_settings, store=None):
+        key = spectra_cache_key(file_paths, preprocessing_settings, processing_settings)
+        with self._lock:
+            spectra = self._entries.get(key)
+            if spectra is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return spectra
+            self.misses += 1
+        spectra = compute_component_spectra(file_paths, preprocessing_settings, processing_settings, store)
+        with self._lock:
+            self._entries[key] = spectra
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return spectra
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": sum(spectra.nbytes for spectra in self._entries.values()),
+            }
+
+
+_spectral_cache = SpectralCache()
+
+
+def get_spectral_cache():
+    """
+    Returns the process-wide spectral cache used by the MHVSR tab.
+    """
+    return _spectral_cache
+
+
+def process_mhvsr(file_paths, preprocessing_settings, processing_settings, cache=None, store=None):
     """
     Processes MHVSR data from a list of files.
+
+    With a SpectralCache, the windowed component spectra are reused when only the
+    smoothing or combine settings changed since the last run on the same files.
+    With a ProjectStore holding the files, samples are read from it instead of decoding miniSEED.
     """
-    srecords = hvsrpy.read(file_paths)
-    srecords = hvsrpy.preprocess(srecords, preprocessing_settings)
-    hvsr = hvsrpy.process(srecords, processing_settings)
+    if supports_spectral_cache(processing_settings):
+        if cache is not None:
+            spectra = cache.get_or_compute(file_paths, preprocessing_settings, processing_settings, store)
+        else:
+            spectra = compute_component_spectra(file_paths, preprocessing_settings, processing_settings, store)
+        raise_if_cancelled()
+        with stage("process"):
+            return combine_component_spectra(spectra, processing_settings)
+    srecords = read_records(file_paths, store)
+    raise_if_cancelled()
+    with stage("preprocess"):
+        srecords = hvsrpy.preprocess(srecords, preprocessing_settings)
+    raise_if_cancelled()
+    with stage("process"):
+        hvsr = hvsrpy.process(srecords, processing_settings)
     return hvsr
 
 def get_default_preprocessing_settings(window_length=150):
@@ -33,4 +364,66 @@ def get_default_processing_settings(bandwidth=40, combine_method='geometric_mean
                                center_frequencies_in_hz=np.geomspace(0.2, 50, 200))
     settings.method_to_combine_horizontals = combine_method
     settings.handle_dissimilar_time_steps_by = "frequency_domain_resampling"
-    return settings
\ No newline at end of file
+    return settings
+
+PROJECT_FILE_PATTERN = re.compile(r"_(\d+)_\d{8}T\d{6}_to_\d{8}T\d{6}\.mseed$")
+
+
+def group_project_files(project_path):
+    """
+    Groups the miniSEED files of a Multifetch project by station number.
+
+    Returns a dict of station number to a sorted list of file paths.
+    """
+    groups = {}
+    for filename in sorted(os.listdir(project_path)):
+        match = PROJECT_FILE_PATTERN.search(filename)
+        if match:
+            groups.setdefault(int(match.group(1)), []).append(os.path.join(project_path, filename))
+    return dict(sorted(groups.items()))
+
+
+def _process_station(station, file_paths, preprocessing_settings, processing_settings):
+    # Runs in a worker process; each file is one three-component record. The worker's metrics
+    # are sent back per station so the parent can add them to its own.
+    from project_store import open_store_for
+    get_metrics().reset()
+    start = time.perf_counter()
+    hvsr = process_mhvsr(list(file_paths), preprocessing_settings, processing_settings,
+                         store=open_store_for(list(file_paths)))
+    return station, hvsr, time.perf_counter() - start, get_metrics().snapshot()
+
+
+def _terminate_pool(executor):
+    executor.shutdown(wait=False, cancel_futures=True)
+    # ProcessPoolExecutor has no public way to stop running work, so stop the workers directly.
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+def process_mhvsr_batch(station_files, preprocessing_settings, processing_settings, on_result, max_workers=None):
+    """
+    Runs process_mhvsr for each station in a process pool.
+
+    station_files maps a station to its list of files. on_result(station, hvsr, elapsed, error)
+    is called in the calling thread as each station finishes, so results can be shown as they
+    arrive; hvsr is None and error is set if that station failed. Cancelling the calling
+    thread's task stops the worker processes at once.
+    """
+    # Spawn rather than fork: the GUI calls this from a worker thread of a running Tk app.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor, \
+            held(lambda: _terminate_pool(executor)):
+        futures = {executor.submit(_process_station, station, files, preprocessing_settings, processing_settings): station
+                   for station, files in station_files.items()}
+        for finished, future in enumerate(as_completed(futures), 1):
+            raise_if_cancelled()
+            report_progress(finished / len(futures), f"{finished}/{len(futures)} stations")
+            station = futures[future]
+            try:
+                _, hvsr, elapsed, metrics = future.result()
+            except Exception as e:
+                on_result(station, None, 0.0, e)
+            else:
+                get_metrics().merge(metrics)
+                on_result(station, hvsr, elapsed, None)
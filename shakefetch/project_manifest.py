@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from obspy import UTCDateTime
+
+MANIFEST_FILE = "manifest.json"
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETE = "complete"
+STATUS_PARTIAL = "partial"
+STATUS_FAILED = "failed"
+
+PARAM_KEYS = ("host", "port", "net", "sta", "loc", "cha", "station_num")
+
+
+def window_filename(project_name, params):
+    """
+    Returns the miniSEED filename for a window: projectname_stationnumber_starttime_endtime.mseed
+    """
+    st_str = params['start_time'].strftime('%Y%m%dT%H%M%S')
+    et_str = params['end_time'].strftime('%Y%m%dT%H%M%S')
+    return f"{project_name}_{params['station_num']}_{st_str}_to_{et_str}.mseed"
+
+
+def file_checksum(path, block_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ProjectManifest:
+    """
+    Records every requested window of a Multifetch project with its status, size and checksum.
+
+    The manifest lives in the project directory so a rerun, even after an app restart,
+    only fetches windows that are not already complete on disk.
+    """
+    def __init__(self, project_path, project_name):
+        self.project_path = project_path
+        self.project_name = project_name
+        self.path = os.path.join(project_path, MANIFEST_FILE)
+        self.windows = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def exists(cls, project_path):
+        return os.path.exists(os.path.join(project_path, MANIFEST_FILE))
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.windows = data.get("windows", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.windows = {}
+        # A window still marked running was interrupted by a crash or a dropped link. Partial
+        # windows, and windows saved with gaps, are fetched again on the next run.
+        for window in self.windows.values():
+            if window["status"] == STATUS_RUNNING:
+                window["status"] = STATUS_PARTIAL
+
+    def save(self):
+        with self._lock:
+            data = {"project_name": self.project_name, "windows": self.windows}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def add_windows(self, all_params):
+        """Registers requested windows, keeping the recorded state of ones already known."""
+        with self._lock:
+            for params in all_params:
+                filename = window_filename(self.project_name, params)
+                if filename in self.windows:
+                    continue
+                window = {key: params[key] for key in PARAM_KEYS if key in params}
+                window.update({
+                    "start_time": str(params['start_time']),
+                    "end_time": str(params['end_time']),
+                    "status": STATUS_PENDING,
+                    "bytes": 0,
+                    "sha256": None,
+                    "attempts": 0,
+                    "completeness": None,
+                    "error": None,
+                    "updated": None,
+                })
+                self.windows[filename] = window
+        self.save()
+
+    def is_complete(self, filename):
+        """Checks that a window is complete and its file still matches the recorded checksum."""
+        window = self.windows.get(filename)
+        if not window or window["status"] != STATUS_COMPLETE:
+            return False
+        path = os.path.join(self.project_path, filename)
+        if not os.path.exists(path) or os.path.getsize(path) != window["bytes"]:
+            return False
+        return file_checksum(path) == window["sha256"]
+
+    def windows_to_fetch(self, all_params):
+        """Returns the params of windows that still need fetching, in the order given."""
+        return [params for params in all_params
+                if not self.is_complete(window_filename(self.project_name, params))]
+
+    def all_params(self):
+        """Rebuilds fetch params for every window in the manifest, e.g. to resume after a restart."""
+        all_params = []
+        for window in self.windows.values():
+            params = {key: window[key] for key in PARAM_KEYS if key in window}
+            params["start_time"] = UTCDateTime(window["start_time"])
+            params["end_time"] = UTCDateTime(window["end_time"])
+            all_params.append(params)
+        return sorted(all_params, key=lambda params: params["station_num"])
+
+    def _update(self, filename, **fields):
+        with self._lock:
+            self.windows[filename].update(fields, updated=datetime.now(timezone.utc).isoformat())
+        self.save()
+
+    def status(self, params):
+        """Returns the recorded status of a window, or None if it is not in the manifest."""
+        window = self.windows.get(window_filename(self.project_name, params))
+        return window["status"] if window else None
+
+    def mark_running(self, params):
+        filename = window_filename(self.project_name, params)
+        with self._lock:
+            attempts = self.windows[filename]["attempts"] + 1
+        self._update(filename, status=STATUS_RUNNING, attempts=attempts, error=None)
+
+    def mark_complete(self, params, status=STATUS_COMPLETE, coverage=None):
+        """
+        Records a written window. coverage holds the completeness (in percent) and the gaps
+        the saved file still has, from CoverageReport.as_dict.
+        """
+        filename = window_filename(self.project_name, params)
+        path = os.path.join(self.project_path, filename)
+        self._update(filename, status=status, bytes=os.path.getsize(path), sha256=file_checksum(path),
+                     **(coverage or {}))
+
+    def mark_failed(self, params, error):
+        self._update(window_filename(self.project_name, params), status=STATUS_FAILED, error=str(error))
+
+    def summary(self):
+        """Returns a count of windows per status."""
+        counts = {}
+        with self._lock:
+            for window in self.windows.values():
+                counts[window["status"]] = counts.get(window["status"], 0) + 1
+        return counts
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+STORE_DIR = "store"
+INDEX_FILE = "index.json"
+# About 2.9 h at 100 Hz; longer traces are split so no single array file gets huge.
+CHUNK_SAMPLES = 2 ** 20
+
+COMPONENT_CODES = {"N": "ns", "1": "ns", "E": "ew", "2": "ew", "Z": "vt"}
+
+
+class ProjectStore:
+    """
+    Decoded samples of a Multifetch project, kept as .npy chunks next to its miniSEED files.
+
+    The index records each chunk's NSLC, start time, sampling rate and source file. Chunks are
+    opened with np.load(mmap_mode="r"), so reading a station back needs no miniSEED decoding
+    and pages samples in from disk only as they are used. A source file is re-imported
+    only when its size or modification time changes.
+    """
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.path = os.path.join(project_path, STORE_DIR)
+        self.index_path = os.path.join(self.path, INDEX_FILE)
+        self.sources = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def exists(cls, project_path):
+        return os.path.exists(os.path.join(project_path, STORE_DIR, INDEX_FILE))
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                self.sources = json.load(f).get("sources", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.sources = {}
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": 1, "sources": self.sources}, f, indent=1)
+            os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _signature(file_path):
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns
+
+    def contains(self, file_path):
+        """Checks whether a miniSEED file is in the store and unchanged since it was added."""
+        entry = self.sources.get(os.path.basename(file_path))
+        if entry is None:
+            return False
+        try:
+            return (entry["size"], entry["mtime_ns"]) == self._signature(file_path)
+        except OSError:
+            return False
+
+    def add_file(self, file_path, station_num=None, save=True):
+        """Decodes a miniSEED file once and stores its traces as chunked .npy arrays."""
+        from obspy import read
+        if self.contains(file_path):
+            return False
+        name = os.path.basename(file_path)
+        size, mtime_ns = self._signature(file_path)
+        stream = read(file_path, format="MSEED")
+        stream.merge(method=-1)
+
+        os.makedirs(self.path, exist_ok=True)
+        stem = os.path.splitext(name)[0]
+        segments = []
+        for trace_index, trace in enumerate(stream.split()):
+            data = np.ascontiguousarray(trace.data)
+            delta = trace.stats.delta
+            for chunk_index, offset in enumerate(range(0, len(data), CHUNK_SAMPLES)):
+                chunk = data[offset:offset + CHUNK_SAMPLES]
+                chunk_file = f"{stem}.{trace_index}.{chunk_index}.npy"
+                np.save(os.path.join(self.path, chunk_file), chunk)
+                segments.append({
+                    "file": chunk_file,
+                    "network": trace.stats.network, "station": trace.stats.station,
+                    "location": trace.stats.location, "channel": trace.stats.channel,
+                    "start": float(trace.stats.starttime.timestamp + offset * delta),
+                    "sampling_rate": trace.stats.sampling_rate,
+                    "npts": len(chunk),
+                    "dtype": chunk.dtype.str,
+                })
+        with self._lock:
+            previous = self.sources.get(name)
+            self.sources[name] = {"size": size, "mtime_ns": mtime_ns, "station_num": station_num,
+                                  "segments": segments}
+        if previous is not None:
+            # A changed file can have fewer traces or chunks than before; drop the ones left over.
+            current = {segment["file"] for segment in segments}
+            for segment in previous["segments"]:
+                if segment["file"] not in current:
+                    try:
+                        os.remove(os.path.join(self.path, segment["file"]))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logging.warning(f"Could not remove stale store chunk {segment['file']}: {e}")
+        if save:
+            self.save()
+        return True
+
+    def add_project(self, file_paths_by_station):
+        """Adds every file of a project, given as {station_num: [file paths]}. Returns the number added."""
+        added = 0
+        for station_num, file_paths in file_paths_by_station.items():
+            for file_path in file_paths:
+                added += self.add_file(file_path, station_num, save=False)
+        self.save()
+        return added
+
+    def open_chunk(self, segment):
+        """Returns a read-only memory map of one chunk's samples."""
+        return np.load(os.path.join(self.path, segment["file"]), mmap_mode="r")
+
+    def traces(self, file_path):
+        """
+        Returns {channel: (start, sampling_rate, samples)} for a stored file.
+
+        A trace held in one chunk is returned as that chunk's memory map without copying.
+        """
+        entry = self.sources[os.path.basename(file_path)]
+        pieces = {}
+        for segment in entry["segments"]:
+            pieces.setdefault(segment["channel"], []).append(segment)
+        traces = {}
+        for channel, segments in pieces.items():
+            segments.sort(key=lambda segment: segment["start"])
+            for previous, segment in zip(segments, segments[1:]):
+                expected = previous["start"] + previous["npts"] / previous["sampling_rate"]
+                if abs(segment["start"] - expected) > 0.5 / segment["sampling_rate"]:
+                    raise ValueError(f"{os.path.basename(file_path)} has a gap in channel {channel}")
+            chunks = [self.open_chunk(segment) for segment in segments]
+            samples = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+            traces[channel] = (segments[0]["start"], segments[0]["sampling_rate"], samples)
+        return traces
+
+    def stream(self, file_path):
+        """Returns a stored file as an obspy Stream whose traces wrap the memory-mapped chunks."""
+        from obspy import Stream, Trace, UTCDateTime
+        stream = Stream()
+        for segment in self.sources[os.path.basename(file_path)]["segments"]:
+            header = {key: segment[key] for key in ("network", "station", "location", "channel", "sampling_rate")}
+            header["starttime"] = UTCDateTime(segment["start"])
+            stream.append(Trace(data=self.open_chunk(segment), header=header))
+        return stream
+
+    def record(self, file_paths):
+        """
+        Builds an hvsrpy SeismicRecording3C from stored files, like hvsrpy.read does from miniSEED.
+
+        Components are picked by the last letter of the channel code and trimmed to the time
+        range all three share.
+        """
+        import hvsrpy
+        components = {}
+        for file_path in file_paths:
+            for channel, trace in self.traces(file_path).items():
+                component = COMPONENT_CODES.get(channel[-1:])
+                if component is not None:
+                    components[component] = trace
+        missing = [name for name in ("ns", "ew", "vt") if name not in components]
+        if missing:
+            raise ValueError(f"Stored record {file_paths} has no {', '.join(missing)} component")
+        start = max(trace[0] for trace in components.values())
+        end = min(trace[0] + (len(trace[2]) - 1) / trace[1] for trace in components.values())
+
+        series = {}
+        for name, (trace_start, sampling_rate, samples) in components.items():
+            first = int(round((start - trace_start) * sampling_rate))
+            last = int(round((end - trace_start) * sampling_rate)) + 1
+            series[name] = hvsrpy.TimeSeries(samples[first:last], 1 / sampling_rate)
+        file_names = file_paths[0] if len(file_paths) == 1 else list(file_paths)
+        return hvsrpy.SeismicRecording3C(series["ns"], series["ew"], series["vt"],
+                                         meta={"file name(s)": file_names})
+
+    def read(self, file_paths):
+        """
+        Returns hvsrpy records for file_paths in the shape hvsrpy.read accepts: each entry is
+        one file holding three components or a list of per-component files.
+        """
+        return [self.record([entry] if isinstance(entry, str) else list(entry)) for entry in file_paths]
+
+    def contains_all(self, file_paths):
+        """Checks whether every file of an hvsrpy.read-style list is in the store and unchanged."""
+        for entry in file_paths:
+            for file_path in ([entry] if isinstance(entry, str) else entry):
+                if not self.contains(file_path):
+                    return False
+        return True
+
+
+def open_store_for(file_paths):
+    """
+    Returns the ProjectStore of the project directory holding file_paths, or None if there is
+    no store or it does not hold all of them.
+    """
+    first = file_paths[0] if isinstance(file_paths[0], str) else file_paths[0][0]
+    project_path = os.path.dirname(os.path.abspath(first))
+    if not ProjectStore.exists(project_path):
+        return None
+    store = ProjectStore(project_path)
+    return store if store.contains_all(file_paths) else None
@@ -0,0 +1,163 @@
+import fnmatch
+import logging
+import os
+import posixpath
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from obspy import read, Stream, UTCDateTime
+from task_executor import current_task, held, raise_if_cancelled, run_in_task
+
+# Raspberry Shakes keep their miniSEED archive in SeisComP Data Structure (SDS) layout:
+# <root>/<year>/<net>/<sta>/<cha>.D/<net>.<sta>.<loc>.<cha>.D.<year>.<julian day>
+DEFAULT_ARCHIVE_ROOT = "/opt/data/archive"
+DEFAULT_MAX_TRANSFERS = 4
+DEFAULT_MIRROR_DIR = "archive_mirror"
+
+
+def archive_days(start_time, end_time):
+    """Returns (year, julian day) for every UTC day that overlaps [start_time, end_time]."""
+    days = []
+    day = UTCDateTime(start_time.year, julday=start_time.julday)
+    while day <= end_time:
+        days.append((day.year, day.julday))
+        day += 86400
+    return days
+
+
+class ArchiveFetcher:
+    """
+    Fetches waveforms from a Shake's on-device miniSEED archive over SFTP.
+
+    Only the day files that cover the requested window are transferred, up to max_transfers
+    at a time, each over its own SFTP channel of the one SSH session. Day files are kept in
+    mirror_dir and only transferred again if the remote file has changed size, so re-fetching
+    a window of past days costs a directory listing. open_sftp() must return a new
+    paramiko SFTPClient (or anything with listdir_attr, stat, get and close).
+    """
+    def __init__(self, open_sftp, archive_root=DEFAULT_ARCHIVE_ROOT, mirror_dir=DEFAULT_MIRROR_DIR,
+                 max_transfers=DEFAULT_MAX_TRANSFERS):
+        self.open_sftp = open_sftp
+        self.archive_root = archive_root
+        self.mirror_dir = mirror_dir
+        self.max_transfers = max_transfers
+        self.stats = {"files_listed": 0, "files_transferred": 0, "files_reused": 0, "bytes_transferred": 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_communicator(cls, communicator, **kwargs):
+        """Builds a fetcher that opens its SFTP channels on a connected ShakeCommunicator's session."""
+        def open_sftp():
+            if not communicator.is_connected():
+                communicator.reconnect()
+            return communicator.client.open_sftp()
+        return cls(open_sftp, **kwargs)
+
+    def list_day_files(self, params, sftp=None):
+        """
+        Returns [(remote_path, size)] of the archive day files covering a window.
+
+        Channel codes may end in ? or * as with the wave server.
+        """
+        own_sftp = sftp is None
+        sftp = sftp or self.open_sftp()
+        try:
+            loc = params['loc'] if params['loc'] not in ("", "--") else ""
+            files = []
+            for year, julday in archive_days(params['start_time'], params['end_time']):
+                station_dir = posixpath.join(self.archive_root, str(year), params['net'], params['sta'])
+                try:
+                    channel_dirs = [entry.filename for entry in sftp.listdir_attr(station_dir)
+                                    if stat.S_ISDIR(entry.st_mode or 0)
+                                    and fnmatch.fnmatchcase(entry.filename, f"{params['cha']}.D")]
+                except FileNotFoundError:
+                    continue
+                for channel_dir in sorted(channel_dirs):
+                    channel = channel_dir[:-2]
+                    filename = f"{params['net']}.{params['sta']}.{loc}.{channel}.D.{year}.{julday:03d}"
+                    remote_path = posixpath.join(station_dir, channel_dir, filename)
+                    try:
+                        files.append((remote_path, sftp.stat(remote_path).st_size))
+                    except FileNotFoundError:
+                        continue
+            with self._lock:
+                self.stats["files_listed"] += len(files)
+            return files
+        finally:
+            if own_sftp:
+                sftp.close()
+
+    def _mirror_path(self, remote_path):
+        relative = posixpath.relpath(remote_path, self.archive_root)
+        return os.path.join(self.mirror_dir, *relative.split("/"))
+
+    def _transfer(self, files):
+        """Transfers a share of the day files over one SFTP channel and returns their local paths."""
+        sftp = None
+        local_paths = []
+        try:
+            for remote_path, size in files:
+                local_path = self._mirror_path(remote_path)
+                if os.path.exists(local_path) and os.path.getsize(local_path) == size:
+                    with self._lock:
+                        self.stats["files_reused"] += 1
+                    local_paths.append(local_path)
+                    continue
+                raise_if_cancelled()
+                sftp = sftp or self.open_sftp()
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                tmp_path = local_path + ".part"
+                try:
+                    with held(sftp.close):
+                        sftp.get(remote_path, tmp_path)
+                    raise_if_cancelled()
+                except BaseException:
+                    # Don't leave a half-transferred day file behind in the mirror.
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                os.replace(tmp_path, local_path)
+                with self._lock:
+                    self.stats["files_transferred"] += 1
+                    self.stats["bytes_transferred"] += os.path.getsize(local_path)
+                local_paths.append(local_path)
+        finally:
+            if sftp is not None:
+                sftp.close()
+        return local_paths
+
+    def transfer(self, params):
+        """Mirrors the day files covering a window and returns their local paths."""
+        files = self.list_day_files(params)
+        if not files:
+            return []
+        workers = max(1, min(self.max_transfers, len(files)))
+        # Deal the files out round-robin so each channel gets a similar share of the days.
+        shares = [files[i::workers] for i in range(workers)]
+        task = current_task()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sftp-archive") as executor:
+            shares = executor.map(lambda share: run_in_task(task, self._transfer, share), shares)
+            return [path for paths in shares for path in paths]
+
+    def fetch(self, params):
+        """
+        Returns the archived data for a window as a Stream, trimmed locally to the window.
+        """
+        start = time.perf_counter()
+        stream = Stream()
+        for local_path in self.transfer(params):
+            stream += read(local_path, format="MSEED",
+                           starttime=params['start_time'], endtime=params['end_time'])
+        # Day files overlap at midnight; merge the duplicate records without masking gaps.
+        stream.merge(method=-1)
+        stream.trim(params['start_time'], params['end_time'])
+        logging.info(f"Archive fetch of {params['net']}.{params['sta']}.{params['loc']}.{params['cha']} "
+                     f"took {time.perf_counter() - start:.1f} s: {self.stats}")
+        return stream
+
+    def fetch_to_file(self, params, output_file):
+        """Writes the archived data for a window to a miniSEED file and returns a summary dict."""
+        stream = self.fetch(params)
+        stream.write(output_file, format="MSEED")
+        return {"traces": len(stream), "bytes": os.path.getsize(output_file)}
@@ -1,27 +1,30 @@
-import hvsrpy
-from hvsrpy import sesame
+import time
+STARTUP_T0 = time.perf_counter()
 import sys
 import os
 import json
-import keyring
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 from ttkthemes import ThemedTk
-from obspy import UTCDateTime
-import threading
 import queue
 import logging
 from datetime import datetime, timedelta, timezone
-import numpy as np
+from ui_dispatch import QueueDispatcher, append_bounded, DEFAULT_INTERVAL_MS
+from station_schedule import StationSchedule
+from virtual_table import VirtualTable
+from metrics import get_metrics, profile_call, stage
+from task_executor import (TaskExecutor, PRIORITY_BATCH, PRIORITY_INTERACTIVE, QUEUED, RUNNING, CANCELLED, FAILED,
+                           raise_if_cancelled)
 
-# Import the refactored logic
-from time_sync import ShakeCommunicator
-from data_acquisition import fetch_waveforms
-from mhvsr_logic import process_mhvsr, get_default_preprocessing_settings, get_default_processing_settings
+# The scientific stack (obspy, hvsrpy, numpy), paramiko and keyring are imported by the
+# tab or action that first needs them, so the window appears before they are loaded.
+IMPORTS_DONE = time.perf_counter()
 
 PROFILES_FILE = "profiles.json"
 KEYRING_SERVICE = "ShakeFetch"
+# SSH tasks are cancelled if a Shake stops answering for this long.
+SSH_TASK_TIMEOUT = 120
 
 class DateTimePicker(tk.Toplevel):
     def __init__(self, parent, entry_widget):
@@ -76,9 +79,12 @@ class ShakeFetchApp:
         self.shake_communicator = None
         self.profiles = {}
         self.remember_ssh_var = tk.BooleanVar(value=True)
+        self.waveform_cache = None
+        self.profile_next_task_var = tk.BooleanVar(value=False)
 
         # Setup logging
         self.setup_logging()
+        self.create_menu()
 
         # Style
         style = ttk.Style()
@@ -89,6 +95,15 @@ class ShakeFetchApp:
 
         # Queue for thread communication
         self.task_queue = queue.Queue()
+        self.dispatcher = QueueDispatcher(self.task_queue, coalesce=(
+            self.update_ts_output, self.update_da_output, self.update_mf_output, self.update_mhvsr_output))
+
+        # Every worker runs on the executor; tab_tasks holds the task each tab's Cancel button stops.
+        self.executor = TaskExecutor(on_event=lambda event: self.task_queue.put((self.on_task_event, event)))
+        self.tab_tasks = {}
+        self.task_events = {}
+        self.task_status_var = tk.StringVar(value="No tasks running")
+        ttk.Label(self.root, textvariable=self.task_status_var, anchor="w").pack(side="bottom", fill="x", padx=10)
 
         # Create a Notebook widget (for tabs)
         self.notebook = ttk.Notebook(self.root)
@@ -105,19 +120,44 @@ class ShakeFetchApp:
         self.notebook.add(self.multifetch_tab, text="Multifetch")
         self.notebook.add(self.mhvsr_tab, text="MHVSR Analysis")
 
-        # Populate the tabs
-        self.create_time_sync_tab()
-        self.create_data_acquisition_tab()
-        self.create_multifetch_tab()
-        self.create_mhvsr_tab()
+        # Tabs are populated the first time they are selected
+        self.tab_builders = {
+            str(self.time_sync_tab): self.create_time_sync_tab,
+            str(self.data_acquisition_tab): self.create_data_acquisition_tab,
+            str(self.multifetch_tab): self.create_multifetch_tab,
+            str(self.mhvsr_tab): self.create_mhvsr_tab,
+        }
+        self.ensure_tab_built(self.time_sync_tab)
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
 
         # Load profiles
         self.load_profiles()
 
         # Start the queue processor
-        self.root.after(100, self.process_queue)
+        self.root.after(DEFAULT_INTERVAL_MS, self.process_queue)
+        self.root.after_idle(self.report_startup_time)
         logging.info("ShakeFetch application started.")
 
+    def on_tab_changed(self, event):
+        self.ensure_tab_built(self.notebook.select())
+
+    def ensure_tab_built(self, tab):
+        builder = self.tab_builders.pop(str(tab), None)
+        if builder:
+            start = time.perf_counter()
+            builder()
+            logging.info(f"Built tab {self.notebook.tab(tab, 'text')!r} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def build_all_tabs(self):
+        for tab in list(self.tab_builders):
+            self.ensure_tab_built(tab)
+
+    def report_startup_time(self):
+        now = time.perf_counter()
+        report = (f"Startup timing: imports {(IMPORTS_DONE - STARTUP_T0) * 1000:.0f} ms, "
+                  f"time to first window {(now - STARTUP_T0) * 1000:.0f} ms")
+        logging.info(report)
+
     def setup_logging(self):
         if not os.path.exists("logs"):
             os.makedirs("logs")
@@ -125,19 +165,111 @@ class ShakeFetchApp:
                             level=logging.INFO,
                             format="%(asctime)s - %(levelname)s - %(message)s")
 
+    def create_menu(self):
+        menubar = tk.Menu(self.root)
+        diagnostics = tk.Menu(menubar, tearoff=0)
+        diagnostics.add_command(label="Show Metrics", command=self.show_metrics)
+        diagnostics.add_command(label="Export Metrics...", command=self.export_metrics)
+        diagnostics.add_command(label="Reset Metrics", command=get_metrics().reset)
+        diagnostics.add_separator()
+        diagnostics.add_checkbutton(label="Profile Next Task", variable=self.profile_next_task_var)
+        diagnostics.add_command(label="Cancel All Tasks", command=self.cancel_all_tasks)
+        menubar.add_cascade(label="Diagnostics", menu=diagnostics)
+        self.root.config(menu=menubar)
+
+    def show_metrics(self):
+        lines = get_metrics().summary_lines()
+        messagebox.showinfo("Metrics", "\n".join(lines) if lines else "No stages recorded yet.")
+
+    def export_metrics(self):
+        output_file = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("JSON", "*.json"), ("Prometheus text", "*.prom")])
+        if output_file:
+            try:
+                get_metrics().write(output_file)
+                logging.info(f"Metrics exported to {output_file}")
+            except OSError as e:
+                messagebox.showerror("File Save Error", f"Failed to save metrics: {e}")
+
     def process_queue(self):
+        backlog = False
         try:
-            message = self.task_queue.get_nowait()
-            message[0](*message[1:])
-        except queue.Empty:
-            pass
+            backlog = self.dispatcher.drain()
         finally:
-            self.root.after(100, self.process_queue)
-
-    def start_task(self, worker_func, *args):
-        thread = threading.Thread(target=worker_func, args=args)
-        thread.daemon = True
-        thread.start()
+            # Come straight back while a backlog remains, after letting Tk redraw
+            self.root.after(1 if backlog else DEFAULT_INTERVAL_MS, self.process_queue)
+
+    def start_task(self, worker_func, *args, key=None, priority=PRIORITY_INTERACTIVE, timeout=None, **kwargs):
+        """
+        Runs a worker on the task executor and returns its Task.
+
+        key names the tab whose Cancel button stops it (see restore_after_cancel). Each task is
+        timed as its own stage, and "Profile Next Task" profiles just the next one.
+        """
+        name = worker_func.__name__
+        profile = self.profile_next_task_var.get()
+        self.profile_next_task_var.set(False)
+
+        def run():
+            start = time.perf_counter()
+            with stage(f"task.{name}"):
+                if profile:
+                    profile_call(worker_func, *args, name=name, **kwargs)
+                else:
+                    worker_func(*args, **kwargs)
+            logging.info(f"Task {name} finished in {time.perf_counter() - start:.2f} s")
+
+        task = self.executor.submit(run, name=name, priority=priority, timeout=timeout)
+        if key is not None:
+            self.tab_tasks[key] = task
+        return task
+
+    def cancel_task(self, key):
+        task = self.tab_tasks.pop(key, None)
+        if task is not None and task.cancel("cancelled"):
+            logging.info(f"Cancelled task {task.name}")
+            # The task's sockets and processes are already released; give the tab back now.
+            self.restore_after_cancel(key, "cancelled")
+
+    def cancel_all_tasks(self):
+        for key in list(self.tab_tasks):
+            self.cancel_task(key)
+        self.executor.cancel_all()
+
+    def restore_after_cancel(self, key, reason):
+        if key == "da":
+            self.get_waveforms_button.config(state="normal")
+            self.update_da_output(f"Fetch {reason}.\n")
+        elif key == "mf":
+            self.finish_multifetch(f"\nMultifetch {reason}.\n")
+        elif key == "mhvsr":
+            self.finish_mhvsr_batch(f"MHVSR analysis {reason}.\n")
+        elif key == "fleet":
+            self.finish_fleet_sync(f"Fleet sync {reason}.\n")
+
+    def on_task_event(self, event):
+        if event.state in (RUNNING, QUEUED):
+            self.task_events[event.task_id] = event
+        else:
+            self.task_events.pop(event.task_id, None)
+            if event.state in (CANCELLED, FAILED):
+                logging.info(f"Task {event.name} {event.state}: {event.message}")
+            for key, task in list(self.tab_tasks.items()):
+                if task.id == event.task_id:
+                    del self.tab_tasks[key]
+                    # Cancel buttons restore their tab themselves; this catches timeouts.
+                    if event.state == CANCELLED:
+                        self.restore_after_cancel(key, event.message or "cancelled")
+        running = [e for e in self.task_events.values() if e.state == RUNNING]
+        queued = len(self.task_events) - len(running)
+        parts = []
+        for e in running:
+            label = e.name.removesuffix("_worker").replace("_", " ")
+            progress = f" {e.fraction:.0%}" if e.fraction is not None else ""
+            detail = f" ({e.message})" if e.message else ""
+            parts.append(f"{label}{progress}{detail}")
+        status = ("Running: " + ", ".join(parts)) if parts else "No tasks running"
+        self.task_status_var.set(status + (f"; {queued} queued" if queued else ""))
 
     # --- Profile Management ---
     def load_profiles(self):
@@ -167,6 +299,7 @@ class ShakeFetchApp:
             self.update_all_fields(profile_data)
             
             # Retrieve password from keyring
+            import keyring
             password = keyring.get_password(KEYRING_SERVICE, profile_name)
             if password:
                 self.ts_password_entry.delete(0, tk.END)
@@ -174,6 +307,8 @@ class ShakeFetchApp:
             logging.info(f"Loaded profile: {profile_name}")
 
     def update_all_fields(self, data):
+        self.build_all_tabs()
+
         # Helper to update an entry
         def _update_entry(entry, value):
             entry.delete(0, tk.END)
@@ -198,6 +333,7 @@ class ShakeFetchApp:
         _update_entry(self.mf_sta_entry, data.get("mf_sta", "R1E3F"))
         _update_entry(self.mf_loc_entry, data.get("mf_loc", "00"))
         _update_entry(self.mf_cha_entry, data.get("mf_cha", "EH*"))
+        self.mf_parallel_var.set(data.get("mf_parallel", "4"))
 
     def save_profile(self):
         profile_name = self.profile_name_entry.get()
@@ -205,6 +341,8 @@ class ShakeFetchApp:
             messagebox.showerror("Input Error", "Profile Name cannot be empty.")
             return
 
+        import keyring
+        self.build_all_tabs()
         profile_data = {
             "ts_host": self.ts_host_entry.get(),
             "ts_username": self.ts_username_entry.get(),
@@ -220,6 +358,7 @@ class ShakeFetchApp:
             "mf_sta": self.mf_sta_entry.get(),
             "mf_loc": self.mf_loc_entry.get(),
             "mf_cha": self.mf_cha_entry.get(),
+            "mf_parallel": self.mf_parallel_var.get(),
         }
         self.profiles[profile_name] = profile_data
 
@@ -249,6 +388,7 @@ class ShakeFetchApp:
         
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete the profile '{profile_name}'?"):
             if profile_name in self.profiles:
+                import keyring
                 del self.profiles[profile_name]
                 try:
                     keyring.delete_password(KEYRING_SERVICE, profile_name)
@@ -303,6 +443,9 @@ class ShakeFetchApp:
         ttk.Label(input_frame, text="Password:").grid(row=2, column=0, sticky="w", pady=2)
         self.ts_password_entry = ttk.Entry(input_frame, show="*", width=30)
         self.ts_password_entry.grid(row=2, column=1, sticky="ew", padx=5)
+        ttk.Label(input_frame, text="Step Clock if Off by (ms):").grid(row=3, column=0, sticky="w", pady=2)
+        self.ts_threshold_var = tk.StringVar(value="50")
+        ttk.Spinbox(input_frame, from_=0, to=10000, width=7, textvariable=self.ts_threshold_var).grid(row=3, column=1, sticky="w", padx=5)
         input_frame.columnconfigure(1, weight=1)
 
         button_frame = ttk.Frame(self.time_sync_tab)
@@ -314,12 +457,47 @@ class ShakeFetchApp:
         self.sync_time_button = ttk.Button(button_frame, text="Sync Time", command=self.run_sync_time, state="disabled")
         self.sync_time_button.pack(side="left", padx=5)
 
+        self.measure_offset_button = ttk.Button(button_frame, text="Measure Offset", command=self.run_measure_offset, state="disabled")
+        self.measure_offset_button.pack(side="left", padx=5)
+
+        self.drift_monitor_button = ttk.Button(button_frame, text="Monitor Drift", command=self.toggle_drift_monitor, state="disabled")
+        self.drift_monitor_button.pack(side="left", padx=5)
+        self.drift_monitor = None
+
+        self.status_check_button = ttk.Button(button_frame, text="Status Check", command=self.run_status_check, state="disabled")
+        self.status_check_button.pack(side="left", padx=5)
+
         self.disconnect_button = ttk.Button(button_frame, text="Disconnect", command=self.run_disconnect, state="disabled")
         self.disconnect_button.pack(side="left", padx=5)
 
         # Status Indicator
         self.ts_status_label = ttk.Label(self.time_sync_tab, text="Status: Idle", anchor="center")
         self.ts_status_label.pack(fill="x", padx=10, pady=5)
+
+        # --- Fleet Sync Frame ---
+        fleet_frame = ttk.LabelFrame(self.time_sync_tab, text="Fleet Sync", padding=(10, 5))
+        fleet_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Label(fleet_frame, text="Hosts or Profiles:").grid(row=0, column=0, sticky="w", pady=2)
+        self.fleet_hosts_entry = ttk.Entry(fleet_frame)
+        self.fleet_hosts_entry.grid(row=0, column=1, sticky="ew", padx=5)
+        ttk.Label(fleet_frame, text="Workers:").grid(row=0, column=2, sticky="w")
+        self.fleet_workers_var = tk.StringVar(value="8")
+        ttk.Spinbox(fleet_frame, from_=1, to=64, width=5, textvariable=self.fleet_workers_var).grid(row=0, column=3, padx=5)
+        self.fleet_sync_button = ttk.Button(fleet_frame, text="Sync Fleet", command=self.run_fleet_sync)
+        self.fleet_sync_button.grid(row=0, column=4, padx=5)
+        ttk.Button(fleet_frame, text="Cancel", command=lambda: self.cancel_task("fleet")).grid(row=0, column=5, padx=5)
+
+        fleet_columns = ("Host", "Outcome", "Connect (ms)", "Sync (ms)", "Total (ms)", "Message")
+        self.fleet_table = ttk.Treeview(fleet_frame, columns=fleet_columns, show="headings", height=5)
+        for column in fleet_columns:
+            self.fleet_table.heading(column, text=column)
+            self.fleet_table.column(column, width=260 if column == "Message" else 90, stretch=column == "Message")
+        fleet_scrollbar = ttk.Scrollbar(fleet_frame, orient="vertical", command=self.fleet_table.yview)
+        self.fleet_table.configure(yscrollcommand=fleet_scrollbar.set)
+        self.fleet_table.grid(row=1, column=0, columnspan=5, sticky="ew", pady=(5, 0))
+        fleet_scrollbar.grid(row=1, column=5, sticky="ns", pady=(5, 0))
+        fleet_frame.columnconfigure(1, weight=1)
+
         output_frame = ttk.LabelFrame(self.time_sync_tab, text="Output", padding=(10, 5))
         output_frame.pack(padx=10, pady=(0, 10), expand=True, fill="both")
         self.ts_output_text = scrolledtext.ScrolledText(output_frame, width=70, height=10, wrap=tk.WORD)
@@ -335,6 +513,7 @@ class ShakeFetchApp:
             messagebox.showerror("Input Error", "All fields are required.")
             return
         
+        from time_sync import ShakeCommunicator
         self.shake_communicator = ShakeCommunicator(host, username, password)
         
         logging.info(f"Attempting to connect to {host} for user {username}.")
@@ -342,7 +521,7 @@ class ShakeFetchApp:
         self.update_ts_status("Connecting...", "blue")
         self.ts_output_text.delete('1.0', tk.END)
         self.ts_output_text.insert(tk.INSERT, f"Attempting to connect to {host}...\n\n")
-        self.start_task(self.connect_worker)
+        self.start_task(self.connect_worker, timeout=SSH_TASK_TIMEOUT)
 
     def connect_worker(self):
         try:
@@ -358,6 +537,9 @@ class ShakeFetchApp:
         if "successful" in result.lower():
             self.update_ts_status("Connected", "green")
             self.sync_time_button.config(state="normal")
+            self.measure_offset_button.config(state="normal")
+            self.drift_monitor_button.config(state="normal")
+            self.status_check_button.config(state="normal")
             self.disconnect_button.config(state="normal")
             self.connect_button.config(state="disabled")
         else:
@@ -369,8 +551,12 @@ class ShakeFetchApp:
         logging.info("'Disconnect' button clicked.")
         self.disconnect_button.config(state="disabled")
         self.sync_time_button.config(state="disabled")
+        self.measure_offset_button.config(state="disabled")
+        self.drift_monitor_button.config(state="disabled")
+        self.status_check_button.config(state="disabled")
+        self.stop_drift_monitor()
         self.update_ts_status("Disconnecting...", "blue")
-        self.start_task(self.disconnect_worker)
+        self.start_task(self.disconnect_worker, timeout=SSH_TASK_TIMEOUT)
 
     def disconnect_worker(self):
         try:
@@ -386,19 +572,34 @@ class ShakeFetchApp:
         self.update_ts_status("Disconnected", "red")
         self.connect_button.config(state="normal")
         self.sync_time_button.config(state="disabled")
+        self.measure_offset_button.config(state="disabled")
+        self.drift_monitor_button.config(state="disabled")
+        self.status_check_button.config(state="disabled")
         self.disconnect_button.config(state="disabled")
         self.shake_communicator = None
 
+    def get_step_threshold(self):
+        """Returns the clock step threshold in seconds."""
+        threshold = float(self.ts_threshold_var.get()) / 1000
+        if threshold < 0:
+            raise ValueError("The step threshold cannot be negative.")
+        return threshold
+
     def run_sync_time(self):
         logging.info("'Sync Time' button clicked.")
+        try:
+            threshold = self.get_step_threshold()
+        except ValueError as e:
+            messagebox.showerror("Input Error", f"Invalid step threshold: {e}")
+            return
         self.sync_time_button.config(state="disabled")
         self.update_ts_status("Syncing time...", "blue")
         self.ts_output_text.insert(tk.INSERT, "Attempting to sync time...\n\n")
-        self.start_task(self.sync_time_worker)
+        self.start_task(self.sync_time_worker, threshold, timeout=SSH_TASK_TIMEOUT)
 
-    def sync_time_worker(self):
+    def sync_time_worker(self, threshold):
         try:
-            result = self.shake_communicator.set_time_utc()
+            result = self.shake_communicator.set_time_utc(threshold)
             logging.info(f"Time sync result: {result}")
             self.task_queue.put((self.on_sync_time_result, result))
         except Exception as e:
@@ -413,6 +614,143 @@ class ShakeFetchApp:
         else:
             self.update_ts_status("Connected", "green")
 
+    def run_fleet_sync(self):
+        names = self.fleet_hosts_entry.get().replace(",", " ").split()
+        if not names:
+            messagebox.showerror("Input Error", "Enter at least one host or profile name.")
+            return
+        try:
+            max_workers = int(self.fleet_workers_var.get())
+            if max_workers < 1:
+                raise ValueError("Workers must be at least 1.")
+            threshold = self.get_step_threshold()
+        except ValueError as e:
+            messagebox.showerror("Input Error", f"Invalid fleet sync settings: {e}")
+            return
+
+        self.fleet_sync_button.config(state="disabled")
+        self.fleet_table.delete(*self.fleet_table.get_children())
+        for index, name in enumerate(names):
+            self.fleet_table.insert("", "end", iid=str(index), values=(name, "Pending", "", "", "", ""))
+        self.ts_output_text.insert(tk.INSERT, f"Syncing {len(names)} Shakes, {max_workers} at a time...\n")
+        logging.info(f"Starting fleet sync of {len(names)} hosts with {max_workers} workers.")
+        self.start_task(self.fleet_sync_worker, names, self.ts_username_entry.get(),
+                        self.ts_password_entry.get(), max_workers, threshold, key="fleet", priority=PRIORITY_BATCH)
+
+    def fleet_target(self, name, username, password):
+        """Returns (host, username, password) for a saved profile name or a plain host name."""
+        profile = self.profiles.get(name)
+        if profile is None:
+            return name, username, password
+        import keyring
+        return (profile.get("ts_host", name), profile.get("ts_username", username),
+                keyring.get_password(KEYRING_SERVICE, name) or password)
+
+    def fleet_sync_worker(self, names, username, password, max_workers, threshold):
+        from time_sync import sync_fleet, get_session_pool
+        try:
+            targets = [self.fleet_target(name, username, password) for name in names]
+            start = time.perf_counter()
+            # Sessions stay in the pool, so syncing the fleet again skips the SSH handshakes.
+            results = sync_fleet(targets, max_workers=max_workers, threshold=threshold, pool=get_session_pool(),
+                                 on_result=lambda index, result: self.task_queue.put((self.on_fleet_result, index, result)))
+            failed = sum(not result.ok for result in results)
+            self.task_queue.put((self.finish_fleet_sync,
+                                 f"Fleet sync finished in {time.perf_counter() - start:.1f} s: "
+                                 f"{len(results) - failed} synced, {failed} failed.\n"))
+        except Exception as e:
+            logging.error(f"Fleet sync error: {e}", exc_info=True)
+            self.task_queue.put((self.finish_fleet_sync, f"Fleet sync error: {e}\n"))
+
+    def on_fleet_result(self, index, result):
+        def ms(seconds):
+            return f"{seconds * 1000:.0f}" if seconds is not None else ""
+        self.fleet_table.item(str(index), values=(result.host, "Synced" if result.ok else "Failed",
+                                                  ms(result.connect_seconds), ms(result.sync_seconds),
+                                                  ms(result.total_seconds), " ".join(result.message.split())))
+        logging.info(f"Fleet sync {result.host}: {'ok' if result.ok else 'failed'} in {ms(result.total_seconds)} ms: {result.message}")
+
+    def finish_fleet_sync(self, text):
+        self.ts_output_text.insert(tk.END, text)
+        self.fleet_sync_button.config(state="normal")
+
+    def run_measure_offset(self):
+        self.measure_offset_button.config(state="disabled")
+        self.start_task(self.measure_offset_worker, timeout=SSH_TASK_TIMEOUT)
+
+    def measure_offset_worker(self):
+        try:
+            offset = self.shake_communicator.measure_offset()
+            logging.info(f"{self.shake_communicator.host}: {offset}")
+            self.task_queue.put((self.on_measure_offset_result, f"{offset}\n"))
+        except Exception as e:
+            logging.error(f"Offset measurement error: {e}", exc_info=True)
+            self.task_queue.put((self.on_measure_offset_result, f"Offset measurement failed: {e}\n"))
+
+    def on_measure_offset_result(self, text):
+        self.ts_output_text.insert(tk.END, text)
+        if self.shake_communicator is not None:
+            self.measure_offset_button.config(state="normal")
+
+    def run_status_check(self):
+        self.status_check_button.config(state="disabled")
+        self.start_task(self.status_check_worker, timeout=SSH_TASK_TIMEOUT)
+
+    def status_check_worker(self):
+        try:
+            start = time.perf_counter()
+            results = self.shake_communicator.status()
+            lines = [f"Status of {self.shake_communicator.host} ({len(results)} commands on one session, "
+                     f"{(time.perf_counter() - start) * 1000:.0f} ms):"]
+            for name, result in results.items():
+                if isinstance(result, Exception):
+                    lines.append(f"  {name}: failed: {result}")
+                else:
+                    output = " ".join((result.stdout or result.stderr).split())
+                    lines.append(f"  {name} ({result.latency * 1000:.0f} ms): {output}")
+            self.task_queue.put((self.on_status_check_result, "\n".join(lines) + "\n"))
+        except Exception as e:
+            logging.error(f"Status check error: {e}", exc_info=True)
+            self.task_queue.put((self.on_status_check_result, f"Status check failed: {e}\n"))
+
+    def on_status_check_result(self, text):
+        self.update_ts_output(text)
+        if self.shake_communicator is not None:
+            self.status_check_button.config(state="normal")
+
+    def toggle_drift_monitor(self):
+        if self.drift_monitor is not None and self.drift_monitor.running:
+            self.stop_drift_monitor()
+            return
+        from time_sync import ClockDriftMonitor
+        self.drift_monitor = ClockDriftMonitor(
+            self.shake_communicator,
+            on_update=lambda measurement, drift: self.task_queue.put((self.on_drift_update, measurement, drift)),
+            on_error=lambda e: self.task_queue.put((self.update_ts_output, f"Drift measurement failed: {e}\n")))
+        self.drift_monitor.start()
+        self.drift_monitor_button.config(text="Stop Drift Monitor")
+        self.update_ts_output(f"Measuring clock offset every {self.drift_monitor.interval:.0f} s...\n")
+
+    def stop_drift_monitor(self):
+        if self.drift_monitor is None:
+            return
+        # Don't wait for an in-flight measurement; the thread exits once it returns.
+        self.drift_monitor.stop(timeout=0)
+        history = self.drift_monitor.offset_history()
+        self.drift_monitor = None
+        self.drift_monitor_button.config(text="Monitor Drift")
+        if history:
+            offsets = [offset for _, offset, _ in history]
+            self.update_ts_output(f"Drift monitor stopped after {len(history)} measurements, offset "
+                                  f"{min(offsets) * 1000:+.1f} to {max(offsets) * 1000:+.1f} ms.\n")
+
+    def on_drift_update(self, measurement, drift):
+        drift_text = f", drift {drift:+.2f} ppm" if drift is not None else ""
+        self.update_ts_output(f"{measurement.measured_at.strftime('%H:%M:%S')} {measurement}{drift_text}\n")
+
+    def update_ts_output(self, text):
+        append_bounded(self.ts_output_text, text)
+
     def update_ts_status(self, status, color):
         self.ts_status_label.config(text=f"Status: {status}", foreground=color)
 
@@ -470,23 +808,55 @@ class ShakeFetchApp:
         self.da_start_entry.insert(0, start_time)
         self.da_end_entry.insert(0, end_time)
 
+        # Chunked streaming to disk for long windows
+        ttk.Label(input_frame, text="Chunk Length (min):").grid(row=8, column=0, sticky="w", pady=2)
+        stream_frame = ttk.Frame(input_frame)
+        stream_frame.grid(row=8, column=1, sticky="ew", padx=5)
+        self.da_chunk_minutes = tk.StringVar(value="60")
+        ttk.Spinbox(stream_frame, from_=1, to=1440, width=7, textvariable=self.da_chunk_minutes).pack(side="left")
+        self.da_stream_to_disk_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="Stream to disk in chunks", variable=self.da_stream_to_disk_var).pack(side="left", padx=10)
+        self.da_use_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="Use local cache", variable=self.da_use_cache_var).pack(side="left", padx=10)
+        self.da_from_archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stream_frame, text="From Shake archive (SFTP)", variable=self.da_from_archive_var).pack(side="left", padx=10)
+
+        # Continuous acquisition into rolling files
+        ttk.Label(input_frame, text="Continuous Files:").grid(row=9, column=0, sticky="w", pady=2)
+        continuous_frame = ttk.Frame(input_frame)
+        continuous_frame.grid(row=9, column=1, sticky="ew", padx=5)
+        ttk.Label(continuous_frame, text="New file every", padding=0).pack(side="left")
+        self.da_rotation_var = tk.StringVar(value="day")
+        ttk.Combobox(continuous_frame, textvariable=self.da_rotation_var, values=("hour", "day"), state="readonly", width=6).pack(side="left", padx=5)
+        ttk.Label(continuous_frame, text="Poll every (s):", padding=0).pack(side="left", padx=(10, 0))
+        self.da_poll_seconds = tk.StringVar(value="10")
+        ttk.Spinbox(continuous_frame, from_=1, to=3600, width=7, textvariable=self.da_poll_seconds).pack(side="left", padx=5)
+
         input_frame.columnconfigure(1, weight=1)
         button_frame = ttk.Frame(self.data_acquisition_tab)
         button_frame.pack(pady=5)
         self.get_waveforms_button = ttk.Button(button_frame, text="Get Waveforms", command=self.run_get_waveforms)
         self.get_waveforms_button.pack(side="left", padx=5)
+        ttk.Button(button_frame, text="Cancel", command=lambda: self.cancel_task("da")).pack(side="left", padx=5)
         self.plot_waveforms_button = ttk.Button(button_frame, text="Plot Waveforms", command=self.plot_waveforms)
         self.plot_waveforms_button.pack(side="left", padx=5)
+        self.continuous_button = ttk.Button(button_frame, text="Start Continuous", command=self.toggle_continuous_acquisition)
+        self.continuous_button.pack(side="left", padx=5)
+        self.continuous_acquisition = None
+        self.da_continuous_status = tk.StringVar(value="")
+        ttk.Label(self.data_acquisition_tab, textvariable=self.da_continuous_status).pack(padx=10, anchor="w")
         output_frame = ttk.LabelFrame(self.data_acquisition_tab, text="Output", padding=(10, 5))
         output_frame.pack(padx=10, pady=(0, 10), expand=True, fill="both")
         self.da_output_text = scrolledtext.ScrolledText(output_frame, width=70, height=10, wrap=tk.WORD)
         self.da_output_text.pack(expand=True, fill="both")
         self.stream = None
+        self.waveform_viewer = None
 
     def open_datetime_picker(self, entry_widget):
         DateTimePicker(self.root, entry_widget)
 
     def run_get_waveforms(self):
+        from obspy import UTCDateTime
         try:
             params = {
                 "host": self.da_host_entry.get(), "port": int(self.da_port_entry.get()),
@@ -495,22 +865,89 @@ class ShakeFetchApp:
                 "start_time": UTCDateTime(self.da_start_entry.get()),
                 "end_time": UTCDateTime(self.da_end_entry.get())
             }
+            if self.da_stream_to_disk_var.get():
+                chunk_seconds = int(self.da_chunk_minutes.get()) * 60
+                output_file = filedialog.asksaveasfilename(defaultextension=".mseed", filetypes=[("MSEED files", "*.mseed")])
+                if not output_file:
+                    return
+            if self.da_from_archive_var.get():
+                # The archive is read over SSH with the Shake Connection tab's credentials.
+                self.ensure_tab_built(self.time_sync_tab)
+                ssh = (self.ts_host_entry.get(), self.ts_username_entry.get(), self.ts_password_entry.get())
+                if not all(ssh):
+                    messagebox.showerror("Input Error", "Enter the SSH host, username and password on the Shake Connection tab to read the archive.")
+                    return
             self.get_waveforms_button.config(state="disabled")
             self.da_output_text.delete('1.0', tk.END)
             self.da_output_text.insert(tk.INSERT, f"Connecting to {params['host']}:{params['port']}...\n")
-            self.start_task(self.get_waveforms_worker, params)
+            cache = self.get_waveform_cache() if self.da_use_cache_var.get() else None
+            if self.da_from_archive_var.get():
+                self.start_task(self.archive_waveforms_worker, params, ssh,
+                                output_file if self.da_stream_to_disk_var.get() else None, key="da")
+            elif self.da_stream_to_disk_var.get():
+                self.start_task(self.stream_waveforms_worker, params, output_file, chunk_seconds, cache, key="da")
+            else:
+                self.start_task(self.get_waveforms_worker, params, cache, key="da")
         except Exception as e:
             messagebox.showerror("Error", f"Invalid input: {e}")
             self.get_waveforms_button.config(state="normal")
 
-    def get_waveforms_worker(self, params):
+    def get_waveforms_worker(self, params, cache=None):
+        from data_acquisition import fetch_waveforms, get_connection_pool
         try:
             self.task_queue.put((self.update_da_output, f"Fetching waveforms for {params['net']}.{params['sta']}.{params['loc']}.{params['cha']}...\n"))
-            stream = fetch_waveforms(params)
+            stream = fetch_waveforms(params, cache=cache)
+            raise_if_cancelled()
+            logging.info(f"Connection pool stats: {get_connection_pool().stats()}")
+            if cache is not None:
+                self.task_queue.put((self.update_da_output, self.format_cache_stats()))
             self.task_queue.put((self.finish_get_waveforms, stream))
         except Exception as e:
             self.task_queue.put((self.handle_error, "Waveform Fetch Error", e))
 
+    def stream_waveforms_worker(self, params, output_file, chunk_seconds, cache=None):
+        from data_acquisition import fetch_waveforms_to_file
+        try:
+            self.task_queue.put((self.update_da_output, f"Streaming waveforms for {params['net']}.{params['sta']}.{params['loc']}.{params['cha']} to {output_file}...\n"))
+
+            def on_chunk(index, count, stream):
+                self.task_queue.put((self.update_da_output, f"  Chunk {index}/{count}: wrote {len(stream)} traces.\n"))
+
+            summary = fetch_waveforms_to_file(params, output_file, chunk_seconds=chunk_seconds,
+                                              progress_callback=on_chunk, cache=cache)
+            if cache is not None:
+                self.task_queue.put((self.update_da_output, self.format_cache_stats()))
+            self.task_queue.put((self.finish_stream_waveforms, output_file, summary))
+        except Exception as e:
+            self.task_queue.put((self.handle_error, "Waveform Fetch Error", e))
+
+    def archive_waveforms_worker(self, params, ssh, output_file=None):
+        from time_sync import get_session_pool
+        from sftp_archive import ArchiveFetcher
+        try:
+            self.task_queue.put((self.update_da_output, f"Reading {params['net']}.{params['sta']}.{params['loc']}.{params['cha']} from the archive on {ssh[0]} over SFTP...\n"))
+            fetcher = ArchiveFetcher.from_communicator(get_session_pool().get(*ssh))
+            stream = fetcher.fetch(params)
+            stats = fetcher.stats
+            self.task_queue.put((self.update_da_output,
+                                 f"Archive: {stats['files_transferred']} day files transferred "
+                                 f"({stats['bytes_transferred'] / 1e6:.2f} MB), {stats['files_reused']} already mirrored.\n"))
+            if output_file:
+                stream.write(output_file, format="MSEED")
+                self.task_queue.put((self.finish_stream_waveforms, output_file,
+                                     {"chunks": 1, "bytes": os.path.getsize(output_file)}))
+            else:
+                self.task_queue.put((self.finish_get_waveforms, stream))
+        except Exception as e:
+            self.task_queue.put((self.handle_error, "Waveform Fetch Error", e))
+
+    def finish_stream_waveforms(self, output_file, summary):
+        # Long windows are never held in memory, so there is no stream to plot.
+        self.stream = None
+        self.da_output_text.insert(tk.INSERT, f"Stream saved to {output_file} ({summary['chunks']} chunks, {summary['bytes'] / 1e6:.2f} MB)\n")
+        logging.info(f"Stream successfully streamed to {output_file}: {summary}")
+        self.get_waveforms_button.config(state="normal")
+
     def finish_get_waveforms(self, stream):
         self.stream = stream
         self.da_output_text.insert(tk.INSERT, "Waveforms fetched successfully.\n")
@@ -526,19 +963,82 @@ class ShakeFetchApp:
                 logging.error(f"Failed to save stream to {output_file}: {e}", exc_info=True)
                 messagebox.showerror("File Save Error", f"Failed to save file: {e}")
 
+    def toggle_continuous_acquisition(self):
+        if self.continuous_acquisition is not None and self.continuous_acquisition.running:
+            # Don't wait for an in-flight poll; the thread closes its file once it returns.
+            self.continuous_acquisition.stop(timeout=0)
+            self.continuous_acquisition = None
+            self.continuous_button.config(text="Start Continuous")
+            self.update_da_output("Continuous acquisition stopped.\n")
+            return
+
+        from continuous_acquisition import ContinuousAcquisition
+        try:
+            params = {
+                "host": self.da_host_entry.get(), "port": int(self.da_port_entry.get()),
+                "net": self.da_net_entry.get(), "sta": self.da_sta_entry.get(),
+                "loc": self.da_loc_entry.get(), "cha": self.da_cha_entry.get(),
+            }
+            poll_interval = float(self.da_poll_seconds.get())
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Error", f"Invalid input: {e}")
+            return
+        output_dir = filedialog.askdirectory(title="Continuous Acquisition Output Directory")
+        if not output_dir:
+            return
+
+        try:
+            self.continuous_acquisition = ContinuousAcquisition(
+                params, output_dir, rotation=self.da_rotation_var.get(), poll_interval=poll_interval,
+                on_update=lambda snapshot: self.task_queue.put((self.on_continuous_update, snapshot)),
+                on_error=lambda e: self.task_queue.put((self.update_da_output, f"Continuous poll failed: {e}\n")))
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not start continuous acquisition: {e}")
+            return
+        self.continuous_acquisition.start()
+        self.continuous_button.config(text="Stop Continuous")
+        self.update_da_output(f"Continuous acquisition from {params['host']}:{params['port']} into {output_dir}, "
+                              f"one file per {self.da_rotation_var.get()}...\n")
+        logging.info(f"Started continuous acquisition into {output_dir}")
+
+    def on_continuous_update(self, snapshot):
+        from continuous_acquisition import AcquisitionStats
+        self.da_continuous_status.set("Continuous: " + AcquisitionStats.format(snapshot))
+
+    def get_waveform_cache(self):
+        if self.waveform_cache is None:
+            from waveform_cache import WaveformCache
+            self.waveform_cache = WaveformCache()
+        return self.waveform_cache
+
+    def format_cache_stats(self):
+        stats = self.get_waveform_cache().get_stats()
+        return (f"Cache: {stats['hits']} hits, {stats['partial_hits']} partial, {stats['misses']} misses, "
+                f"{stats['bytes_from_cache'] / 1e6:.2f} MB from cache, {stats['bytes_fetched'] / 1e6:.2f} MB fetched, "
+                f"{stats['total_bytes'] / 1e6:.2f} MB held\n")
+
     def update_da_output(self, text):
-        self.da_output_text.insert(tk.INSERT, text)
+        append_bounded(self.da_output_text, text)
 
     def plot_waveforms(self):
         if self.stream:
-            self.stream.plot()
+            if self.waveform_viewer is None:
+                # matplotlib is only imported once there is something to plot.
+                from waveform_viewer import WaveformViewer
+                viewer_frame = ttk.LabelFrame(self.data_acquisition_tab, text="Waveform Viewer (scroll to zoom, drag to pan, double-click to reset)", padding=(10, 5))
+                viewer_frame.pack(padx=10, pady=(0, 10), expand=True, fill="both")
+                self.waveform_viewer = WaveformViewer(viewer_frame)
+                self.waveform_viewer.pack(expand=True, fill="both")
+            self.waveform_viewer.set_stream(self.stream)
         else:
             messagebox.showinfo("No Data", "No waveform data to plot. Please fetch waveforms first.")
 
     def handle_error(self, title, error):
         messagebox.showerror(title, str(error))
-        self.run_mhvsr_button.config(state="normal")
-        if title == "Connection Error":
+        if title == "MHVSR Error":
+            self.run_mhvsr_button.config(state="normal")
+            self.batch_mhvsr_button.config(state="normal")
+        elif title == "Connection Error":
             self.connect_button.config(state="normal")
             self.update_ts_status("Failed", "red")
         elif title == "Disconnect Error":
@@ -549,6 +1049,9 @@ class ShakeFetchApp:
             self.update_ts_status("Error", "red")
         elif title == "Waveform Fetch Error":
             self.get_waveforms_button.config(state="normal")
+        elif title == "Multifetch Error":
+            self.mf_fetch_all_button.config(state="normal")
+            self.mf_resume_button.config(state="normal")
 
     # --- Multifetch Tab ---
     def create_multifetch_tab(self):
@@ -581,6 +1084,9 @@ class ShakeFetchApp:
         
         self.mf_set_stations_button = ttk.Button(project_frame, text="Generate Station Inputs", command=self.generate_station_inputs)
         self.mf_set_stations_button.grid(row=2, column=2, padx=5, pady=5)
+
+        self.mf_import_button = ttk.Button(project_frame, text="Import Schedule...", command=self.import_station_schedule)
+        self.mf_import_button.grid(row=3, column=2, padx=5, pady=5)
         
         project_frame.columnconfigure(1, weight=1)
 
@@ -617,36 +1123,48 @@ class ShakeFetchApp:
         self.mf_cha_entry = ttk.Entry(conn_frame)
         self.mf_cha_entry.grid(row=5, column=1, sticky="ew", padx=5)
         self.mf_cha_entry.insert(0, "EH*")
-        
-        conn_frame.columnconfigure(1, weight=1)
 
-        # --- Frame to hold the scrollable station inputs ---
-        canvas_frame = ttk.LabelFrame(main_frame, text="Station Time Windows", padding=(10, 5))
-        canvas_frame.pack(fill="both", expand=True, padx=10, pady=5)
+        ttk.Label(conn_frame, text="Parallel Fetches per Host:").grid(row=6, column=0, sticky="w", pady=2)
+        self.mf_parallel_var = tk.StringVar(value="4")
+        ttk.Spinbox(conn_frame, from_=1, to=32, width=7, textvariable=self.mf_parallel_var).grid(row=6, column=1, sticky="w", padx=5)
+
+        ttk.Label(conn_frame, text="Chunk Length (min):").grid(row=7, column=0, sticky="w", pady=2)
+        mf_stream_frame = ttk.Frame(conn_frame)
+        mf_stream_frame.grid(row=7, column=1, sticky="ew", padx=5)
+        self.mf_chunk_minutes = tk.StringVar(value="60")
+        ttk.Spinbox(mf_stream_frame, from_=1, to=1440, width=7, textvariable=self.mf_chunk_minutes).pack(side="left")
+        self.mf_stream_to_disk_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(mf_stream_frame, text="Stream to disk", variable=self.mf_stream_to_disk_var).pack(side="left", padx=10)
+        self.mf_use_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(mf_stream_frame, text="Use local cache", variable=self.mf_use_cache_var).pack(side="left", padx=10)
+        self.mf_build_store_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(mf_stream_frame, text="Build project store", variable=self.mf_build_store_var).pack(side="left", padx=10)
+
+        ttk.Label(conn_frame, text="Gap Refill Attempts:").grid(row=8, column=0, sticky="w", pady=2)
+        self.mf_refill_attempts_var = tk.StringVar(value="3")
+        ttk.Spinbox(conn_frame, from_=0, to=10, width=7, textvariable=self.mf_refill_attempts_var).grid(row=8, column=1, sticky="w", padx=5)
         
-        self.stations_canvas = tk.Canvas(canvas_frame)
-        scrollbar = ttk.Scrollbar(canvas_frame, orient="vertical", command=self.stations_canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.stations_canvas)
-
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.stations_canvas.configure(scrollregion=self.stations_canvas.bbox("all"))
-        )
-
-        self.stations_canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.stations_canvas.configure(yscrollcommand=scrollbar.set)
+        conn_frame.columnconfigure(1, weight=1)
 
-        self.stations_canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # --- Station time windows, shown in a virtualized table ---
+        table_frame = ttk.LabelFrame(main_frame, text="Station Time Windows (double-click a time to edit)", padding=(10, 5))
+        table_frame.pack(fill="both", expand=True, padx=10, pady=5)
 
-        self.station_widgets = []
+        self.mf_schedule = StationSchedule()
+        self.mf_schedule_table = VirtualTable(table_frame, self.mf_schedule, column_widths={"Station": 80})
+        self.mf_schedule_table.pack(fill="both", expand=True)
 
         # --- Bottom frame for controls and output ---
         bottom_frame = ttk.Frame(main_frame)
         bottom_frame.pack(fill="x", side="bottom", padx=10, pady=(0, 10))
 
-        self.mf_fetch_all_button = ttk.Button(bottom_frame, text="Fetch All Waveforms", command=self.run_multifetch)
-        self.mf_fetch_all_button.pack(pady=5)
+        mf_button_frame = ttk.Frame(bottom_frame)
+        mf_button_frame.pack(pady=5)
+        self.mf_fetch_all_button = ttk.Button(mf_button_frame, text="Fetch All Waveforms", command=self.run_multifetch)
+        self.mf_fetch_all_button.pack(side="left", padx=5)
+        self.mf_resume_button = ttk.Button(mf_button_frame, text="Resume Project", command=self.resume_multifetch)
+        self.mf_resume_button.pack(side="left", padx=5)
+        ttk.Button(mf_button_frame, text="Cancel", command=lambda: self.cancel_task("mf")).pack(side="left", padx=5)
 
         output_frame = ttk.LabelFrame(bottom_frame, text="Output", padding=(10, 5))
         output_frame.pack(fill="both", expand=True)
@@ -660,43 +1178,40 @@ class ShakeFetchApp:
             self.mf_project_dir_entry.insert(0, directory)
 
     def generate_station_inputs(self):
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        self.station_widgets = []
-
         try:
             num_stations = int(self.mf_station_count_spinbox.get())
         except (ValueError, tk.TclError):
             messagebox.showerror("Input Error", "Number of stations must be a valid integer.")
             return
 
-        for i in range(num_stations):
-            station_frame = ttk.Frame(self.scrollable_frame, padding=5)
-            station_frame.pack(fill="x", padx=5, pady=5, expand=True)
-            
-            ttk.Label(station_frame, text=f"Station {i+1}:").grid(row=0, column=0, sticky="w")
-            
-            # Start Time
-            ttk.Label(station_frame, text="Start Time (UTC):").grid(row=0, column=1, sticky="w", padx=(10, 0))
-            start_time_entry = ttk.Entry(station_frame, width=22)
-            start_time_entry.grid(row=0, column=2, sticky="ew")
-            start_btn = ttk.Button(station_frame, text="...", width=3, command=lambda e=start_time_entry: self.open_datetime_picker(e))
-            start_btn.grid(row=0, column=3, padx=5)
-
-            # End Time
-            ttk.Label(station_frame, text="End Time (UTC):").grid(row=0, column=4, sticky="w", padx=(10, 0))
-            end_time_entry = ttk.Entry(station_frame, width=22)
-            end_time_entry.grid(row=0, column=5, sticky="ew")
-            end_btn = ttk.Button(station_frame, text="...", width=3, command=lambda e=end_time_entry: self.open_datetime_picker(e))
-            end_btn.grid(row=0, column=6, padx=5)
-            
-            now = datetime.now(timezone.utc)
-            start_time_entry.insert(0, now.strftime("%Y-%m-%dT%H:%M:%S"))
-            end_time_entry.insert(0, (now + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%S"))
+        self.mf_schedule = StationSchedule.uniform(num_stations)
+        self.mf_schedule_table.set_model(self.mf_schedule)
+
+    def import_station_schedule(self):
+        from station_schedule import load_schedule
+        path = filedialog.askopenfilename(title="Import Station Schedule",
+                                          filetypes=[("Schedule files", "*.csv *.json"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            schedule = load_schedule(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Error", f"Could not import {os.path.basename(path)}:\n{e}")
+            return
 
-            self.station_widgets.append({"start": start_time_entry, "end": end_time_entry})
-            station_frame.columnconfigure(2, weight=1)
-            station_frame.columnconfigure(5, weight=1)
+        self.mf_schedule = schedule
+        self.mf_schedule_table.set_model(self.mf_schedule)
+        self.mf_output_text.delete('1.0', tk.END)
+        self.mf_output_text.insert(tk.INSERT, f"Imported {len(schedule)} station windows from {path}\n")
+        logging.info(f"Imported {len(schedule)} station windows from {path}")
+        try:
+            base_params, _ = self.get_multifetch_options()
+        except (ValueError, tk.TclError):
+            base_params = None
+        report = schedule.validate(base_params)
+        self.mf_output_text.insert(tk.INSERT, report.summary() + "\n")
+        for line in report.lines():
+            self.mf_output_text.insert(tk.INSERT, f"  {line}\n")
 
     def run_multifetch(self):
         project_name = self.mf_project_name_entry.get()
@@ -706,88 +1221,131 @@ class ShakeFetchApp:
             messagebox.showerror("Input Error", "Project Name and Project Directory are required.")
             return
 
-        if not self.station_widgets:
+        if not len(self.mf_schedule):
             messagebox.showerror("Input Error", "Please generate station inputs first.")
             return
         
         try:
-            base_params = {
-                "host": self.mf_host_entry.get(), "port": int(self.mf_port_entry.get()),
-                "net": self.mf_net_entry.get(), "sta": self.mf_sta_entry.get(),
-                "loc": self.mf_loc_entry.get(), "cha": self.mf_cha_entry.get(),
-            }
+            base_params, options = self.get_multifetch_options()
         except (ValueError, tk.TclError) as e:
             messagebox.showerror("Input Error", f"Invalid Shake Connection Details: {e}")
             return
 
-        all_params = []
-        for i, station in enumerate(self.station_widgets):
-            try:
-                start_time = UTCDateTime(station["start"].get())
-                end_time = UTCDateTime(station["end"].get())
-                
-                # Create a copy of base_params and update it
-                params = base_params.copy()
-                params.update({
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "station_num": i + 1
-                })
-                all_params.append(params)
-            except Exception as e:
-                messagebox.showerror("Input Error", f"Invalid date/time for Station {i+1}: {e}")
-                return
-                
+        # Times are parsed as they are edited or imported; only their order is left to check.
+        report = self.mf_schedule.validate(base_params)
+        if not report.ok:
+            messagebox.showerror("Input Error", "Some windows end before they start or repeat a station number:\n"
+                                 + "\n".join(report.lines(limit=10)))
+            return
+        all_params = self.mf_schedule.all_params(base_params)
+
         self.mf_fetch_all_button.config(state="disabled")
+        self.mf_resume_button.config(state="disabled")
         self.mf_output_text.delete('1.0', tk.END)
         self.mf_output_text.insert(tk.INSERT, f"Starting multifetch for project: {project_name}\n")
         logging.info(f"Starting multifetch for project: {project_name}")
         
-        self.start_task(self.multifetch_worker, project_name, project_dir, all_params)
+        self.start_task(self.multifetch_worker, project_name, project_dir, all_params, key="mf", priority=PRIORITY_BATCH,
+                        **options)
+
+    def get_multifetch_options(self):
+        base_params = {
+            "host": self.mf_host_entry.get(), "port": int(self.mf_port_entry.get()),
+            "net": self.mf_net_entry.get(), "sta": self.mf_sta_entry.get(),
+            "loc": self.mf_loc_entry.get(), "cha": self.mf_cha_entry.get(),
+        }
+        max_per_host = int(self.mf_parallel_var.get())
+        if max_per_host < 1:
+            raise ValueError("Parallel fetches per host must be at least 1.")
+        refill_attempts = int(self.mf_refill_attempts_var.get())
+        if refill_attempts < 0:
+            raise ValueError("Gap refill attempts cannot be negative.")
+        options = {
+            "max_per_host": max_per_host,
+            "chunk_seconds": int(self.mf_chunk_minutes.get()) * 60 if self.mf_stream_to_disk_var.get() else None,
+            "cache": self.get_waveform_cache() if self.mf_use_cache_var.get() else None,
+            "build_store": self.mf_build_store_var.get(),
+            "refill_attempts": refill_attempts,
+        }
+        return base_params, options
+
+    def resume_multifetch(self):
+        from project_manifest import ProjectManifest
+        project_name = self.mf_project_name_entry.get()
+        project_dir = self.mf_project_dir_entry.get()
+        project_path = os.path.join(project_dir, project_name)
+
+        if not project_name or not project_dir:
+            messagebox.showerror("Input Error", "Project Name and Project Directory are required.")
+            return
+        if not ProjectManifest.exists(project_path):
+            messagebox.showerror("Resume Error", f"No manifest found in {project_path}.")
+            return
 
-    def multifetch_worker(self, project_name, project_dir, all_params):
         try:
-            if not os.path.exists(project_dir):
-                self.task_queue.put((self.update_mf_output, f"Project directory not found. Please select a valid directory.\n"))
-                return
-            
-            project_path = os.path.join(project_dir, project_name)
-            os.makedirs(project_path, exist_ok=True)
+            _, options = self.get_multifetch_options()
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Input Error", f"Invalid Shake Connection Details: {e}")
+            return
+
+        # The manifest carries each window's own connection and time range.
+        all_params = ProjectManifest(project_path, project_name).all_params()
+
+        self.mf_fetch_all_button.config(state="disabled")
+        self.mf_resume_button.config(state="disabled")
+        self.mf_output_text.delete('1.0', tk.END)
+        self.mf_output_text.insert(tk.INSERT, f"Resuming multifetch for project: {project_name} ({len(all_params)} windows in manifest)\n")
+        logging.info(f"Resuming multifetch for project: {project_name}")
+
+        self.start_task(self.multifetch_worker, project_name, project_dir, all_params, key="mf", priority=PRIORITY_BATCH,
+                        **options)
+
+    def multifetch_worker(self, project_name, project_dir, all_params, max_per_host=4, chunk_seconds=None, cache=None,
+                          build_store=False, refill_attempts=3):
+        from data_acquisition import get_connection_pool
+        from fetch_scheduler import run_project_fetch
+        from gap_refill import GapRefiller
+        if not os.path.exists(project_dir):
+            self.task_queue.put((self.update_mf_output, f"Project directory not found. Please select a valid directory.\n"))
+            self.task_queue.put((self.finish_multifetch, ""))
+            return
+        project_path = os.path.join(project_dir, project_name)
+
+        def log(text):
+            self.task_queue.put((self.update_mf_output, text))
+
+        try:
+            store = None
+            if build_store:
+                from project_store import ProjectStore
+                store = ProjectStore(project_path)
+            stats, manifest = run_project_fetch(project_name, project_path, all_params, log,
+                                                max_per_host=max_per_host, chunk_seconds=chunk_seconds, cache=cache,
+                                                store=store, refiller=GapRefiller(max_attempts=refill_attempts))
         except Exception as e:
-            self.task_queue.put((self.handle_error, "Directory Error", f"Could not create project directory: {e}"))
+            logging.error(f"Multifetch for project {project_name} failed: {e}", exc_info=True)
+            self.task_queue.put((self.handle_error, "Multifetch Error", f"Could not run multifetch for project: {e}"))
             return
 
-        for params in all_params:
-            station_num = params["station_num"]
-            self.task_queue.put((self.update_mf_output, f"\n--- Fetching Station {station_num} ---\n"))
-            try:
-                stream = fetch_waveforms(params)
-                self.task_queue.put((self.update_mf_output, f"  Successfully fetched {len(stream)} traces.\n"))
-                
-                # Create filename: projectname_stationnumber_starttime_endtime.mseed
-                st_str = params['start_time'].strftime('%Y%m%dT%H%M%S')
-                et_str = params['end_time'].strftime('%Y%m%dT%H%M%S')
-                filename = f"{project_name}_{station_num}_{st_str}_to_{et_str}.mseed"
-                output_file = os.path.join(project_path, filename)
-                
-                stream.write(output_file, format="MSEED")
-                self.task_queue.put((self.update_mf_output, f"  Saved stream to {filename}\n"))
-                logging.info(f"Saved stream for station {station_num} to {output_file}")
-                
-            except Exception as e:
-                error_msg = f"  Error for station {station_num}: {e}\n"
-                self.task_queue.put((self.update_mf_output, error_msg))
-                logging.error(f"Error fetching/saving station {station_num}: {e}", exc_info=True)
+        pool_stats = get_connection_pool().stats()
+        pool_summary = f"Connection pool: {pool_stats['hits']} hits, {pool_stats['misses']} misses, {pool_stats['reconnects']} reconnects"
+        logging.info(f"Multifetch for project {project_name} finished: {stats.summary()}. {pool_summary}")
 
-        self.task_queue.put((self.finish_multifetch, "\n--- Multifetch complete! ---\n"))
+        status_counts = ", ".join(f"{count} {status}" for status, count in sorted(manifest.summary().items()))
+        summary = f"\n--- Multifetch complete! ---\n{stats.summary()}\n{pool_summary}\nManifest: {status_counts}\n"
+        if cache is not None:
+            summary += self.format_cache_stats()
+        if store is not None:
+            summary += f"Project store: {len(store.sources)} files in {store.path}\n"
+        self.task_queue.put((self.finish_multifetch, summary))
 
     def update_mf_output(self, text):
-        self.mf_output_text.insert(tk.INSERT, text)
-        self.mf_output_text.see(tk.END)
+        append_bounded(self.mf_output_text, text)
 
     def finish_multifetch(self, text):
         self.update_mf_output(text)
         self.mf_fetch_all_button.config(state="normal")
+        self.mf_resume_button.config(state="normal")
 
     # --- MHVSR Analysis Tab ---
     def create_mhvsr_tab(self):
@@ -842,6 +1400,14 @@ class ShakeFetchApp:
         self.save_mhvsr_button = ttk.Button(control_frame, text="Save Results", command=self.save_mhvsr_results, state="disabled")
         self.save_mhvsr_button.pack(side="left", padx=5)
 
+        self.batch_mhvsr_button = ttk.Button(control_frame, text="Batch Project...", command=self.run_mhvsr_batch)
+        self.batch_mhvsr_button.pack(side="left", padx=5)
+
+        ttk.Button(control_frame, text="Cancel", command=lambda: self.cancel_task("mhvsr")).pack(side="left", padx=5)
+
+        self.live_mhvsr_button = ttk.Button(control_frame, text="Start Live Monitor", command=self.toggle_live_mhvsr)
+        self.live_mhvsr_button.pack(side="left", padx=5)
+
         # --- Output ---
         output_frame = ttk.LabelFrame(analysis_frame, text="Output", padding=(10, 5))
         output_frame.pack(fill="both", expand=True, pady=5)
@@ -850,6 +1416,7 @@ class ShakeFetchApp:
         self.mhvsr_output_text.pack(expand=True, fill="both")
 
         self.hvsr_result = None
+        self.live_monitor = None
 
     def select_mhvsr_files(self):
         files = filedialog.askopenfilenames(title="Select MSEED/MiniSEED Files", filetypes=[("MSEED/MiniSEED files", "*.mseed *.miniseed"), ("All files", "*.*")])
@@ -868,27 +1435,139 @@ class ShakeFetchApp:
         self.mhvsr_output_text.delete('1.0', tk.END)
         self.mhvsr_output_text.insert(tk.INSERT, "Running MHVSR analysis...\n")
 
-        self.start_task(self.mhvsr_worker)
+        self.start_task(self.mhvsr_worker, key="mhvsr", priority=PRIORITY_BATCH)
+
+    def get_mhvsr_settings(self):
+        from mhvsr_logic import get_default_preprocessing_settings, get_default_processing_settings
+        window_length = int(self.mhvsr_window_length.get())
+        bandwidth = int(self.mhvsr_bandwidth.get())
+        combine_method = self.mhvsr_combine_method.get()
+
+        preprocessing_settings = get_default_preprocessing_settings()
+        preprocessing_settings.window_length_in_seconds = window_length
+
+        processing_settings = get_default_processing_settings()
+        processing_settings.smoothing['bandwidth'] = bandwidth
+        processing_settings.method_to_combine_horizontals = combine_method
+        return preprocessing_settings, processing_settings
 
     def mhvsr_worker(self):
+        from mhvsr_logic import process_mhvsr, get_spectral_cache
+        from project_store import open_store_for
         try:
-            window_length = int(self.mhvsr_window_length.get())
-            bandwidth = int(self.mhvsr_bandwidth.get())
-            combine_method = self.mhvsr_combine_method.get()
+            preprocessing_settings, processing_settings = self.get_mhvsr_settings()
+            cache = get_spectral_cache()
+            hits_before = cache.hits
+            start = time.perf_counter()
+            file_paths = [list(self.mhvsr_files)]
+            store = open_store_for(file_paths)
+            hvsr = process_mhvsr(file_paths, preprocessing_settings, processing_settings, cache=cache, store=store)
+            raise_if_cancelled()
+            reused = "reused cached spectra" if cache.hits > hits_before else "computed spectra"
+            source = ", read from the project store" if store is not None else ""
+            self.task_queue.put((self.update_mhvsr_output, f"Processed in {time.perf_counter() - start:.2f} s ({reused}{source}).\n"))
+            self.task_queue.put((self.on_mhvsr_complete, hvsr))
+        except Exception as e:
+            self.task_queue.put((self.handle_error, "MHVSR Error", e))
 
-            preprocessing_settings = get_default_preprocessing_settings()
-            preprocessing_settings.window_length_in_seconds = window_length
+    def run_mhvsr_batch(self):
+        project_path = filedialog.askdirectory(title="Select Multifetch Project Directory")
+        if not project_path:
+            return
 
-            processing_settings = get_default_processing_settings()
-            processing_settings.smoothing['bandwidth'] = bandwidth
-            processing_settings.method_to_combine_horizontals = combine_method
+        self.run_mhvsr_button.config(state="disabled")
+        self.batch_mhvsr_button.config(state="disabled")
+        self.mhvsr_output_text.delete('1.0', tk.END)
+        self.mhvsr_output_text.insert(tk.INSERT, f"Running batch MHVSR analysis for {project_path}...\n")
 
-            hvsr = process_mhvsr([list(self.mhvsr_files)], preprocessing_settings, processing_settings)
-            self.task_queue.put((self.on_mhvsr_complete, hvsr))
+        self.start_task(self.mhvsr_batch_worker, project_path, key="mhvsr", priority=PRIORITY_BATCH)
+
+    def mhvsr_batch_worker(self, project_path):
+        import hvsrpy
+        from mhvsr_logic import group_project_files, process_mhvsr_batch
+        try:
+            station_files = group_project_files(project_path)
+            if not station_files:
+                self.task_queue.put((self.finish_mhvsr_batch, "No Multifetch miniSEED files found in the selected directory.\n"))
+                return
+            preprocessing_settings, processing_settings = self.get_mhvsr_settings()
+            results_dir = os.path.join(project_path, "mhvsr")
+            os.makedirs(results_dir, exist_ok=True)
+            self.task_queue.put((self.update_mhvsr_output, f"Processing {len(station_files)} stations in a process pool...\n"))
+
+            def on_result(station, hvsr, elapsed, error):
+                if error is not None:
+                    logging.error(f"Batch MHVSR failed for station {station}: {error}")
+                    self.task_queue.put((self.update_mhvsr_output, f"  Station {station}: error: {error}\n"))
+                    return
+                output_file = os.path.join(results_dir, f"station_{station}.csv")
+                hvsrpy.object_io.write_hvsr_object_to_file(hvsr, output_file)
+                f0 = hvsr.mean_fn_frequency(distribution="lognormal")
+                logging.info(f"Batch MHVSR for station {station} finished in {elapsed:.1f} s, f0 = {f0:.3f} Hz")
+                self.task_queue.put((self.update_mhvsr_output,
+                                     f"  Station {station}: f0 = {f0:.3f} Hz, {len(station_files[station])} files, "
+                                     f"{elapsed:.1f} s, saved to {os.path.basename(output_file)}\n"))
+
+            start = time.perf_counter()
+            process_mhvsr_batch(station_files, preprocessing_settings, processing_settings, on_result)
+            self.task_queue.put((self.finish_mhvsr_batch,
+                                 f"Batch MHVSR complete in {time.perf_counter() - start:.1f} s. Results in {results_dir}\n"))
         except Exception as e:
+            logging.error(f"Batch MHVSR error: {e}", exc_info=True)
             self.task_queue.put((self.handle_error, "MHVSR Error", e))
 
+    def toggle_live_mhvsr(self):
+        if self.live_monitor is not None and self.live_monitor.running:
+            # Don't wait for an in-flight poll; the thread exits once it returns.
+            self.live_monitor.stop(timeout=0)
+            self.live_monitor = None
+            self.live_mhvsr_button.config(text="Start Live Monitor")
+            self.update_mhvsr_output("Live monitor stopped.\n")
+            return
+
+        from live_hvsr import LiveHvsrMonitor
+        # The live monitor uses the connection entered on the Single Fetch tab
+        self.ensure_tab_built(self.data_acquisition_tab)
+        try:
+            params = {
+                "host": self.da_host_entry.get(), "port": int(self.da_port_entry.get()),
+                "net": self.da_net_entry.get(), "sta": self.da_sta_entry.get(),
+                "loc": self.da_loc_entry.get(), "cha": self.da_cha_entry.get(),
+            }
+            preprocessing_settings, processing_settings = self.get_mhvsr_settings()
+            self.live_monitor = LiveHvsrMonitor(
+                params, preprocessing_settings, processing_settings,
+                on_update=lambda snapshot: self.task_queue.put((self.on_live_hvsr_update, snapshot)),
+                on_error=lambda e: self.task_queue.put((self.update_mhvsr_output, f"Live poll failed: {e}\n")))
+        except Exception as e:
+            messagebox.showerror("Error", f"Invalid input: {e}")
+            return
+
+        self.live_monitor.start()
+        self.live_mhvsr_button.config(text="Stop Live Monitor")
+        self.mhvsr_output_text.delete('1.0', tk.END)
+        self.update_mhvsr_output(f"Live monitor on {params['host']}:{params['port']}, "
+                                 f"{preprocessing_settings.window_length_in_seconds} s windows...\n")
+
+    def on_live_hvsr_update(self, snapshot):
+        state = "stable" if snapshot["stable"] else "not yet stable"
+        self.update_mhvsr_output(
+            f"Window {snapshot['windows']} ({snapshot['rejected']} rejected with gaps): "
+            f"mean curve peak {snapshot['peak_frequency']:.3f} Hz (A0 {snapshot['peak_amplitude']:.2f}), "
+            f"f0 {snapshot['fn_mean']:.3f} Hz (lognormal std {snapshot['fn_std']:.3f}), {state}\n")
+
+    def update_mhvsr_output(self, text):
+        append_bounded(self.mhvsr_output_text, text)
+
+    def finish_mhvsr_batch(self, text):
+        self.update_mhvsr_output(text)
+        self.run_mhvsr_button.config(state="normal")
+        self.batch_mhvsr_button.config(state="normal")
+
     def on_mhvsr_complete(self, hvsr):
+        import hvsrpy
+        from hvsrpy import sesame
+        import numpy as np
         self.hvsr_result = hvsr
         self.mhvsr_output_text.insert(tk.INSERT, "MHVSR analysis complete.\n")
         self.run_mhvsr_button.config(state="normal")
@@ -900,7 +1579,7 @@ class ShakeFetchApp:
         from contextlib import redirect_stdout
 
         f = io.StringIO()
-        with redirect_stdout(f):
+        with redirect_stdout(f), stage("sesame"):
             hvsr.update_peaks_bounded(search_range_in_hz=(None, None))
             print("\nSESAME (2004) Clarity and Reliability Criteria:")
             print("-"*47)
@@ -930,6 +1609,7 @@ class ShakeFetchApp:
 
     def plot_mhvsr_results(self):
         if self.hvsr_result:
+            import hvsrpy
             import matplotlib.pyplot as plt
             fig, ax = hvsrpy.plot_single_panel_hvsr_curves(self.hvsr_result)
             ax.legend(loc="center left", bbox_to_anchor=(1, 0.5))
@@ -943,6 +1623,7 @@ class ShakeFetchApp:
             output_file = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
             if output_file:
                 try:
+                    import hvsrpy
                     hvsrpy.object_io.write_hvsr_object_to_file(self.hvsr_result, output_file)
                     self.mhvsr_output_text.insert(tk.INSERT, f"\nResults saved to {output_file}\n")
                     logging.info(f"MHVSR results successfully saved to {output_file}")
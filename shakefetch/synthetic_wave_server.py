@@ -0,0 +1,284 @@
+import logging
+import os
+import socketserver
+import threading
+import time
+import numpy as np
+
+DEFAULT_NETWORK = "AM"
+DEFAULT_STATION = "R0000"
+DEFAULT_LOCATION = "00"
+DEFAULT_CHANNELS = ("EHZ", "EHN", "EHE")
+DEFAULT_SAMPLING_RATE = 100.0
+DEFAULT_PACKET_SAMPLES = 100
+DEFAULT_RETENTION_SECONDS = 7 * 86400
+# The synthetic signal repeats after this long; long enough that HVSR windows never line up with it.
+LOOP_SECONDS = 1000
+RESONANCE_HZ = 2.0
+SEND_BLOCK = 64 * 1024
+
+TRACEBUF2_HEADER = np.dtype([
+    ("pinno", "<i4"), ("ndata", "<i4"), ("start", "<f8"), ("end", "<f8"), ("rate", "<f8"),
+    ("sta", "S7"), ("net", "S9"), ("chan", "S4"), ("loc", "S3"),
+    ("version", "S2"), ("datatype", "S3"), ("quality", "S2"), ("pad", "S2"),
+])
+
+
+class SyntheticSignal:
+    """
+    Deterministic three-component ambient noise, the same for every request of the same window.
+
+    Every channel is white noise; horizontal channels (ending in N, E, 1 or 2) also carry noise
+    through a resonator at resonance_hz, so their HVSR has a clear peak there. Sample n of a
+    channel is sample n % loop of a buffer generated once, so any window costs one numpy take.
+    """
+    def __init__(self, sampling_rate=DEFAULT_SAMPLING_RATE, resonance_hz=RESONANCE_HZ, seed=0):
+        self.sampling_rate = sampling_rate
+        self.resonance_hz = resonance_hz
+        self.seed = seed
+        self._loops = {}
+        self._lock = threading.Lock()
+
+    def _loop(self, channel):
+        with self._lock:
+            loop = self._loops.get(channel)
+            if loop is None:
+                loop = self._loops[channel] = self._generate(channel)
+            return loop
+
+    def _generate(self, channel):
+        from scipy.signal import iirpeak, lfilter
+        rng = np.random.default_rng([self.seed, *channel.encode()])
+        samples = int(LOOP_SECONDS * self.sampling_rate)
+        signal = rng.normal(size=samples)
+        if channel[-1:] in "NE12":
+            b, a = iirpeak(self.resonance_hz, 2.0, fs=self.sampling_rate)
+            signal += 8 * lfilter(b, a, rng.normal(size=samples))
+        return np.round(signal * 1000).astype(np.int32)
+
+    def samples(self, channel, first, last):
+        """Returns samples first to last (exclusive) of a channel, counted from the POSIX epoch."""
+        loop = self._loop(channel)
+        return np.take(loop, np.arange(first, last) % len(loop))
+
+    def stream(self, network, station, location, channels, start_time, end_time):
+        """Returns the signal between two UTCDateTimes as an obspy Stream, one trace per channel."""
+        from obspy import Stream, Trace, UTCDateTime
+        first = int(np.ceil(float(start_time) * self.sampling_rate))
+        last = int(np.floor(float(end_time) * self.sampling_rate)) + 1
+        stream = Stream()
+        for channel in channels:
+            header = {"network": network, "station": station, "location": location, "channel": channel,
+                      "sampling_rate": self.sampling_rate,
+                      "starttime": UTCDateTime(first / self.sampling_rate)}
+            stream.append(Trace(data=self.samples(channel, first, last), header=header))
+        return stream
+
+
+class _Throttle:
+    """Shares a fixed number of bytes per second between every connection of a server."""
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, nbytes):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(now, self._next) + nbytes / self.bytes_per_second
+            delay = self._next - now
+        time.sleep(delay)
+
+
+class _WaveServerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Like a real wave server, answer requests on one socket until the client hangs up.
+        server = self.server.wave_server
+        for line in self.rfile:
+            try:
+                reply = server.reply(line.decode("ascii").split())
+            except (UnicodeDecodeError, ValueError, IndexError):
+                reply = b"0 FB\n"
+            if server.latency:
+                time.sleep(server.latency)
+            with server._lock:
+                server.stats["requests"] += 1
+                server.stats["bytes_sent"] += len(reply)
+            view = memoryview(reply)
+            for offset in range(0, len(view), SEND_BLOCK):
+                block = view[offset:offset + SEND_BLOCK]
+                server.throttle.wait(len(block))
+                self.wfile.write(block)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SyntheticWaveServer:
+    """
+    A stand-in Earthworm wave server on localhost that serves a SyntheticSignal.
+
+    Answers MENU, MENUSCNL and GETSCNLRAW requests the way data_acquisition and obspy's
+    Earthworm Client expect, with whole TraceBuf2 packets of packet_samples covering the
+    requested window. latency seconds are added before every reply, and bandwidth (bytes per
+    second, shared by all connections) limits how fast replies are sent, so a benchmark can
+    mimic a Shake on a slow link. Data is available for the last retention_seconds up to now.
+    outages lists (start, end) or (start, end, channel) POSIX times whose packets the server
+    withholds, for all channels or just one, to stand in for a Shake that lost data; the
+    list may be changed while the server runs. Use as a context manager, or call start() and stop().
+    """
+    def __init__(self, host="127.0.0.1", port=0, network=DEFAULT_NETWORK, station=DEFAULT_STATION,
+                 location=DEFAULT_LOCATION, channels=DEFAULT_CHANNELS, signal=None,
+                 packet_samples=DEFAULT_PACKET_SAMPLES, latency=0.0, bandwidth=None,
+                 retention_seconds=DEFAULT_RETENTION_SECONDS, outages=()):
+        self.network = network
+        self.station = station
+        self.location = location
+        self.channels = tuple(channels)
+        self.signal = signal or SyntheticSignal()
+        self.packet_samples = packet_samples
+        self.latency = latency
+        self.throttle = _Throttle(bandwidth)
+        self.retention_seconds = retention_seconds
+        self.outages = list(outages)
+        self.stats = {"requests": 0, "bytes_sent": 0}
+        self._lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _WaveServerHandler)
+        self._server.wave_server = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    @property
+    def params(self):
+        """Connection params for fetch_waveforms, without the time window."""
+        host, port = self.address
+        return {"host": host, "port": port, "net": self.network, "sta": self.station,
+                "loc": self.location, "cha": self.channels[0][:-1] + "?"}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="synthetic-wave-server",
+                                        daemon=True)
+        self._thread.start()
+        logging.info(f"Synthetic wave server listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _available(self):
+        end = time.time()
+        return end - self.retention_seconds, end
+
+    def _menu_line(self, pinno, channel):
+        start, end = self._available()
+        return (f" {pinno} {self.station} {channel} {self.network} {self.location or '--'} "
+                f"{start:.6f} {end:.6f} i4")
+
+    def _pin(self, station, channel, network, location):
+        # Clients send "--" for an empty location code.
+        if (station, network, "" if location == "--" else location) != (self.station, self.network, self.location):
+            return None
+        return self.channels.index(channel) if channel in self.channels else None
+
+    def reply(self, tokens):
+        command, request_id = tokens[0], tokens[1]
+        if command == "MENU:":
+            lines = "".join(self._menu_line(pinno, channel) for pinno, channel in enumerate(self.channels))
+            return f"{request_id}{lines}\n".encode("ascii")
+        if command == "MENUSCNL:":
+            pinno = self._pin(*tokens[2:6])
+            lines = self._menu_line(pinno, tokens[3]) if pinno is not None else ""
+            return f"{request_id}{lines}\n".encode("ascii")
+        if command == "GETSCNLRAW:":
+            return self._tracebufs(request_id, tokens[2:6], float(tokens[6]), float(tokens[7]))
+        return f"{request_id} FB\n".encode("ascii")
+
+    def _tracebufs(self, request_id, scnl, start, end):
+        station, channel, network, location = scnl
+        prefix = f"{request_id} {{pinno}} {station} {channel} {network} {location}"
+        pinno = self._pin(station, channel, network, location)
+        if pinno is None:
+            return (prefix.format(pinno=0) + " FN\n").encode("ascii")
+        available_start, available_end = self._available()
+        if end < available_start:
+            return (prefix.format(pinno=pinno) + " FL i4\n").encode("ascii")
+        if start > available_end:
+            return (prefix.format(pinno=pinno) + " FR i4\n").encode("ascii")
+
+        # Whole packets that overlap the window, as a tank hands them out; the client trims them.
+        rate = self.signal.sampling_rate
+        size = self.packet_samples
+        first_packet = int(np.floor(max(start, available_start) * rate / size))
+        last_packet = min(int(np.floor(end * rate / size)) + 1, int(np.floor(available_end * rate / size)))
+        if last_packet <= first_packet:
+            return (prefix.format(pinno=pinno) + " FG i4\n").encode("ascii")
+
+        starts = (first_packet + np.arange(last_packet - first_packet)) * size / rate
+        kept = np.ones(len(starts), dtype=bool)
+        for outage in self.outages:
+            if len(outage) < 3 or outage[2] == channel:
+                kept &= (starts + size / rate <= outage[0]) | (starts >= outage[1])
+        starts = starts[kept]
+        if not len(starts):
+            return (prefix.format(pinno=pinno) + " FG i4\n").encode("ascii")
+
+        count = len(starts)
+        packets = np.zeros(count, dtype=[("header", TRACEBUF2_HEADER), ("data", "<i4", (size,))])
+        header = packets["header"]
+        header["pinno"] = pinno
+        header["ndata"] = size
+        header["start"] = starts
+        header["end"] = starts + (size - 1) / rate
+        header["rate"] = rate
+        header["sta"], header["net"], header["chan"] = station.encode(), network.encode(), channel.encode()
+        header["loc"] = location.encode()
+        header["version"], header["datatype"], header["quality"] = b"20", b"i4", b""
+        samples = self.signal.samples(channel, first_packet * size, last_packet * size).reshape(-1, size)
+        packets["data"] = samples[kept]
+        body = packets.tobytes()
+        line = (f"{prefix.format(pinno=pinno)} F i4 {starts[0]:.6f} {starts[-1] + (size - 1) / rate:.6f} "
+                f"{len(body)}\n")
+        return line.encode("ascii") + body
+
+
+def write_synthetic_project(project_path, project_name, stations, window_seconds, start_time=None,
+                            signal=None, network=DEFAULT_NETWORK, station=DEFAULT_STATION,
+                            location=DEFAULT_LOCATION, channels=DEFAULT_CHANNELS):
+    """
+    Writes a Multifetch-style project of synthetic three-component miniSEED files.
+
+    Each of stations numbered windows gets one file of window_seconds, named like
+    Multifetch names them, so group_project_files and MHVSR pick them up. Windows follow
+    one another from start_time (default: a day ago). Returns {station_num: [file path]}.
+    """
+    from obspy import UTCDateTime
+    from project_manifest import window_filename
+    signal = signal or SyntheticSignal()
+    start_time = UTCDateTime(start_time) if start_time is not None else UTCDateTime(int(time.time()) - 86400)
+    os.makedirs(project_path, exist_ok=True)
+    files = {}
+    for station_num in range(1, stations + 1):
+        window_start = start_time + (station_num - 1) * window_seconds
+        params = {"station_num": station_num, "start_time": window_start,
+                  "end_time": window_start + window_seconds}
+        stream = signal.stream(network, station, location, channels, params["start_time"], params["end_time"])
+        path = os.path.join(project_path, window_filename(project_name, params))
+        stream.write(path, format="MSEED")
+        files[station_num] = [path]
+    return files
@@ -0,0 +1,339 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+DEFAULT_MAX_WORKERS = 4
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_current = threading.local()
+
+
+class TaskCancelled(BaseException):
+    """
+    Raised inside a task once it has been cancelled.
+
+    Like asyncio.CancelledError it is a BaseException, so the workers' `except Exception`
+    error handlers let it through to the executor instead of reporting it as a failure.
+    """
+
+
+class TaskEvent:
+    """A state change or progress report of a task, passed to the executor's on_event."""
+    __slots__ = ("task_id", "name", "priority", "state", "fraction", "message", "elapsed")
+
+    def __init__(self, task, message=None):
+        self.task_id = task.id
+        self.name = task.name
+        self.priority = task.priority
+        self.state = task.state
+        self.fraction = task.fraction
+        self.message = message
+        self.elapsed = task.elapsed
+
+    def __repr__(self):
+        fraction = f" {self.fraction:.0%}" if self.fraction is not None else ""
+        message = f": {self.message}" if self.message else ""
+        return f"<TaskEvent {self.name}#{self.task_id} {self.state}{fraction}{message}>"
+
+
+class Task:
+    """
+    One unit of work submitted to a TaskExecutor.
+
+    Cancellation is cooperative: cancel() sets a flag that the task's code checks with
+    raise_if_cancelled(), and runs the cancel callbacks registered with hold() at once, so
+    sockets, SSH sessions or worker processes a blocked task holds are released straight away.
+    """
+    def __init__(self, executor, task_id, func, args, kwargs, name, priority, timeout):
+        self.executor = executor
+        self.id = task_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name
+        self.priority = priority
+        self.timeout = timeout
+        self.state = QUEUED
+        self.fraction = None
+        self.cancel_reason = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+        self._holds = {}
+        self._hold_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self._done_event.is_set()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def wait(self, timeout=None):
+        """Blocks until the task has finished, failed or been cancelled."""
+        return self._done_event.wait(timeout)
+
+    def cancel(self, reason="cancelled"):
+        """Cancels the task, releasing everything it holds. Does nothing once it has finished."""
+        with self._lock:
+            if self.done or self.cancelled:
+                return False
+            self.cancel_reason = reason
+            self._cancel_event.set()
+            holds, self._holds = list(self._holds.values()), {}
+        for release in holds:
+            try:
+                release()
+            except Exception as e:
+                logging.warning(f"Releasing a resource of cancelled task {self.name} failed: {e}")
+        self.executor._cancelled(self)
+        return True
+
+    def raise_if_cancelled(self):
+        if self._cancel_event.is_set():
+            raise TaskCancelled(self.cancel_reason)
+
+    def sleep(self, seconds):
+        """Sleeps like time.sleep, but wakes and raises TaskCancelled as soon as the task is cancelled."""
+        if self._cancel_event.wait(seconds):
+            raise TaskCancelled(self.cancel_reason)
+
+    def hold(self, release):
+        """
+        Registers release() to be called if the task is cancelled while holding a resource.
+
+        Returns a handle for unhold() once the resource has been given back normally. If the
+        task is already cancelled, release() is called at once and TaskCancelled is raised.
+        """
+        with self._lock:
+            if not self._cancel_event.is_set():
+                handle = next(self._hold_ids)
+                self._holds[handle] = release
+                return handle
+        release()
+        raise TaskCancelled(self.cancel_reason)
+
+    def unhold(self, handle):
+        with self._lock:
+            self._holds.pop(handle, None)
+
+    def report(self, fraction=None, message=None):
+        """Reports progress: fraction done in [0, 1] (None if unknown) and/or a status message."""
+        if fraction is not None:
+            self.fraction = min(max(float(fraction), 0.0), 1.0)
+        self.executor._emit(self, message)
+
+
+class TaskExecutor:
+    """
+    Runs tasks on a fixed number of worker threads, interactive tasks ahead of batch ones.
+
+    Batch tasks may take at most max_workers - 1 threads, so a Single Fetch or a connect
+    never waits behind a queue of Multifetch and MHVSR runs. A task with a timeout is
+    cancelled once it has run that many seconds. on_event(TaskEvent) is called from the
+    worker threads whenever a task is queued, starts, reports progress or ends.
+    """
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, on_event=None):
+        if max_workers < 2:
+            raise ValueError("max_workers must be at least 2, one is kept for interactive tasks")
+        self.max_workers = max_workers
+        self.limits = {PRIORITY_INTERACTIVE: max_workers, PRIORITY_BATCH: max_workers - 1}
+        self.on_event = on_event
+        self._queues = {priority: deque() for priority in sorted(self.limits)}
+        self._running = {priority: 0 for priority in self.limits}
+        self._tasks = {}
+        self._ids = itertools.count(1)
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def submit(self, func, *args, name=None, priority=PRIORITY_INTERACTIVE, timeout=None, **kwargs):
+        """Queues func(*args, **kwargs) and returns its Task."""
+        if priority not in self.limits:
+            raise ValueError(f"Unknown task priority {priority!r}")
+        with self._condition:
+            task = Task(self, next(self._ids), func, args, kwargs, name or getattr(func, "__name__", "task"),
+                        priority, timeout)
+            self._tasks[task.id] = task
+            self._queues[priority].append(task)
+            # Threads are started as needed, so an idle app holds none.
+            demand = sum(self._running.values()) + sum(len(queue) for queue in self._queues.values())
+            if len(self._threads) < min(self.max_workers, demand):
+                thread = threading.Thread(target=self._work, name=f"task-worker-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        self._emit(task)
+        return task
+
+    def tasks(self):
+        """Returns the tasks that are queued or running."""
+        with self._condition:
+            return [task for task in self._tasks.values() if not task.done]
+
+    def cancel_all(self, reason="cancelled"):
+        for task in self.tasks():
+            task.cancel(reason)
+
+    def _next_task(self):
+        for priority, queue in self._queues.items():
+            if queue and self._running[priority] < self.limits[priority]:
+                self._running[priority] += 1
+                return queue.popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                while task is None:
+                    self._condition.wait()
+                    task = self._next_task()
+            try:
+                self._run(task)
+            finally:
+                with self._condition:
+                    self._running[task.priority] -= 1
+                    self._tasks.pop(task.id, None)
+                    self._condition.notify_all()
+
+    def _run(self, task):
+        if task.cancelled:
+            self._finish(task, CANCELLED)
+            return
+        task.started = time.monotonic()
+        task.state = RUNNING
+        self._emit(task)
+        timer = None
+        if task.timeout:
+            timer = threading.Timer(task.timeout, task.cancel, args=(f"timed out after {task.timeout:g} s",))
+            timer.daemon = True
+            timer.start()
+        _current.task = task
+        try:
+            task.func(*task.args, **task.kwargs)
+            task.raise_if_cancelled()
+        except TaskCancelled:
+            self._finish(task, CANCELLED, task.cancel_reason)
+        except Exception as e:
+            logging.error(f"Task {task.name} failed: {e}", exc_info=True)
+            task.error = e
+            self._finish(task, FAILED, str(e))
+        else:
+            self._finish(task, DONE)
+        finally:
+            _current.task = None
+            if timer is not None:
+                timer.cancel()
+
+    def _finish(self, task, state, message=None):
+        with task._lock:
+            task.finished = time.monotonic()
+            task.state = state
+            task._holds = {}
+            task._done_event.set()
+        self._emit(task, message)
+
+    def _cancelled(self, task):
+        with self._condition:
+            queue = self._queues[task.priority]
+            if task in queue:
+                queue.remove(task)
+                self._tasks.pop(task.id, None)
+            else:
+                return
+        # A queued task never reaches a worker, so finish it here.
+        self._finish(task, CANCELLED, task.cancel_reason)
+
+    def _emit(self, task, message=None):
+        if self.on_event:
+            try:
+                self.on_event(TaskEvent(task, message))
+            except Exception as e:
+                logging.error(f"Task event handler failed: {e}")
+
+
+def current_task():
+    """Returns the Task running in this thread, or None outside a task."""
+    return getattr(_current, "task", None)
+
+
+def run_in_task(task, func, *args, **kwargs):
+    """
+    Runs func in this thread as part of task, e.g. in a thread pool the task started.
+
+    Code in func then sees the task through current_task(), so it is cancelled and releases
+    resources along with it.
+    """
+    previous = current_task()
+    _current.task = task
+    try:
+        if task is not None:
+            task.raise_if_cancelled()
+        return func(*args, **kwargs)
+    finally:
+        _current.task = previous
+
+
+def raise_if_cancelled():
+    """Raises TaskCancelled if the current task has been cancelled; does nothing outside a task."""
+    task = current_task()
+    if task is not None:
+        task.raise_if_cancelled()
+
+
+def sleep(seconds):
+    """Sleeps, returning early with TaskCancelled if the current task is cancelled."""
+    task = current_task()
+    if task is None:
+        time.sleep(seconds)
+    else:
+        task.sleep(seconds)
+
+
+def report_progress(fraction=None, message=None):
+    """Reports progress of the current task; does nothing outside a task."""
+    task = current_task()
+    if task is not None:
+        task.report(fraction, message)
+
+
+class held:
+    """
+    Context manager that registers release() with the current task while the block runs.
+
+        with held(conn.abort):
+            data = conn.read()
+    """
+    def __init__(self, release):
+        self.release = release
+        self.task = current_task()
+        self.handle = None
+
+    def __enter__(self):
+        if self.task is not None:
+            self.handle = self.task.hold(self.release)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.handle is not None:
+            self.task.unhold(self.handle)
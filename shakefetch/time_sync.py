@@ -1,12 +1,92 @@
+import logging
+import shlex
+import threading
+import time
 import paramiko
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from metrics import stage
+from task_executor import current_task, held, raise_if_cancelled, run_in_task
+
+DEFAULT_FLEET_WORKERS = 8
+DEFAULT_OFFSET_SAMPLES = 5
+DEFAULT_STEP_THRESHOLD = 0.05
+DEFAULT_DRIFT_INTERVAL = 60.0
+DEFAULT_DRIFT_HISTORY = 1440
+KEEPALIVE_SECONDS = 15
+DEFAULT_COMMAND_TIMEOUT = 30
+DEFAULT_CONCURRENT_COMMANDS = 4
+
+# Prints the remote clock for every line it reads, from one process started once per
+# measurement, so a reading costs a single round trip on an open channel. bash's
+# $EPOCHREALTIME reads the clock without forking date; plain sh falls back to date.
+CLOCK_READER = ("exec \"$(command -v bash || echo sh)\" -c "
+                "'while read -r _; do if [ -n \"$EPOCHREALTIME\" ]; then echo \"$EPOCHREALTIME\"; "
+                "else date -u +%s.%N; fi; done'")
+
+# Commands run together by ShakeCommunicator.status, keyed by the name they are reported under.
+STATUS_COMMANDS = {
+    "uptime": "uptime",
+    "clock": "date -u '+%Y-%m-%dT%H:%M:%S.%N'",
+    "ntp": "timedatectl show -p NTPSynchronized --value",
+    "disk": "df -h / | tail -n 1",
+}
+
+
+class ClockOffset:
+    """
+    A remote clock offset measured over SSH.
+
+    offset is remote minus local time in seconds, taken from the round trip with the
+    smallest rtt, where the remote timestamp is assumed to fall half way through.
+    """
+    def __init__(self, offset, rtt, samples, measured_at):
+        self.offset = offset
+        self.rtt = rtt
+        self.samples = samples
+        self.measured_at = measured_at
+
+    def __str__(self):
+        return (f"Clock offset {self.offset * 1000:+.1f} ms "
+                f"(round trip {self.rtt * 1000:.0f} ms, best of {len(self.samples)})")
+
+class CommandResult:
+    """
+    Output, exit status and wall-clock timing of one remote command.
+    """
+    def __init__(self, command, stdout, stderr, exit_status, sent, received):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+        self.sent = sent
+        self.received = received
+
+    @property
+    def latency(self):
+        return self.received - self.sent
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
 
 class ShakeCommunicator:
+    """
+    An SSH session to one Shake.
+
+    The transport sends keep-alives so idle NAT and Wi-Fi links don't drop it, and every
+    command runs on its own channel over that one transport, so several can run at once
+    without another handshake. A command that finds the session dead reconnects once.
+    """
     def __init__(self, host, username, password):
         self.host = host
         self.username = username
         self.password = password
         self.client = None
+        self.reconnects = 0
+        self._connect_lock = threading.Lock()
 
     def connect(self):
         """Establishes an SSH connection."""
@@ -16,7 +96,9 @@ class ShakeCommunicator:
         try:
             self.client = paramiko.client.SSHClient()
             self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.client.connect(self.host, username=self.username, password=self.password, timeout=10)
+            with stage("ssh_connect"):
+                self.client.connect(self.host, username=self.username, password=self.password, timeout=10)
+            self.client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
             return "Connection successful."
         except Exception as e:
             self.client = None
@@ -34,42 +116,422 @@ class ShakeCommunicator:
         """Checks if the client is connected."""
         return self.client and self.client.get_transport() and self.client.get_transport().is_active()
 
-    def set_time_utc(self):
-        """Sets the remote host's time to the current UTC time."""
-        if not self.is_connected():
-            return "Not connected. Please connect first."
+    def reconnect(self, failed_client=None):
+        """
+        Replaces a dead session with a new one, raising ConnectionError if that fails.
+
+        failed_client is the SSHClient a command just failed on. Threads whose commands fail
+        together all call this; the first one reconnects, and the others keep the session it
+        opened instead of closing it under its retried command.
+        """
+        with self._connect_lock:
+            if self.is_connected() and (failed_client is None or self.client is not failed_client):
+                return
+            if self.client:
+                self.client.close()
+                self.client = None
+            result = self.connect()
+            if "successful" not in result:
+                raise ConnectionError(result)
+            self.reconnects += 1
+            logging.info(f"Reconnected SSH session to {self.host}")
+
+    def _run_once(self, client, command, input, timeout):
+        with stage("ssh_command") as timer:
+            sent = time.time()
+            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+            if input is not None:
+                stdin.write(input)
+                stdin.flush()
+            stdin.channel.shutdown_write()
+            # Cancelling the task closes just this command's channel, not the shared session.
+            with held(stdout.channel.close):
+                output = stdout.read().decode()
+                error = stderr.read().decode()
+                exit_status = stdout.channel.recv_exit_status()
+            raise_if_cancelled()
+            timer.bytes = len(output) + len(error)
+        return CommandResult(command, output, error, exit_status, sent, time.time())
 
-        date_now = datetime.utcnow().strftime("%d %b %Y %H:%M:%S")
-        command = f'sudo -kS date --set "{date_now}"'
+    def run_command(self, command, input=None, timeout=DEFAULT_COMMAND_TIMEOUT, retry=True):
+        """
+        Runs one command on its own channel of the session and returns a CommandResult.
 
+        If the session turns out to be dead, it is reconnected and the command is sent again,
+        unless retry is False (for commands that must not run twice).
+        """
+        result = self._with_retry(lambda client: self._run_once(client, command, input, timeout), retry)
+        logging.debug(f"{self.host}: {command!r} exited {result.exit_status} in {result.latency * 1000:.0f} ms")
+        return result
+
+    def _with_retry(self, run, retry=True):
+        """Calls run(client) on a live session, reconnecting and calling it once more if the session died."""
+        client = self.client
+        if not self.is_connected():
+            if not retry:
+                raise ConnectionError("Not connected. Please connect first.")
+            self.reconnect(client)
+            client = self.client
         try:
-            stdin, stdout, stderr = self.client.exec_command(command)
-            stdin.write(self.password + '\n')
-            stdin.flush()
+            return run(client)
+        except (paramiko.SSHException, EOFError, OSError):
+            raise_if_cancelled()
+            if not retry:
+                raise
+            self.reconnect(client)
+            return run(self.client)
+
+    def run_commands(self, commands, max_concurrent=DEFAULT_CONCURRENT_COMMANDS, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """
+        Runs several commands concurrently, each on its own channel of the one session.
+
+        Returns CommandResults in the order of commands; a command that failed to run gets
+        its exception in place of a result.
+        """
+        if not self.is_connected():
+            self.reconnect()
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrent), thread_name_prefix=f"ssh-{self.host}") as executor:
+            futures = [executor.submit(self.run_command, command, timeout=timeout) for command in commands]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+        return results
+
+    def status(self, commands=STATUS_COMMANDS):
+        """
+        Runs the status commands concurrently and returns {name: CommandResult or exception}.
+        """
+        return dict(zip(commands, self.run_commands(list(commands.values()))))
+
+    def measure_offset(self, samples=DEFAULT_OFFSET_SAMPLES):
+        """
+        Measures the remote clock offset from several timestamped round trips.
+
+        The remote clock is read by CLOCK_READER on one channel, and each round trip is timed
+        from sending a line to reading the clock back, so opening the channel and starting a
+        process do not count towards it. The first reading only warms the channel up. The
+        round trip with the smallest rtt is used, and half of it is taken as the delay
+        before the remote read. Returns a ClockOffset.
+        """
+        measurements = self._with_retry(lambda client: self._read_clock(client, samples))
+        rtt, offset = min(measurements)
+        return ClockOffset(offset, rtt, measurements, datetime.now(timezone.utc))
+
+    def _read_clock(self, client, samples, timeout=DEFAULT_COMMAND_TIMEOUT):
+        """Returns (rtt, offset) for samples clock readings over one CLOCK_READER channel."""
+        measurements = []
+        with stage("ssh_command"):
+            stdin, stdout, _ = client.exec_command(CLOCK_READER, timeout=timeout)
+            with held(stdout.channel.close):
+                try:
+                    for index in range(samples + 1):
+                        sent = time.time()
+                        stdin.write("\n")
+                        stdin.flush()
+                        line = stdout.readline()
+                        received = time.time()
+                        if not line:
+                            raise EOFError("The remote clock reader stopped")
+                        try:
+                            # EPOCHREALTIME follows the locale's decimal separator.
+                            remote = float(line.strip().replace(",", "."))
+                        except ValueError:
+                            raise ValueError(f"Unexpected remote clock reading {line.strip()!r}")
+                        if index:
+                            rtt = received - sent
+                            measurements.append((rtt, remote - (sent + rtt / 2)))
+                finally:
+                    stdin.channel.shutdown_write()
+                    stdout.channel.close()
+            raise_if_cancelled()
+        return measurements
+
+    def step_clock(self, offset):
+        """
+        Steps the remote clock back by offset seconds.
+
+        The correction is applied to the remote clock's own reading inside the sudo call, so
+        neither the SSH round trip nor the password prompt adds to the error.
+        """
+        script = f'date -u --set "@$(date +%s.%N | awk "{{printf \\"%.6f\\", \\$1 - ({offset:.6f})}}")"'
+        # An empty prompt keeps sudo's password prompt out of stderr.
+        command = f"sudo -kS -p '' sh -c {shlex.quote(script)}"
+        # Never resend: a step that ran before the session dropped must not be applied twice.
+        result = self.run_command(command, input=self.password + '\n', retry=False)
+        return result.stdout, result.stderr
 
-            output = stdout.read().decode()
-            error = stderr.read().decode()
+    def set_time_utc(self, threshold=DEFAULT_STEP_THRESHOLD, samples=DEFAULT_OFFSET_SAMPLES):
+        """
+        Sets the remote host's time to the current UTC time if it is off by more than threshold seconds.
 
-            result = ""
+        The offset is measured with measure_offset before and after stepping the clock.
+        """
+        if not self.is_connected():
+            return "Not connected. Please connect first."
+
+        try:
+            before = self.measure_offset(samples)
+            result = f"{before}.\n"
+            if abs(before.offset) <= threshold:
+                return result + f"Within {threshold * 1000:.0f} ms threshold, clock not stepped."
+
+            output, error = self.step_clock(before.offset)
             if output:
                 result += f"Output:\n{output}\n"
             if error:
-                result += f"Error:\n{error}\n"
-            if not result:
-                result = "Time synchronization completed successfully, no output."
-            return result
+                return result + f"Error:\n{error}\n"
+            after = self.measure_offset(samples)
+            return result + f"Clock stepped. {after}."
         except Exception as e:
             return f"An error occurred during time synchronization: {e}"
 
-def connect_and_set_time(host, username, password):
+
+class ClockDriftMonitor:
     """
-    Connects to a remote host, sets the time, and disconnects.
+    Measures a connected Shake's clock offset every interval seconds and keeps the history.
+
+    on_update(measurement, drift) is called from the monitor thread after each measurement,
+    drift being the least-squares drift rate in parts per million (None until there are two
+    measurements). on_error(exception) is called when a measurement fails.
     """
+    def __init__(self, communicator, interval=DEFAULT_DRIFT_INTERVAL, samples=DEFAULT_OFFSET_SAMPLES,
+                 history=DEFAULT_DRIFT_HISTORY, on_update=None, on_error=None):
+        self.communicator = communicator
+        self.interval = interval
+        self.samples = samples
+        self.history = deque(maxlen=history)
+        self.on_update = on_update
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="clock-drift", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.measure()
+            except Exception as e:
+                logging.error(f"Clock offset measurement on {self.communicator.host} failed: {e}")
+                if self.on_error:
+                    self.on_error(e)
+            self._stop.wait(self.interval)
+
+    def measure(self):
+        """Takes one offset measurement and adds it to the history."""
+        measurement = self.communicator.measure_offset(self.samples)
+        with self._lock:
+            self.history.append(measurement)
+        drift = self.drift_ppm()
+        logging.info(f"{self.communicator.host}: {measurement}"
+                     + (f", drift {drift:+.2f} ppm" if drift is not None else ""))
+        if self.on_update:
+            self.on_update(measurement, drift)
+        return measurement
+
+    def drift_ppm(self):
+        """Returns the least-squares slope of offset over time in parts per million."""
+        with self._lock:
+            points = [(m.measured_at.timestamp(), m.offset) for m in self.history]
+        if len(points) < 2:
+            return None
+        t0 = points[0][0]
+        times = [t - t0 for t, _ in points]
+        offsets = [offset for _, offset in points]
+        mean_t = sum(times) / len(times)
+        mean_offset = sum(offsets) / len(offsets)
+        variance = sum((t - mean_t) ** 2 for t in times)
+        if variance == 0:
+            return None
+        slope = sum((t - mean_t) * (o - mean_offset) for t, o in zip(times, offsets)) / variance
+        return slope * 1e6
+
+    def offset_history(self):
+        """Returns (measured_at, offset, rtt) tuples, oldest first."""
+        with self._lock:
+            return [(m.measured_at, m.offset, m.rtt) for m in self.history]
+
+class SessionPool:
+    """
+    Keeps one live ShakeCommunicator per (host, username) for reuse across syncs and status checks.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host, username, password):
+        """Returns a connected session, reusing the pooled one when it is still alive."""
+        key = (host, username)
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is not None and session.password == password and session.is_connected():
+            with self._lock:
+                self.hits += 1
+            return session
+
+        new_session = ShakeCommunicator(host, username, password)
+        result = new_session.connect()
+        if "successful" not in result:
+            raise ConnectionError(result)
+        with self._lock:
+            self.misses += 1
+            self._sessions[key] = new_session
+        if session is not None:
+            session.disconnect()
+        return new_session
+
+    def close(self, host, username):
+        with self._lock:
+            session = self._sessions.pop((host, username), None)
+        if session is not None:
+            session.disconnect()
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.disconnect()
+
+    def stats(self):
+        """Returns the pool hit/miss counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "open": sum(session.is_connected() is True for session in self._sessions.values()),
+                "reconnects": sum(session.reconnects for session in self._sessions.values()),
+            }
+
+
+_session_pool = SessionPool()
+
+
+def get_session_pool():
+    """
+    Returns the process-wide SSH session pool.
+    """
+    return _session_pool
+
+
+def connect_and_set_time(host, username, password, threshold=DEFAULT_STEP_THRESHOLD, pool=None):
+    """
+    Connects to a remote host and sets the time.
+
+    Without a pool the session is closed again afterwards; with one it is kept for reuse.
+    """
+    if pool is not None:
+        try:
+            return pool.get(host, username, password).set_time_utc(threshold)
+        except ConnectionError as e:
+            return str(e)
+
     shake = ShakeCommunicator(host, username, password)
     connection_result = shake.connect()
     if "successful" not in connection_result:
         return connection_result
 
-    sync_result = shake.set_time_utc()
+    sync_result = shake.set_time_utc(threshold)
     shake.disconnect()
     return sync_result
+
+
+class FleetSyncResult:
+    """
+    Outcome of connecting to and syncing one Shake in a fleet sync.
+    """
+    def __init__(self, host, username):
+        self.host = host
+        self.username = username
+        self.ok = False
+        self.connect_seconds = None
+        self.sync_seconds = None
+        self.total_seconds = None
+        self.message = ""
+
+
+def sync_host(host, username, password, threshold=DEFAULT_STEP_THRESHOLD, pool=None):
+    """
+    Connects to one host and sets its time, timing each step.
+
+    Without a pool the session is closed afterwards; with one it is taken from and left in
+    the pool. Returns a FleetSyncResult; failures are recorded in it rather than raised.
+    """
+    result = FleetSyncResult(host, username)
+    start = time.perf_counter()
+    shake = None
+    try:
+        if pool is not None:
+            try:
+                shake = pool.get(host, username, password)
+            except ConnectionError as e:
+                result.message = str(e)
+                return result
+            finally:
+                result.connect_seconds = time.perf_counter() - start
+        else:
+            shake = ShakeCommunicator(host, username, password)
+            connection_result = shake.connect()
+            result.connect_seconds = time.perf_counter() - start
+            if "successful" not in connection_result:
+                result.message = connection_result
+                return result
+
+        sync_start = time.perf_counter()
+        sync_result = shake.set_time_utc(threshold)
+        result.sync_seconds = time.perf_counter() - sync_start
+        result.ok = "Error" not in sync_result and "error occurred" not in sync_result
+        result.message = sync_result.strip()
+        return result
+    finally:
+        if pool is None and shake is not None:
+            shake.disconnect()
+        result.total_seconds = time.perf_counter() - start
+
+
+def sync_fleet(targets, max_workers=DEFAULT_FLEET_WORKERS, on_result=None, threshold=DEFAULT_STEP_THRESHOLD, pool=None):
+    """
+    Syncs the time of many Shakes concurrently, at most max_workers at once.
+
+    targets is a list of (host, username, password) tuples. on_result(index, result) is called
+    from the worker threads as each host finishes, index being its position in targets.
+    With a SessionPool the hosts' sessions are reused and left open for the next run.
+    Hosts are synced as part of the calling thread's task, so cancelling it stops them.
+    Returns the FleetSyncResults in target order.
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    task = current_task()
+    results = [None] * len(targets)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fleet-sync") as executor:
+        futures = {executor.submit(run_in_task, task, sync_host, *target, threshold=threshold, pool=pool): index
+                   for index, target in enumerate(targets)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                host, username, _ = targets[index]
+                result = FleetSyncResult(host, username)
+                result.message = f"An error occurred during fleet sync: {e}"
+            results[index] = result
+            if on_result:
+                on_result(index, result)
+    return results
@@ -0,0 +1,72 @@
+import logging
+import queue
+import time
+import tkinter as tk
+
+DEFAULT_BUDGET_MS = 25
+DEFAULT_INTERVAL_MS = 50
+MAX_OUTPUT_LINES = 5000
+
+
+def append_bounded(widget, text, max_lines=MAX_OUTPUT_LINES):
+    """
+    Appends text to a Text widget, scrolls to it and drops the oldest lines beyond max_lines.
+    """
+    widget.insert(tk.END, text)
+    lines = int(widget.index("end-1c").split(".")[0])
+    if lines > max_lines:
+        widget.delete("1.0", f"{lines - max_lines + 1}.0")
+    widget.see(tk.END)
+
+
+class QueueDispatcher:
+    """
+    Runs (callable, *args) messages posted by worker threads on the Tk thread in batches.
+
+    Each drain runs messages until the queue is empty or budget_ms has passed, so a burst
+    of progress messages is cleared in a few frames instead of one message per tick.
+    Consecutive messages for a coalescing callable, such as a log append, are merged into
+    a single call with their text concatenated. Any other message flushes the merged text
+    first, so output order is kept.
+    """
+    def __init__(self, task_queue, coalesce=(), budget_ms=DEFAULT_BUDGET_MS):
+        self.task_queue = task_queue
+        self.coalesce = set(coalesce)
+        self.budget = budget_ms / 1000
+        self.messages = 0
+        self.calls = 0
+
+    def _call(self, func, args):
+        self.calls += 1
+        try:
+            func(*args)
+        except Exception:
+            logging.error(f"UI message {getattr(func, '__name__', func)} failed", exc_info=True)
+
+    def _flush(self, pending):
+        for func, texts in pending.items():
+            self._call(func, ("".join(texts),))
+        pending.clear()
+
+    def drain(self):
+        """
+        Runs queued messages for up to the time budget. Returns True if messages are left over.
+        """
+        deadline = time.perf_counter() + self.budget
+        pending = {}
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    message = self.task_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.messages += 1
+                func, args = message[0], message[1:]
+                if func in self.coalesce and len(args) == 1:
+                    pending.setdefault(func, []).append(args[0])
+                    continue
+                self._flush(pending)
+                self._call(func, args)
+        finally:
+            self._flush(pending)
+        return not self.task_queue.empty()
@@ -0,0 +1,202 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, font as tkfont
+
+
+class VirtualTable(ttk.Frame):
+    """
+    A table that only creates Treeview rows for the part of the model that is on screen.
+
+    The model needs COLUMNS, EDITABLE (column indexes), __len__, row_values(row) and
+    set_value(row, column, text). Scrolling re-fills the same handful of rows with new
+    values, so a 1000-row schedule costs no more to show than a 20-row one.
+    Double-clicking an editable cell opens an inline editor; Enter or leaving the cell
+    saves it and Escape cancels.
+    """
+    def __init__(self, parent, model=None, column_widths=None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.model = model
+        self.offset = 0
+        self.visible = 1
+        self.selected = None
+        self.editor = None
+        self.row_height = self._style_row_height()
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="browse")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.column_widths = column_widths or {}
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Double-1>", self.on_double_click)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Up>", lambda e: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self.move_selection(-self.visible))
+        self.tree.bind("<Next>", lambda e: self.move_selection(self.visible))
+        self.tree.bind("<Return>", lambda e: self.edit_cell(self.selected, 1) if self.selected is not None else None)
+
+        if model is not None:
+            self.set_model(model)
+
+    @staticmethod
+    def _style_row_height():
+        height = ttk.Style().lookup("Treeview", "rowheight")
+        try:
+            return int(height)
+        except (TypeError, ValueError):
+            return tkfont.nametofont("TkDefaultFont").metrics("linespace") + 4
+
+    def set_model(self, model):
+        """Shows a new model, scrolled to the top."""
+        self.close_editor(save=False)
+        self.model = model
+        self.offset = 0
+        self.selected = None
+        columns = [f"c{i}" for i in range(len(model.COLUMNS))]
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=columns)
+        for column_id, heading in zip(columns, model.COLUMNS):
+            self.tree.heading(column_id, text=heading)
+            self.tree.column(column_id, width=self.column_widths.get(heading, 160), stretch=True)
+        self.refresh()
+
+    def on_resize(self, event):
+        # The heading takes about one row; whatever is left holds the visible rows.
+        visible = max(1, event.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    def refresh(self):
+        """Re-fills the on-screen rows from the model at the current offset."""
+        if self.model is None:
+            return
+        total = len(self.model)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        count = min(self.visible, total - self.offset)
+
+        items = self.tree.get_children()
+        for iid in items[count:]:
+            self.tree.delete(iid)
+        for index in range(len(items), count):
+            self.tree.insert("", "end", iid=f"slot{index}")
+        for index in range(count):
+            self.tree.item(f"slot{index}", values=self.model.row_values(self.offset + index))
+
+        if self.selected is not None and self.offset <= self.selected < self.offset + count:
+            slot = f"slot{self.selected - self.offset}"
+            if self.tree.selection() != (slot,):
+                self.tree.selection_set(slot)
+            self.tree.focus(slot)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+        self._measure_row_height()
+
+    def _measure_row_height(self):
+        # Themes differ in row height, so correct the style guess once rows are drawn.
+        children = self.tree.get_children()
+        if not children:
+            return
+        bbox = self.tree.bbox(children[0])
+        if bbox and bbox[3] > 0 and bbox[3] != self.row_height:
+            self.row_height = bbox[3]
+            visible = max(1, (self.tree.winfo_height() - bbox[1]) // self.row_height)
+            if visible != self.visible:
+                self.visible = visible
+                self.refresh()
+
+    def yview(self, *args):
+        if self.model is None or not len(self.model):
+            return
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.model))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.visible if args[2] == "pages" else 1)
+            self.offset += step
+        self.close_editor()
+        self.refresh()
+
+    def scroll(self, rows):
+        self.close_editor()
+        self.offset += rows
+        self.refresh()
+        return "break"
+
+    def on_mousewheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_select(self, event):
+        selection = self.tree.selection()
+        if selection:
+            self.selected = self.offset + self.tree.index(selection[0])
+
+    def move_selection(self, rows):
+        if self.model is None or not len(self.model):
+            return "break"
+        current = self.selected if self.selected is not None else self.offset
+        self.selected = max(0, min(current + rows, len(self.model) - 1))
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + self.visible:
+            self.offset = self.selected - self.visible + 1
+        self.refresh()
+        return "break"
+
+    def on_double_click(self, event):
+        if self.tree.identify_region(event.x, event.y) != "cell":
+            return
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return
+        column = int(self.tree.identify_column(event.x)[1:]) - 1
+        self.edit_cell(self.offset + self.tree.index(iid), column)
+
+    def edit_cell(self, row, column):
+        """Opens an inline editor over a cell, scrolling it into view first."""
+        if column not in self.model.EDITABLE:
+            return
+        self.close_editor()
+        if not self.offset <= row < self.offset + self.visible:
+            self.offset = row
+            self.refresh()
+        self.tree.update_idletasks()
+        slot = f"slot{row - self.offset}"
+        bbox = self.tree.bbox(slot, f"#{column + 1}")
+        if not bbox:
+            return
+        x, y, width, height = bbox
+        entry = ttk.Entry(self.tree)
+        entry.insert(0, self.model.row_values(row)[column])
+        entry.select_range(0, tk.END)
+        entry.place(x=x, y=y, width=width, height=height)
+        entry.focus_set()
+        entry.bind("<Return>", lambda e: self.close_editor())
+        entry.bind("<KP_Enter>", lambda e: self.close_editor())
+        entry.bind("<Escape>", lambda e: self.close_editor(save=False))
+        entry.bind("<FocusOut>", lambda e: self.close_editor())
+        self.editor = (entry, row, column)
+
+    def close_editor(self, save=True):
+        """Closes the inline editor, saving its text into the model unless save is False."""
+        if self.editor is None:
+            return
+        entry, row, column = self.editor
+        self.editor = None
+        text = entry.get()
+        entry.destroy()
+        self.tree.focus_set()
+        if save:
+            try:
+                self.model.set_value(row, column, text)
+            except ValueError as e:
+                messagebox.showerror("Input Error", f"{self.model.COLUMNS[column]} for row {row + 1}: {e}")
+        self.refresh()
@@ -0,0 +1,324 @@
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+import time
+from obspy import read, Stream, UTCDateTime
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+INDEX_FILE = "index.json"
+
+
+def default_cache_dir():
+    """
+    Returns the per-user cache directory: %LOCALAPPDATA%\\ShakeFetch\\cache on Windows and
+    $XDG_CACHE_HOME/shakefetch (~/.cache/shakefetch) elsewhere.
+    """
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "ShakeFetch", "cache")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "shakefetch")
+
+
+def subtract_intervals(start, end, covered, min_gap=0.0):
+    """
+    Returns the parts of [start, end] not covered by any (start, end) interval in covered.
+
+    Uncovered pieces shorter than min_gap seconds are dropped.
+    """
+    missing = []
+    cursor = start
+    for c_start, c_end in sorted(covered):
+        if c_end <= cursor:
+            continue
+        if c_start >= end:
+            break
+        if c_start > cursor:
+            missing.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return [(s, e) for s, e in missing if e - s >= min_gap]
+
+
+def trace_intervals(traces):
+    """Returns the sorted (start, end) seconds each trace covers, its last sample counting for one delta."""
+    return sorted((float(tr.stats.starttime), float(tr.stats.endtime) + tr.stats.delta)
+                  for tr in traces if tr.stats.npts)
+
+
+class WaveformCache:
+    """
+    On-disk waveform cache keyed by wave server and NSLC with an index of the time ranges held.
+
+    Each fetched piece of a channel is stored as its own miniSEED segment file. The index
+    records the intervals each segment actually holds data for, so only the parts of a window
+    a channel is missing, including its gaps, are requested from the wave server. A request
+    for a wildcard channel such as EH? is looked up per channel, for the channels
+    list_channels(params) returns. When the cache grows past max_bytes, the least recently
+    used segments are evicted. cache_dir defaults to the per-user default_cache_dir().
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, min_gap=1.0):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        # Sub-sample slivers at window edges are not worth a round trip.
+        self.min_gap = min_gap
+        self._lock = threading.RLock()
+        self.index = {}
+        # Segment files a fetch is about to read, which evict() must leave alone.
+        self._pins = {}
+        self._channels = {}
+        self.stats = {
+            "hits": 0,
+            "partial_hits": 0,
+            "misses": 0,
+            "bytes_from_cache": 0,
+            "bytes_fetched": 0,
+            "evictions": 0,
+        }
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def key(params, channel=None):
+        # Two wave servers can serve the same NSLC, so the server is part of the key.
+        return (f"{params['host']}:{params['port']}/{params['net']}.{params['sta']}.{params['loc']}."
+                f"{params['cha'] if channel is None else channel}")
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+        for key in list(self.index):
+            segments = []
+            for seg in self.index[key]:
+                path = os.path.join(self.cache_dir, seg["file"])
+                # Drop segments whose file was deleted behind our back, and those of older
+                # caches that recorded a single span over gaps and missing channels.
+                if "intervals" not in seg:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                elif os.path.exists(path):
+                    segments.append(seg)
+            if segments:
+                self.index[key] = segments
+            else:
+                del self.index[key]
+
+    def _save_index(self):
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(seg["bytes"] for segs in self.index.values() for seg in segs)
+
+    def missing_intervals(self, key, start, end):
+        """Returns the (start, end) sub-intervals of the window the channel key holds no data for."""
+        with self._lock:
+            covered = [tuple(interval) for seg in self.index.get(key, []) for interval in seg["intervals"]]
+        return subtract_intervals(float(start), float(end), covered, self.min_gap)
+
+    def channels(self, params, list_channels=None):
+        """
+        Returns the channels a request for params covers, or None if a wildcard request's
+        channels are not known.
+
+        A wildcard is expanded with list_channels(params), asked once per station, or else with
+        the matching channels the cache already holds for the station.
+        """
+        if params['cha'][-1:] not in "?*":
+            return [params['cha']]
+        station_key = self.key(params)
+        with self._lock:
+            channels = self._channels.get(station_key)
+        if channels is None and list_channels is not None:
+            try:
+                channels = list_channels(params)
+            except Exception as e:
+                logging.warning(f"Could not list the channels of {station_key}, using those cached: {e}")
+            else:
+                with self._lock:
+                    self._channels[station_key] = channels
+        if channels is None:
+            prefix = self.key(params, channel="")
+            with self._lock:
+                channels = sorted(key[len(prefix):] for key in self.index
+                                  if key.startswith(prefix) and fnmatch.fnmatchcase(key[len(prefix):], params['cha']))
+        return list(channels) or None
+
+    def store(self, key, stream, start, end, pin=False):
+        """
+        Saves one channel's stream fetched for [start, end] as a segment holding the intervals
+        the stream has data for. A pinned segment is kept from evict() until it is unpinned.
+        """
+        intervals = [[max(interval_start, float(start)), min(interval_end, float(end))]
+                     for interval_start, interval_end in trace_intervals(stream)
+                     if interval_end > float(start) and interval_start < float(end)]
+        if not intervals:
+            return None
+        safe_key = re.sub(r'[^A-Za-z0-9._-]', '_', key)
+        filename = f"{safe_key}_{int(float(start) * 1000)}_{int(float(end) * 1000)}.mseed"
+        path = os.path.join(self.cache_dir, filename)
+        stream.write(path, format="MSEED")
+        nbytes = os.path.getsize(path)
+        with self._lock:
+            segments = [seg for seg in self.index.get(key, []) if seg["file"] != filename]
+            segments.append({"intervals": intervals, "file": filename, "bytes": nbytes, "last_access": time.time()})
+            self.index[key] = sorted(segments, key=lambda seg: seg["intervals"][0][0])
+            self.stats["bytes_fetched"] += nbytes
+            if pin:
+                self._pin([filename], 1)
+            self._save_index()
+        return filename
+
+    def _overlapping(self, key, start, end):
+        return [seg for seg in self.index.get(key, [])
+                if any(interval_end >= start and interval_start <= end for interval_start, interval_end in seg["intervals"])]
+
+    def _pin(self, files, count):
+        with self._lock:
+            for filename in files:
+                pins = self._pins.get(filename, 0) + count
+                if pins:
+                    self._pins[filename] = pins
+                else:
+                    del self._pins[filename]
+
+    def read(self, key, start, end, fresh_files=()):
+        """
+        Reads and stitches all cached segments of a channel key overlapping [start, end].
+
+        Segments listed in fresh_files were just fetched and are not counted as cache bytes.
+        """
+        start, end = float(start), float(end)
+        with self._lock:
+            segments = self._overlapping(key, start, end)
+            now = time.time()
+            for seg in segments:
+                seg["last_access"] = now
+            if segments:
+                self._save_index()
+            # Keep evict() on another thread from removing the files until they are read.
+            self._pin([seg["file"] for seg in segments], 1)
+        stream = Stream()
+        try:
+            for seg in segments:
+                stream += read(os.path.join(self.cache_dir, seg["file"]), format="MSEED")
+                if seg["file"] not in fresh_files:
+                    with self._lock:
+                        self.stats["bytes_from_cache"] += seg["bytes"]
+        finally:
+            self._pin([seg["file"] for seg in segments], -1)
+        if not len(stream):
+            return stream
+        stream.merge(method=1)
+        stream.trim(UTCDateTime(start), UTCDateTime(end))
+        # Gaps the server could not fill come back as masked arrays, which miniSEED cannot store.
+        return stream.split()
+
+    def evict(self):
+        """Removes least recently used segments until the cache is within max_bytes."""
+        with self._lock:
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return
+            entries = sorted(((seg["last_access"], key, seg) for key, segs in self.index.items() for seg in segs
+                              if seg["file"] not in self._pins),
+                             key=lambda entry: entry[0])
+            for _, key, seg in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, seg["file"]))
+                except FileNotFoundError:
+                    pass
+                self.index[key].remove(seg)
+                if not self.index[key]:
+                    del self.index[key]
+                total -= seg["bytes"]
+                self.stats["evictions"] += 1
+            self._save_index()
+
+    def fetch(self, params, fetch_func, list_channels=None):
+        """
+        Returns the requested window, calling fetch_func(params) only for the sub-intervals
+        each channel is missing.
+
+        list_channels(params) expands a wildcard channel, as channels() describes. If the
+        channels are still unknown, the whole window is fetched and cached per channel.
+        """
+        start, end = float(params['start_time']), float(params['end_time'])
+        channels = self.channels(params, list_channels)
+        with self._lock:
+            if channels is None:
+                missing, cached_files = {None: [(start, end)]}, []
+            else:
+                missing = {channel: self.missing_intervals(self.key(params, channel), start, end)
+                           for channel in channels}
+                # What the cache already holds must still be there when it is read.
+                cached_files = [seg["file"] for channel in channels
+                                for seg in self._overlapping(self.key(params, channel), start, end)]
+                self._pin(cached_files, 1)
+            if not any(missing.values()):
+                self.stats["hits"] += 1
+            elif all(gaps == [(start, end)] for gaps in missing.values()):
+                self.stats["misses"] += 1
+            else:
+                self.stats["partial_hits"] += 1
+
+        fresh_files = []
+        try:
+            for channel, gaps in missing.items():
+                for gap_start, gap_end in gaps:
+                    gap_params = dict(params, start_time=UTCDateTime(gap_start), end_time=UTCDateTime(gap_end))
+                    if channel is not None:
+                        gap_params["cha"] = channel
+                    piece = fetch_func(gap_params)
+                    received = sorted({trace.stats.channel for trace in piece})
+                    if channel is None:
+                        channels = received
+                    for name in received:
+                        # Pinned until read, so evict() on another thread cannot remove it first.
+                        filename = self.store(self.key(params, name), piece.select(channel=name), gap_start, gap_end,
+                                              pin=True)
+                        if filename:
+                            fresh_files.append(filename)
+            stream = Stream()
+            for channel in channels or ():
+                stream += self.read(self.key(params, channel), start, end, fresh_files)
+        finally:
+            self._pin(cached_files + fresh_files, -1)
+        self.evict()
+        return stream
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["segments"] = sum(len(segs) for segs in self.index.values())
+            stats["total_bytes"] = self.total_bytes()
+        return stats
+
+    def clear(self):
+        with self._lock:
+            for segs in self.index.values():
+                for seg in segs:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, seg["file"]))
+                    except FileNotFoundError:
+                        pass
+            self.index = {}
+            self._save_index()
@@ -0,0 +1,211 @@
+import time
+import logging
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+BLOCK = 16
+LEVEL_FACTOR = 4
+ZOOM_STEP = 1.5
+MIN_VIEW_SAMPLES = 20
+
+
+class MinMaxPyramid:
+    """
+    Min/max envelopes of one trace at a ladder of block sizes (16, 64, 256, ... samples).
+
+    envelope() reads the coarsest level that still has at least one block per pixel, so
+    drawing any range costs a few pixels' worth of work however long the trace is.
+    The pyramid adds about a sixth of the trace's size in memory.
+    """
+    def __init__(self, data, start, delta):
+        self.data = np.asarray(data)
+        self.start = start
+        self.delta = delta
+        self.levels = []
+        mins = maxs = self.data
+        block = 1
+        factor = BLOCK
+        while len(mins) > factor:
+            mins = _reduce(mins, factor, np.minimum)
+            maxs = _reduce(maxs, factor, np.maximum)
+            block *= factor
+            self.levels.append((block, mins, maxs))
+            factor = LEVEL_FACTOR
+
+    @property
+    def end(self):
+        return self.start + (len(self.data) - 1) * self.delta
+
+    def envelope(self, t0, t1, pixels):
+        """
+        Returns (x, y) of a line to draw between times t0 and t1 at pixels horizontal resolution.
+
+        While there are fewer than two samples per pixel the raw samples are returned.
+        Otherwise the line zig-zags between each pixel column's minimum and maximum, which
+        draws the same filled envelope as the full trace.
+        """
+        first = max(0, int(np.floor((t0 - self.start) / self.delta)))
+        last = min(len(self.data), int(np.ceil((t1 - self.start) / self.delta)) + 1)
+        if last <= first:
+            return np.empty(0), np.empty(0)
+        samples_per_pixel = (last - first) / max(pixels, 1)
+        if samples_per_pixel < 2:
+            x = self.start + np.arange(first, last) * self.delta
+            return x, self.data[first:last]
+
+        block, mins, maxs = 1, self.data, self.data
+        for level_block, level_mins, level_maxs in self.levels:
+            if level_block > samples_per_pixel:
+                break
+            block, mins, maxs = level_block, level_mins, level_maxs
+        first_block, last_block = first // block, -(-last // block)
+        mins, maxs = mins[first_block:last_block], maxs[first_block:last_block]
+
+        edges = np.unique(np.linspace(0, len(mins), pixels + 1).astype(int)[:-1])
+        column_mins = np.minimum.reduceat(mins, edges)
+        column_maxs = np.maximum.reduceat(maxs, edges)
+        column_x = self.start + (first_block + edges) * block * self.delta
+
+        x = np.repeat(column_x, 2)
+        y = np.empty(len(x))
+        y[0::2] = column_mins
+        y[1::2] = column_maxs
+        return x, y
+
+
+def _reduce(values, factor, ufunc):
+    """Reduces values in blocks of factor, the last block possibly shorter."""
+    return ufunc.reduceat(values, np.arange(0, len(values), factor))
+
+
+class WaveformViewer(ttk.Frame):
+    """
+    An embedded viewer for long streams, one axis per channel with a shared time axis.
+
+    Each trace is drawn from its MinMaxPyramid at the canvas' pixel width, and redrawn the same
+    way after every pan or zoom, so a multi-hour 100 Hz recording draws as fast as a minute.
+    Full-resolution samples are drawn once the view is zoomed in to under two samples a pixel.
+    The mouse wheel zooms around the cursor, dragging pans and double-clicking resets the view.
+    """
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.figure = Figure(figsize=(6, 3), dpi=100)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.status = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.status).pack(anchor="w")
+
+        self.channels = []
+        self.axes = []
+        self.view = (0.0, 1.0)
+        self.extent = (0.0, 1.0)
+        self.origin = None
+        self._drag = None
+
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("button_press_event", self.on_press)
+        self.canvas.mpl_connect("button_release_event", self.on_release)
+        self.canvas.mpl_connect("motion_notify_event", self.on_motion)
+        self.canvas.mpl_connect("resize_event", lambda event: self.redraw())
+
+    def set_stream(self, stream):
+        """Shows a new stream, zoomed out to its full length."""
+        start = time.perf_counter()
+        self.origin = min(trace.stats.starttime for trace in stream) if len(stream) else None
+        by_channel = {}
+        # Masked (gappy) traces are drawn as separate segments.
+        for trace in stream.split():
+            if not trace.stats.npts:
+                continue
+            offset = trace.stats.starttime - self.origin
+            by_channel.setdefault(trace.id, []).append(MinMaxPyramid(trace.data, offset, trace.stats.delta))
+
+        self.figure.clear()
+        self.channels = []
+        self.axes = []
+        shared = None
+        for index, (channel_id, pyramids) in enumerate(sorted(by_channel.items())):
+            axis = self.figure.add_subplot(len(by_channel), 1, index + 1, sharex=shared)
+            shared = shared or axis
+            axis.set_ylabel(channel_id.split(".")[-1])
+            axis.label_outer()
+            lines = [axis.plot([], [], color="k", linewidth=0.5)[0] for _ in pyramids]
+            low = min(float(pyramid.levels[-1][1].min() if pyramid.levels else pyramid.data.min()) for pyramid in pyramids)
+            high = max(float(pyramid.levels[-1][2].max() if pyramid.levels else pyramid.data.max()) for pyramid in pyramids)
+            axis.set_ylim(*_padded(low, high))
+            self.channels.append(list(zip(pyramids, lines)))
+            self.axes.append(axis)
+        if self.axes:
+            self.axes[-1].set_xlabel(f"Seconds since {self.origin.strftime('%Y-%m-%d %H:%M:%S')} UTC")
+            self.extent = (min(p.start for ch in self.channels for p, _ in ch),
+                           max(p.end for ch in self.channels for p, _ in ch))
+        else:
+            self.extent = (0.0, 1.0)
+        self.figure.subplots_adjust(left=0.08, right=0.99, top=0.98, bottom=0.15, hspace=0.05)
+        self.view = self.extent
+        logging.info(f"Waveform viewer built envelopes for {len(stream)} traces in "
+                     f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        self.redraw()
+
+    def redraw(self):
+        if not self.axes:
+            self.canvas.draw_idle()
+            return
+        start = time.perf_counter()
+        t0, t1 = self.view
+        pixels = max(1, int(self.axes[0].get_window_extent().width))
+        total_points = 0
+        for channel in self.channels:
+            for pyramid, line in channel:
+                x, y = pyramid.envelope(t0, t1, pixels)
+                line.set_data(x, y)
+                total_points += len(x)
+        self.axes[0].set_xlim(t0, t1)
+        self.canvas.draw_idle()
+        self.status.set(f"{t1 - t0:.1f} s shown, {total_points} points drawn, "
+                        f"envelopes in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def set_view(self, t0, t1):
+        """Shows [t0, t1] seconds after the stream start, kept inside the stream."""
+        low, high = self.extent
+        min_width = MIN_VIEW_SAMPLES * min((p.delta for ch in self.channels for p, _ in ch), default=1.0)
+        width = min(max(t1 - t0, min_width), high - low)
+        t0 = min(max(t0, low), high - width)
+        self.view = (t0, t0 + width)
+        self.redraw()
+
+    def on_scroll(self, event):
+        if event.xdata is None:
+            return
+        scale = 1 / ZOOM_STEP if event.button == "up" else ZOOM_STEP
+        t0, t1 = self.view
+        self.set_view(event.xdata - (event.xdata - t0) * scale, event.xdata + (t1 - event.xdata) * scale)
+
+    def on_press(self, event):
+        if event.inaxes is None:
+            return
+        if event.dblclick:
+            self.set_view(*self.extent)
+            return
+        self._drag = (event.x, self.view)
+
+    def on_motion(self, event):
+        if self._drag is None or event.x is None:
+            return
+        x, (t0, t1) = self._drag
+        seconds_per_pixel = (t1 - t0) / max(1, self.axes[0].get_window_extent().width)
+        shift = (x - event.x) * seconds_per_pixel
+        self.set_view(t0 + shift, t1 + shift)
+
+    def on_release(self, event):
+        self._drag = None
+
+
+def _padded(low, high):
+    if high <= low:
+        return low - 1, high + 1
+    margin = (high - low) * 0.05
+    return low - margin, high + margin
@@ -0,0 +1,22 @@
+import os
+import sys
+import time
+import pytest
+
+# The modules import one another by bare name, as they do when run from shakefetch/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shakefetch"))
+
+
+@pytest.fixture
+def wave_server():
+    """A SyntheticWaveServer on localhost holding the last week of a three-component signal."""
+    from synthetic_wave_server import SyntheticWaveServer
+    with SyntheticWaveServer() as server:
+        yield server
+
+
+@pytest.fixture
+def window_start():
+    """A whole second an hour ago, well inside the synthetic server's retention."""
+    from obspy import UTCDateTime
+    return UTCDateTime(int(time.time()) - 3600)
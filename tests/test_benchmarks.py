@@ -0,0 +1,14 @@
+import os
+from benchmarks import format_results, run_suite
+
+
+def test_run_suite_creates_work_dir(tmp_path):
+    work_dir = str(tmp_path / "not" / "yet" / "there")
+    results = run_suite(stations=2, window_minutes=1, fetch_minutes=1, latency_ms=0, repeats=1, memory=False,
+                        skip=("mhvsr",), work_dir=work_dir)
+    assert os.path.isdir(work_dir)
+    assert os.listdir(work_dir) == []
+    fetch, multifetch = results["results"]["fetch"], results["results"]["multifetch"]
+    assert fetch["samples"] > 0
+    assert multifetch["windows_ok"] == 2 and multifetch["windows_failed"] == 0
+    assert format_results(results)
@@ -0,0 +1,63 @@
+import glob
+import os
+import time
+from obspy import UTCDateTime, read
+from continuous_acquisition import ContinuousAcquisition, RollingMiniSeedWriter
+from data_acquisition import ConnectionPool
+
+
+def test_writer_splits_traces_at_period_boundaries(tmp_path):
+    from synthetic_wave_server import SyntheticSignal
+    hour = UTCDateTime(int(time.time()) // 3600 * 3600 - 3600)
+    stream = SyntheticSignal().stream("AM", "R0000", "00", ["EHZ"], hour - 30, hour + 30)
+    writer = RollingMiniSeedWriter(str(tmp_path), "AM", "R0000", "00", rotation="hour")
+    assert writer.write(stream) > 0
+    writer.close()
+    before = read(writer.path_for(float(hour - 3600)))
+    after = read(writer.path_for(float(hour)))
+    assert before[0].stats.npts == 3000 and before[0].stats.endtime < hour
+    assert after[0].stats.npts == 3001 and after[0].stats.starttime == hour
+
+
+def test_polls_write_rolling_files_and_advance_the_cursor(wave_server, tmp_path):
+    # Start five minutes before an hour boundary an hour ago, so the polls cross into the next file.
+    hour = UTCDateTime(int(time.time()) // 3600 * 3600 - 3600)
+    params = dict(wave_server.params, cha="EHZ")
+    pool = ConnectionPool()
+    acquisition = ContinuousAcquisition(params, str(tmp_path), rotation="hour", max_request_seconds=240,
+                                        pool=pool)
+    acquisition.cursor = hour - 300
+    try:
+        first = acquisition.poll()
+        second = acquisition.poll()
+    finally:
+        acquisition.writer.close()
+        pool.close_all()
+    assert first == 24001 and second == 24001
+    assert acquisition.cursor > hour + 170
+    assert acquisition.stats.polls == 2 and acquisition.stats.gaps == 0
+
+    files = sorted(glob.glob(os.path.join(str(tmp_path), "AM.R0000.00.*.mseed")))
+    assert [os.path.basename(path) for path in files] == [
+        f"AM.R0000.00.{(hour - 3600).strftime('%Y%m%dT%H')}.mseed",
+        f"AM.R0000.00.{hour.strftime('%Y%m%dT%H')}.mseed"]
+    stream = read(files[0]) + read(files[1])
+    stream.merge(method=-1)
+    assert len(stream) == 1 and stream[0].stats.npts == first + second
+    assert stream[0].stats.starttime == hour - 300
+
+
+def test_background_thread_catches_up_on_a_backlog(wave_server, tmp_path):
+    pool = ConnectionPool()
+    acquisition = ContinuousAcquisition(dict(wave_server.params, cha="EHZ"), str(tmp_path), poll_interval=5,
+                                        latency=0, max_request_seconds=60, pool=pool)
+    acquisition.start(UTCDateTime() - 290)
+    try:
+        deadline = time.time() + 10
+        while acquisition.stats.polls < 4 and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        acquisition.stop(timeout=10)
+        pool.close_all()
+    assert acquisition.stats.polls >= 4 and acquisition.stats.failed_polls == 0
+    assert acquisition.stats.samples >= 4 * 6000
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import pytest
+from data_acquisition import ConnectionPool, fetch_waveforms
+from fetch_scheduler import FetchScheduler, FetchStats, run_project_fetch
+from gap_refill import GapRefiller
+from project_manifest import ProjectManifest, STATUS_COMPLETE, STATUS_PARTIAL, window_filename
+from waveform_cache import WaveformCache
+
+
+def project_windows(server, start, count, seconds=60):
+    return [dict(server.params, station_num=n, start_time=start + (n - 1) * seconds, end_time=start + n * seconds)
+            for n in range(1, count + 1)]
+
+
+def test_fetch_stats_summary():
+    stats = FetchStats()
+    stats.record(True, 2_000_000)
+    stats.record(True, 1_000_000)
+    stats.record(False)
+    stats.elapsed = 2.0
+    assert (stats.windows_ok, stats.windows_failed, stats.bytes) == (2, 1, 3_000_000)
+    assert stats.windows_per_second == 1.0
+    assert stats.megabytes_per_second == 1.5
+    assert stats.summary().startswith("2 windows fetched, 1 failed, 3.00 MB")
+
+
+def test_scheduler_limits_requests_per_host(wave_server, window_start):
+    # Both names reach the same server but count as separate hosts.
+    pool = ConnectionPool()
+    active, peak = {}, {}
+    lock = threading.Lock()
+
+    def job(params):
+        host = params["host"]
+        with lock:
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        try:
+            stream = fetch_waveforms(params, pool=pool)
+            time.sleep(0.05)
+            return sum(trace.data.nbytes for trace in stream)
+        finally:
+            with lock:
+                active[host] -= 1
+
+    all_params = []
+    for host in ("127.0.0.1", "localhost"):
+        for params in project_windows(wave_server, window_start, 6, seconds=10):
+            all_params.append(dict(params, host=host))
+    try:
+        stats = FetchScheduler(max_per_host=2).run(all_params, job)
+    finally:
+        pool.close_all()
+    assert stats.windows_ok == 12 and stats.windows_failed == 0
+    assert peak == {"127.0.0.1": 2, "localhost": 2}
+    assert stats.bytes == 12 * 3 * 1001 * 4
+
+
+def test_scheduler_reports_failed_jobs():
+    errors = []
+
+    def job(params):
+        if params["station_num"] == 2:
+            raise ConnectionError("refused")
+        return 10
+
+    all_params = [{"host": "h", "port": 1, "station_num": n} for n in (1, 2, 3)]
+    stats = FetchScheduler().run(all_params, job, on_error=lambda params, e: errors.append(params["station_num"]))
+    assert (stats.windows_ok, stats.windows_failed, stats.bytes) == (2, 1, 20)
+    assert errors == [2]
+
+
+def test_scheduler_rejects_zero_workers():
+    with pytest.raises(ValueError):
+        FetchScheduler(max_per_host=0)
+
+
+def test_project_fetch_skips_complete_windows(wave_server, window_start, tmp_path):
+    project_path = str(tmp_path / "Survey")
+    all_params = project_windows(wave_server, window_start, 3)
+    stats, manifest = run_project_fetch("Survey", project_path, all_params, lambda text: None, max_per_host=2)
+    assert stats.windows_ok == 3
+    assert manifest.summary() == {STATUS_COMPLETE: 3}
+    for params in all_params:
+        assert os.path.exists(os.path.join(project_path, window_filename("Survey", params)))
+
+    log = []
+    stats, _ = run_project_fetch("Survey", project_path, all_params, log.append)
+    assert stats.windows_ok == 0
+    assert "Skipping 3 windows" in "".join(log)
+
+
+def test_project_fetch_resumes_from_manifest(wave_server, window_start, tmp_path):
+    project_path = str(tmp_path / "Survey")
+    all_params = project_windows(wave_server, window_start, 3)
+    run_project_fetch("Survey", project_path, all_params, lambda text: None)
+    os.remove(os.path.join(project_path, window_filename("Survey", all_params[1])))
+
+    # A resume after a restart rebuilds the windows from the manifest alone.
+    resumed = ProjectManifest(project_path, "Survey").all_params()
+    assert [params["station_num"] for params in resumed] == [1, 2, 3]
+    assert resumed[1]["start_time"] == all_params[1]["start_time"]
+    stats, manifest = run_project_fetch("Survey", project_path, resumed, lambda text: None)
+    assert stats.windows_ok == 1
+    assert manifest.summary() == {STATUS_COMPLETE: 3}
+
+
+def test_project_fetch_refills_partial_window_on_rerun(wave_server, window_start, tmp_path):
+    project_path = str(tmp_path / "Survey")
+    all_params = project_windows(wave_server, window_start, 2)
+    outage_start = float(window_start) + 20
+    wave_server.outages = [(outage_start, outage_start + 10)]
+    stats, manifest = run_project_fetch("Survey", project_path, all_params, lambda text: None,
+                                        refiller=GapRefiller(max_attempts=0))
+    assert stats.windows_ok == 2
+    first = manifest.windows[window_filename("Survey", all_params[0])]
+    assert first["status"] == STATUS_PARTIAL
+    assert first["completeness"] == pytest.approx(100 * 50 / 60, abs=0.5)
+    assert manifest.windows[window_filename("Survey", all_params[1])]["status"] == STATUS_COMPLETE
+
+    # The Shake has the data again; only the partial window's gap is fetched.
+    wave_server.outages = []
+    requests_before = wave_server.stats["requests"]
+    log = []
+    stats, manifest = run_project_fetch("Survey", project_path, all_params, log.append,
+                                        refiller=GapRefiller(backoff=0))
+    assert stats.windows_ok == 1
+    assert "refilling the gaps of the partial file" in "".join(log)
+    # One MENU listing the station's channels, then one request per channel for its gap.
+    assert wave_server.stats["requests"] - requests_before == 4
+    first = manifest.windows[window_filename("Survey", all_params[0])]
+    assert (first["status"], first["completeness"]) == (STATUS_COMPLETE, 100.0)
+
+
+def test_project_fetch_refills_through_the_cache(wave_server, window_start, tmp_path):
+    cache = WaveformCache(str(tmp_path / "cache"))
+    all_params = project_windows(wave_server, window_start, 1)
+    params = all_params[0]
+    wave_server.outages = [(float(window_start) + 20, float(window_start) + 30)]
+    run_project_fetch("Survey", str(tmp_path / "Survey"), all_params, lambda text: None, cache=cache,
+                      refiller=GapRefiller(max_attempts=0))
+    assert cache.missing_intervals(cache.key(params, "EHZ"), params["start_time"], params["end_time"])
+
+    wave_server.outages = []
+    _, manifest = run_project_fetch("Survey", str(tmp_path / "Survey"), all_params, lambda text: None, cache=cache,
+                                    refiller=GapRefiller(backoff=0))
+    assert manifest.windows[window_filename("Survey", params)]["status"] == STATUS_COMPLETE
+    # The refilled stretch was stored, so the next run finds the whole window cached.
+    for channel in ("EHZ", "EHN", "EHE"):
+        assert cache.missing_intervals(cache.key(params, channel), params["start_time"], params["end_time"]) == []
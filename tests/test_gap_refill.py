@@ -0,0 +1,94 @@
+import pytest
+from data_acquisition import ConnectionPool, fetch_waveforms
+from gap_refill import CoverageReport, GapRefiller
+from synthetic_wave_server import SyntheticSignal
+
+
+def window(server, start, seconds=60):
+    return dict(server.params, start_time=start, end_time=start + seconds)
+
+
+def test_check_finds_gaps_and_overlaps(window_start):
+    signal = SyntheticSignal()
+    start, end = window_start, window_start + 60
+    stream = signal.stream("AM", "R0000", "00", ["EHZ"], start, start + 20)
+    stream += signal.stream("AM", "R0000", "00", ["EHZ"], start + 30, end)
+    # A packet sent twice overlaps what is already there.
+    stream += signal.stream("AM", "R0000", "00", ["EHZ"], start + 40, start + 45)
+    report = CoverageReport.check(stream, "EHZ", start, end)
+    assert len(report.missing) == 1
+    channel, gap_start, gap_end = report.missing[0]
+    assert channel == "EHZ"
+    assert gap_start == pytest.approx(float(start) + 20.01)
+    assert gap_end == pytest.approx(float(start) + 30)
+    assert report.overlaps == 1
+    assert report.percent == pytest.approx(100 * 50.01 / 60, abs=0.1)
+
+
+def test_check_counts_expected_channels_the_stream_lacks(window_start):
+    signal = SyntheticSignal()
+    start, end = window_start, window_start + 60
+    stream = signal.stream("AM", "R0000", "00", ["EHZ", "EHN"], start, end)
+    assert CoverageReport.check(stream, "EH?", start, end).complete
+    report = CoverageReport.check(stream, "EH?", start, end, channels=["EHE", "EHN", "EHZ"])
+    assert report.missing == [("EHE", float(start), float(end))]
+    assert report.percent == pytest.approx(100 * 2 / 3, abs=0.1)
+
+
+def test_refill_fetches_a_gap(wave_server, window_start):
+    params = window(wave_server, window_start)
+    wave_server.outages = [(float(window_start) + 20, float(window_start) + 30)]
+    stream = fetch_waveforms(params, pool=ConnectionPool())
+    wave_server.outages = []
+    stream, report = GapRefiller(backoff=0).refill(params, stream, lambda p: fetch_waveforms(p, pool=ConnectionPool()))
+    assert report.complete and report.attempts == 1
+    assert sorted(trace.stats.channel for trace in stream) == ["EHE", "EHN", "EHZ"]
+    assert all(trace.stats.npts == 6001 for trace in stream)
+
+
+def test_refill_fetches_a_channel_missing_from_the_whole_window(wave_server, window_start):
+    pool = ConnectionPool()
+    params = window(wave_server, window_start)
+    wave_server.outages = [(float(window_start) - 60, float(window_start) + 120, "EHE")]
+    stream = fetch_waveforms(params, pool=pool)
+    assert sorted(trace.stats.channel for trace in stream) == ["EHN", "EHZ"]
+
+    refiller = GapRefiller(max_attempts=0)
+    _, report = refiller.refill(params, stream.copy(), lambda p: fetch_waveforms(p, pool=pool))
+    assert report.missing == [("EHE", float(params["start_time"]), float(params["end_time"]))]
+    assert report.percent == pytest.approx(100 * 2 / 3, abs=0.1)
+    assert not report.complete
+
+    wave_server.outages = []
+    stream, report = GapRefiller(backoff=0).refill(params, stream, lambda p: fetch_waveforms(p, pool=pool))
+    assert report.complete
+    assert sorted(trace.stats.channel for trace in stream) == ["EHE", "EHN", "EHZ"]
+
+
+def test_expected_channels_fall_back_to_earlier_windows(wave_server, window_start):
+    def unlisted(params):
+        raise ConnectionError("MENU not supported")
+    refiller = GapRefiller(max_attempts=0, list_channels=unlisted)
+    pool = ConnectionPool()
+    first = window(wave_server, window_start)
+    _, report = refiller.refill(first, fetch_waveforms(first, pool=pool), fetch_waveforms)
+    assert report.complete
+
+    wave_server.outages = [(float(window_start), float(window_start) + 240, "EHN")]
+    second = window(wave_server, window_start + 60)
+    _, report = refiller.refill(second, fetch_waveforms(second, pool=pool), fetch_waveforms)
+    assert [channel for channel, _, _ in report.missing] == ["EHN"]
+
+
+def test_expected_channels_list_the_server_once(wave_server, window_start):
+    calls = []
+
+    def list_channels(params):
+        calls.append(params["cha"])
+        return ["EHE", "EHN", "EHZ"]
+    refiller = GapRefiller(list_channels=list_channels)
+    params = window(wave_server, window_start)
+    assert refiller.expected_channels(params, []) == ["EHE", "EHN", "EHZ"]
+    assert refiller.expected_channels(dict(params, start_time=window_start + 60), []) == ["EHE", "EHN", "EHZ"]
+    assert refiller.expected_channels(dict(params, cha="EHZ"), []) == ["EHZ"]
+    assert calls == ["EH?"]
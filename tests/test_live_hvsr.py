@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from live_hvsr import LiveHvsrMonitor, RunningHvsrStatistics, SampleRingBuffer
+from mhvsr_logic import get_default_preprocessing_settings, get_default_processing_settings, process_mhvsr
+
+WINDOW_SECONDS = 30
+WINDOW_SAMPLES = WINDOW_SECONDS * 100
+
+
+def monitor_for(server, start, buffer_windows=3):
+    monitor = LiveHvsrMonitor(server.params, get_default_preprocessing_settings(WINDOW_SECONDS),
+                              get_default_processing_settings(), latency=0, buffer_windows=buffer_windows)
+    monitor.cursor = start
+    return monitor
+
+
+def test_ring_buffer_wraps_around():
+    buffer = SampleRingBuffer(10, ncomponents=1)
+    buffer.write(0, 0, np.arange(8))
+    buffer.write(0, 8, np.arange(8, 15))
+    assert (buffer.oldest(), buffer.available()) == (5, 15)
+    np.testing.assert_array_equal(buffer.read(5, 10)[0], np.arange(5, 15))
+    with pytest.raises(IndexError):
+        buffer.read(4, 2)
+    with pytest.raises(IndexError):
+        buffer.read(10, 6)
+    # Samples already overwritten are not written back.
+    buffer.write(0, 0, np.full(3, -1.0))
+    np.testing.assert_array_equal(buffer.read(5, 10)[0], np.arange(5, 15))
+
+
+def test_ring_buffer_fills_gaps_with_nan():
+    buffer = SampleRingBuffer(20, ncomponents=2)
+    buffer.write(0, 0, np.arange(5))
+    buffer.write(0, 8, np.arange(8, 10))
+    buffer.write(1, 0, np.arange(10))
+    samples = buffer.read(0, 10)
+    assert np.isnan(samples[0, 5:8]).all()
+    np.testing.assert_array_equal(samples[0, 8:], [8, 9])
+    np.testing.assert_array_equal(samples[1], np.arange(10))
+
+    buffer.extend_to(12)
+    assert buffer.available() == 12
+    assert np.isnan(buffer.read(10, 2)).all()
+    # Data arriving late for a stretch already marked missing still lands.
+    buffer.write(1, 10, [10.0, 11.0])
+    np.testing.assert_array_equal(buffer.read(10, 2)[1], [10, 11])
+
+
+def test_running_statistics_match_lognormal_statistics():
+    rng = np.random.default_rng(0)
+    frequency = np.geomspace(0.5, 20, 50)
+    curves = np.exp(rng.normal(size=(6, len(frequency))))
+    statistics = RunningHvsrStatistics(frequency)
+    for curve in curves:
+        statistics.update(curve)
+    np.testing.assert_allclose(statistics.mean_curve(), np.exp(np.log(curves).mean(axis=0)))
+    np.testing.assert_allclose(statistics.std_curve(), np.log(curves).std(axis=0, ddof=1))
+    peaks = np.log(frequency[np.argmax(curves, axis=1)])
+    assert statistics.fn_mean() == pytest.approx(np.exp(peaks.mean()))
+    assert statistics.fn_std() == pytest.approx(peaks.std(ddof=1))
+
+
+def test_live_windows_match_process_mhvsr(wave_server, window_start, tmp_path):
+    windows = 4
+    monitor = monitor_for(wave_server, window_start)
+    # Two polls, so a window is completed by data from both.
+    assert monitor.poll(now=window_start + 1.5 * WINDOW_SECONDS) == 1
+    assert monitor.poll(now=window_start + windows * WINDOW_SECONDS) == windows - 1
+    assert monitor.dropped_windows == 0 and monitor.statistics.rejected == 0
+
+    path = str(tmp_path / "record.mseed")
+    wave_server.signal.stream("AM", "R0000", "00", ["EHZ", "EHN", "EHE"], window_start,
+                              window_start + windows * WINDOW_SECONDS).write(path, format="MSEED")
+    hvsr = process_mhvsr([path], get_default_preprocessing_settings(WINDOW_SECONDS), get_default_processing_settings())
+    assert hvsr.n_curves == windows
+    statistics = monitor.statistics
+    np.testing.assert_allclose(statistics.mean_curve(), hvsr.mean_curve(distribution="lognormal"), rtol=1e-10)
+    np.testing.assert_allclose(statistics.std_curve(), hvsr.std_curve(distribution="lognormal"), rtol=1e-10)
+    assert statistics.fn_mean() == pytest.approx(hvsr.mean_fn_frequency(distribution="lognormal"))
+    assert statistics.fn_std() == pytest.approx(hvsr.std_fn_frequency(distribution="lognormal"))
+
+
+def test_live_rejects_windows_with_gaps(wave_server, window_start):
+    gap_start = float(window_start) + 1.2 * WINDOW_SECONDS
+    wave_server.outages = [(gap_start, gap_start + 5, "EHN")]
+    monitor = monitor_for(wave_server, window_start)
+    assert monitor.poll(now=window_start + 3 * WINDOW_SECONDS) == 2
+    assert monitor.statistics.rejected == 1
+    assert monitor.statistics.snapshot()["windows"] == 2
+
+
+def test_live_drops_windows_it_fell_behind_on(wave_server, window_start):
+    monitor = monitor_for(wave_server, window_start, buffer_windows=2)
+    assert monitor.poll(now=window_start + 5 * WINDOW_SECONDS) == 2
+    assert monitor.dropped_windows == 3
+    assert monitor.next_window == 5 * WINDOW_SAMPLES
@@ -0,0 +1,66 @@
+import os
+import hvsrpy
+import numpy as np
+import pytest
+from obspy import UTCDateTime
+import mhvsr_logic
+import project_store
+from project_store import ProjectStore, open_store_for
+from synthetic_wave_server import SyntheticSignal, write_synthetic_project
+
+START = UTCDateTime(2024, 3, 1)
+
+
+def test_store_reads_records_like_hvsrpy(tmp_path):
+    files = write_synthetic_project(str(tmp_path), "Survey", 2, 300, start_time=START)
+    store = ProjectStore(str(tmp_path))
+    assert store.add_project(files) == 2
+    paths = [file_paths[0] for file_paths in files.values()]
+    assert open_store_for(paths) is not None
+
+    for stored, decoded in zip(store.read(paths), hvsrpy.read(paths)):
+        for component in ("ns", "ew", "vt"):
+            assert getattr(stored, component).dt_in_seconds == getattr(decoded, component).dt_in_seconds
+            np.testing.assert_array_equal(getattr(stored, component).amplitude, getattr(decoded, component).amplitude)
+    # Unchanged files are not imported again.
+    assert store.add_project(files) == 0
+
+
+def test_gapped_file_is_read_from_miniseed(tmp_path, monkeypatch):
+    # A partial window: EHN lost ten seconds in the middle.
+    signal = SyntheticSignal()
+    stream = signal.stream("AM", "R0000", "00", ["EHZ", "EHE"], START, START + 300)
+    stream += signal.stream("AM", "R0000", "00", ["EHN"], START, START + 100)
+    stream += signal.stream("AM", "R0000", "00", ["EHN"], START + 110, START + 300)
+    path = str(tmp_path / "Survey_1_partial.mseed")
+    stream.write(path, format="MSEED")
+    store = ProjectStore(str(tmp_path))
+    store.add_file(path, 1)
+    with pytest.raises(ValueError, match="gap in channel EHN"):
+        store.traces(path)
+
+    read_from = []
+    monkeypatch.setattr(mhvsr_logic.hvsrpy, "read", lambda file_paths: read_from.append(file_paths) or ["record"])
+    assert mhvsr_logic.read_records([path], store) == ["record"]
+    assert read_from == [[path]]
+
+
+def test_changed_file_leaves_no_stale_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(project_store, "CHUNK_SAMPLES", 10000)
+    signal = SyntheticSignal()
+    path = str(tmp_path / "Survey_1.mseed")
+    signal.stream("AM", "R0000", "00", ["EHZ", "EHN", "EHE"], START, START + 300).write(path, format="MSEED")
+    store = ProjectStore(str(tmp_path))
+    store.add_file(path, 1)
+    assert len(os.listdir(store.path)) == 3 * 4 + 1
+
+    # Refilled with fewer channels and a shorter span, as a rewritten partial window can be.
+    signal.stream("AM", "R0000", "00", ["EHZ"], START, START + 60).write(path, format="MSEED")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert not store.contains(path)
+    assert store.add_file(path, 1)
+    chunk_files = sorted(name for name in os.listdir(store.path) if name.endswith(".npy"))
+    assert chunk_files == sorted(segment["file"] for segment in store.sources["Survey_1.mseed"]["segments"])
+    assert len(chunk_files) == 1
+    assert store.traces(path)["EHZ"][2].shape == (6001,)
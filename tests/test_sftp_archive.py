@@ -0,0 +1,147 @@
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from obspy import UTCDateTime
+from sftp_archive import ArchiveFetcher, archive_days
+from synthetic_wave_server import SyntheticSignal
+from task_executor import TaskExecutor
+
+CHANNELS = ("EHZ", "EHN", "EHE")
+MIDNIGHT = UTCDateTime(2024, 3, 1)
+
+
+class DirectorySFTP:
+    """
+    A stand-in for paramiko's SFTPClient serving the local file system, remote paths being
+    local paths. Counts transfers in flight on the shared state.
+    """
+    def __init__(self, state, get_delay=0.0):
+        self.state = state
+        self.get_delay = get_delay
+        self.closed = False
+
+    def listdir_attr(self, path):
+        return [SimpleNamespace(filename=name, st_mode=os.stat(os.path.join(path, name)).st_mode)
+                for name in os.listdir(path)]
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def get(self, remotepath, localpath):
+        with self.state["lock"]:
+            self.state["active"] += 1
+            self.state["peak"] = max(self.state["peak"], self.state["active"])
+        try:
+            time.sleep(self.get_delay)
+            shutil.copyfile(remotepath, localpath)
+        finally:
+            with self.state["lock"]:
+                self.state["active"] -= 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """An SDS archive with two hours of 10 Hz data either side of MIDNIGHT, plus a later day."""
+    root = tmp_path / "archive"
+    signal = SyntheticSignal(sampling_rate=10.0)
+    for start, end in ((MIDNIGHT - 7200, MIDNIGHT - 0.1), (MIDNIGHT, MIDNIGHT + 7200),
+                       (MIDNIGHT + 86400, MIDNIGHT + 90000)):
+        for channel in CHANNELS:
+            stream = signal.stream("AM", "R0000", "00", [channel], start, end)
+            directory = root / str(start.year) / "AM" / "R0000" / f"{channel}.D"
+            directory.mkdir(parents=True, exist_ok=True)
+            stream.write(str(directory / f"AM.R0000.00.{channel}.D.{start.year}.{start.julday:03d}"), format="MSEED")
+    return str(root)
+
+
+def make_fetcher(archive, tmp_path, get_delay=0.0, max_transfers=4):
+    state = {"lock": threading.Lock(), "active": 0, "peak": 0, "opened": []}
+
+    def open_sftp():
+        sftp = DirectorySFTP(state, get_delay)
+        state["opened"].append(sftp)
+        return sftp
+    fetcher = ArchiveFetcher(open_sftp, archive_root=archive, mirror_dir=str(tmp_path / "mirror"),
+                             max_transfers=max_transfers)
+    return fetcher, state
+
+
+def window(start, end, cha="EH?"):
+    return {"net": "AM", "sta": "R0000", "loc": "00", "cha": cha, "start_time": start, "end_time": end}
+
+
+def test_archive_days_cross_midnight():
+    assert archive_days(MIDNIGHT - 1800, MIDNIGHT + 1800) == [(2024, 60), (2024, 61)]
+    assert archive_days(MIDNIGHT + 10, MIDNIGHT + 20) == [(2024, 61)]
+
+
+def test_lists_day_files_of_a_window_across_midnight(archive, tmp_path):
+    fetcher, _ = make_fetcher(archive, tmp_path)
+    files = fetcher.list_day_files(window(MIDNIGHT - 1800, MIDNIGHT + 1800))
+    names = sorted(os.path.basename(path) for path, _ in files)
+    assert names == sorted(f"AM.R0000.00.{channel}.D.2024.{day}" for channel in CHANNELS for day in ("060", "061"))
+    assert all(size > 0 for _, size in files)
+    assert len(fetcher.list_day_files(window(MIDNIGHT - 1800, MIDNIGHT + 1800, cha="EHZ"))) == 2
+
+
+def test_fetch_trims_and_merges_across_midnight(archive, tmp_path):
+    fetcher, _ = make_fetcher(archive, tmp_path)
+    stream = fetcher.fetch(window(MIDNIGHT - 1800, MIDNIGHT + 1800))
+    assert sorted(trace.stats.channel for trace in stream) == sorted(CHANNELS)
+    for trace in stream:
+        assert trace.stats.starttime == MIDNIGHT - 1800
+        assert trace.stats.endtime == MIDNIGHT + 1800
+        assert trace.stats.npts == 36001
+
+
+def test_transfers_in_parallel_and_reuses_the_mirror(archive, tmp_path):
+    fetcher, state = make_fetcher(archive, tmp_path, get_delay=0.05, max_transfers=3)
+    params = window(MIDNIGHT - 1800, MIDNIGHT + 1800)
+    assert len(fetcher.transfer(params)) == 6
+    assert state["peak"] == 3
+    assert fetcher.stats["files_transferred"] == 6
+    assert all(sftp.closed for sftp in state["opened"])
+
+    assert len(fetcher.transfer(params)) == 6
+    assert fetcher.stats["files_transferred"] == 6
+    assert fetcher.stats["files_reused"] == 6
+
+
+def test_failed_transfer_leaves_no_partial_file(archive, tmp_path):
+    fetcher, state = make_fetcher(archive, tmp_path)
+
+    def broken_get(remotepath, localpath):
+        with open(localpath, "wb") as f:
+            f.write(b"half a day file")
+        raise OSError("connection lost")
+    fetcher.open_sftp = lambda: SimpleNamespace(get=broken_get, close=lambda: None)
+    files = fetcher.list_day_files(window(MIDNIGHT + 10, MIDNIGHT + 20, cha="EHZ"), sftp=DirectorySFTP(state))
+    with pytest.raises(OSError):
+        fetcher._transfer(files)
+    assert not any(name.endswith(".part") for _, _, names in os.walk(tmp_path / "mirror") for name in names)
+
+
+def test_cancelled_transfer_leaves_no_partial_file(archive, tmp_path):
+    fetcher, _ = make_fetcher(archive, tmp_path)
+    started, release = threading.Event(), threading.Event()
+
+    def hung_get(remotepath, localpath):
+        with open(localpath, "wb") as f:
+            f.write(b"half a day file")
+        started.set()
+        release.wait(5)
+    fetcher.open_sftp = lambda: SimpleNamespace(get=hung_get, close=release.set, listdir_attr=None)
+    files = [(os.path.join(archive, "2024", "AM", "R0000", "EHZ.D", "AM.R0000.00.EHZ.D.2024.061"), 1)]
+
+    executor = TaskExecutor()
+    task = executor.submit(fetcher._transfer, files)
+    assert started.wait(5)
+    task.cancel()
+    assert task.wait(5) and task.state == "cancelled"
+    assert not any(name.endswith(".part") for _, _, names in os.walk(tmp_path / "mirror") for name in names)
@@ -0,0 +1,33 @@
+import pytest
+from fetch_scheduler import run_project_fetch
+from station_schedule import StationSchedule
+
+
+def test_validate_reports_inverted_duplicate_and_overlapping_windows():
+    schedule = StationSchedule([0, 0, 50, 300], [100, 100, 150, 200])
+    report = schedule.validate({"host": "rs.local"})
+    assert report.inverted == [3]
+    assert report.duplicates == [(1, 0)]
+    assert report.overlaps == [(2, 1)]
+    assert not report.ok
+
+
+def test_validate_rejects_repeated_station_numbers():
+    schedule = StationSchedule([0, 100, 200, 300], [100, 200, 300, 400], station_nums=[1, 2, 1, 1])
+    report = schedule.validate()
+    assert report.repeated == [(2, 0), (3, 0)]
+    assert not report.ok
+    assert "Station 1: station number used again in row 3 (first in row 1)" in report.lines()
+
+
+def test_validate_accepts_distinct_station_numbers():
+    report = StationSchedule([0, 100], [100, 200], station_nums=[3, 7]).validate()
+    assert report.ok and not report
+
+
+def test_project_fetch_rejects_windows_writing_the_same_file(tmp_path):
+    schedule = StationSchedule([0, 0], [60, 60], station_nums=[1, 1])
+    all_params = schedule.all_params({"host": "rs.local", "port": 16032, "net": "AM", "sta": "R0000",
+                                      "loc": "00", "cha": "EH?"})
+    with pytest.raises(ValueError, match="repeat a station number"):
+        run_project_fetch("Survey", str(tmp_path / "Survey"), all_params, lambda text: None)
@@ -0,0 +1,171 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from task_executor import (CANCELLED, DONE, FAILED, PRIORITY_BATCH, QUEUED, RUNNING, TaskCancelled, TaskExecutor,
+                           current_task, held, raise_if_cancelled, run_in_task, sleep)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.01)
+
+
+def test_max_workers_must_leave_a_thread_for_interactive_tasks():
+    with pytest.raises(ValueError):
+        TaskExecutor(max_workers=1)
+    with pytest.raises(ValueError):
+        TaskExecutor().submit(lambda: None, priority=7)
+
+
+def test_events_follow_a_task_to_done_or_failed():
+    events = []
+    executor = TaskExecutor(on_event=events.append)
+    done = executor.submit(lambda: None, name="ok")
+    assert done.wait(5) and done.state == DONE
+
+    def broken():
+        raise RuntimeError("no data")
+    failed = executor.submit(broken)
+    assert failed.wait(5) and failed.state == FAILED
+    assert str(failed.error) == "no data"
+    assert [event.state for event in events if event.task_id == done.id] == [QUEUED, RUNNING, DONE]
+    assert [event.message for event in events if event.task_id == failed.id][-1] == "no data"
+
+
+def test_batch_tasks_leave_a_thread_for_interactive_tasks():
+    executor = TaskExecutor(max_workers=3)
+    release = threading.Event()
+    batch = [executor.submit(release.wait, 5, priority=PRIORITY_BATCH) for _ in range(3)]
+    wait_until(lambda: sum(task.state == RUNNING for task in batch) == 2)
+    time.sleep(0.05)
+    assert [task.state for task in batch] == [RUNNING, RUNNING, QUEUED]
+
+    interactive = executor.submit(lambda: None)
+    assert interactive.wait(5) and interactive.state == DONE
+    assert batch[2].state == QUEUED
+    release.set()
+    assert all(task.wait(5) for task in batch)
+    assert [task.state for task in batch] == [DONE] * 3
+
+
+def test_cancel_queued_task_never_runs():
+    executor = TaskExecutor(max_workers=2)
+    release = threading.Event()
+    ran = []
+    running = executor.submit(release.wait, 5, priority=PRIORITY_BATCH)
+    queued = executor.submit(ran.append, 1, priority=PRIORITY_BATCH)
+    wait_until(lambda: running.state == RUNNING)
+    assert queued.cancel()
+    assert queued.wait(0) and queued.state == CANCELLED
+    assert queued not in executor.tasks()
+    release.set()
+    assert running.wait(5) and running.state == DONE
+    assert ran == []
+    assert not queued.cancel()
+
+
+def test_cancel_running_task_wakes_its_sleep():
+    executor = TaskExecutor()
+    started = threading.Event()
+
+    def long_task():
+        started.set()
+        sleep(30)
+    task = executor.submit(long_task)
+    assert started.wait(5)
+    cancelled_at = time.monotonic()
+    assert task.cancel("user cancelled")
+    assert task.wait(5) and task.state == CANCELLED
+    assert time.monotonic() - cancelled_at < 1
+    assert task.cancel_reason == "user cancelled"
+    assert not task.cancel()
+
+
+def test_timeout_cancels_task():
+    executor = TaskExecutor()
+    task = executor.submit(sleep, 30, timeout=0.1)
+    assert task.wait(5) and task.state == CANCELLED
+    assert task.cancel_reason == "timed out after 0.1 s"
+    assert task.elapsed < 5
+
+
+def test_cancel_runs_release_callbacks_at_once():
+    executor = TaskExecutor()
+    unblocked = threading.Event()
+    released = []
+
+    def blocked_read():
+        # Stands in for a socket read that only returns once the socket is shut down.
+        with held(lambda: (released.append("socket"), unblocked.set())):
+            unblocked.wait(30)
+        raise_if_cancelled()
+    task = executor.submit(blocked_read)
+    wait_until(lambda: task._holds)
+    task.cancel()
+    assert task.wait(5) and task.state == CANCELLED
+    assert released == ["socket"]
+
+
+def test_hold_after_cancel_releases_and_raises():
+    executor = TaskExecutor()
+    release = threading.Event()
+    released = []
+    task = executor.submit(release.wait, 5)
+    wait_until(lambda: task.state == RUNNING)
+    task.cancel()
+    with pytest.raises(TaskCancelled):
+        task.hold(lambda: released.append(True))
+    assert released == [True]
+    release.set()
+    assert task.wait(5) and task.state == CANCELLED
+
+
+def test_held_outside_a_task_does_nothing():
+    with held(lambda: pytest.fail("released outside a task")):
+        raise_if_cancelled()
+    assert current_task() is None
+
+
+def test_run_in_task_carries_the_task_into_pool_threads():
+    executor = TaskExecutor()
+    seen, released = [], []
+    started = threading.Barrier(3, timeout=5)
+
+    def worker():
+        seen.append(current_task())
+        with held(lambda: released.append(threading.current_thread().name)):
+            started.wait()
+            sleep(30)
+
+    def fan_out():
+        task = current_task()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(run_in_task, task, worker) for _ in range(2)]
+            started.wait()
+            for future in futures:
+                future.result()
+    task = executor.submit(fan_out)
+    wait_until(lambda: len(seen) == 2)
+    wait_until(lambda: len(task._holds) == 2)
+    task.cancel()
+    assert task.wait(5) and task.state == CANCELLED
+    assert seen == [task, task]
+    assert len(released) == 2
+    assert current_task() is None
+
+
+def test_run_in_task_does_not_start_cancelled_work():
+    executor = TaskExecutor()
+    release = threading.Event()
+    task = executor.submit(release.wait, 5)
+    wait_until(lambda: task.state == RUNNING)
+    task.cancel()
+    ran = []
+    with pytest.raises(TaskCancelled):
+        run_in_task(task, ran.append, 1)
+    assert ran == [] and current_task() is None
+    release.set()
@@ -0,0 +1,132 @@
+import threading
+import time
+import pytest
+
+paramiko = pytest.importorskip("paramiko")
+from time_sync import ShakeCommunicator  # noqa: E402
+
+
+class FakeChannel:
+    def __init__(self, client):
+        self.client = client
+
+    def shutdown_write(self):
+        pass
+
+    def close(self):
+        pass
+
+    def recv_exit_status(self):
+        return 0
+
+
+class FakeFile:
+    def __init__(self, client, data=b""):
+        self.channel = FakeChannel(client)
+        self.data = data
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def read(self):
+        return self.data
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class FakeClient:
+    """Stands in for paramiko's SSHClient; run(command) gives a command's output or raises."""
+    def __init__(self, run):
+        self.transport = FakeTransport()
+        self.run = run
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.active = False
+
+    def exec_command(self, command, timeout=None):
+        if not self.transport.active:
+            raise paramiko.SSHException("SSH session not active")
+        output = self.run(command)
+        return FakeFile(self), FakeFile(self, output), FakeFile(self)
+
+
+def communicator_with(clients):
+    """A ShakeCommunicator whose connect() hands out the given clients in turn."""
+    shake = ShakeCommunicator("rs.local", "myshake", "secret")
+    handed_out = iter(clients)
+
+    def connect():
+        shake.client = next(handed_out)
+        return "Connection successful."
+    shake.connect = connect
+    shake.connect()
+    return shake
+
+
+def test_concurrent_failures_reconnect_once():
+    # Every command on the first session fails together, as when the link drops.
+    barrier = threading.Barrier(4)
+
+    def dropped(command):
+        barrier.wait(timeout=5)
+        raise paramiko.SSHException("connection reset")
+
+    shake = communicator_with([FakeClient(dropped), FakeClient(lambda command: command.encode())])
+    results = shake.run_commands([f"echo {n}" for n in range(4)], max_concurrent=4)
+    assert [result.stdout for result in results] == [f"echo {n}" for n in range(4)]
+    assert shake.reconnects == 1
+
+
+def test_command_that_must_not_repeat_is_not_retried():
+    shake = communicator_with([FakeClient(lambda command: (_ for _ in ()).throw(EOFError()))])
+    with pytest.raises(EOFError):
+        shake.run_command("sudo date", retry=False)
+    assert shake.reconnects == 0
+
+
+class FakeClockReader:
+    """The ends of a CLOCK_READER channel on a Shake whose clock runs offset seconds ahead."""
+    def __init__(self, offset, link_delay):
+        self.channel = FakeChannel(None)
+        self.offset = offset
+        self.link_delay = link_delay
+        self.lines = []
+
+    def write(self, data):
+        time.sleep(self.link_delay)
+        self.lines.append(f"{time.time() + self.offset:.6f}\n")
+        time.sleep(self.link_delay)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else ""
+
+
+def test_offset_excludes_channel_set_up_from_the_round_trip():
+    reader = FakeClockReader(offset=0.25, link_delay=0.01)
+
+    class SlowSetUpClient(FakeClient):
+        def exec_command(self, command, timeout=None):
+            # Opening the channel and starting the reader takes far longer than a round trip.
+            time.sleep(0.2)
+            return reader, reader, FakeFile(self)
+
+    shake = communicator_with([SlowSetUpClient(None)])
+    offset = shake.measure_offset(samples=3)
+    assert len(offset.samples) == 3
+    assert offset.rtt == pytest.approx(0.02, abs=0.01)
+    assert offset.offset == pytest.approx(0.25, abs=0.005)
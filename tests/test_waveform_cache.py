@@ -0,0 +1,90 @@
+import json
+import numpy as np
+from data_acquisition import ConnectionPool, fetch_waveforms
+from synthetic_wave_server import SyntheticSignal, SyntheticWaveServer
+from waveform_cache import WaveformCache, subtract_intervals
+
+
+def test_subtract_intervals():
+    assert subtract_intervals(0, 10, [(2, 4), (3, 5), (8, 12)]) == [(0, 2), (5, 8)]
+    assert subtract_intervals(0, 10, [(0.5, 10)], min_gap=1.0) == []
+
+
+def test_cache_fetches_only_uncovered_parts(wave_server, window_start, tmp_path):
+    cache = WaveformCache(str(tmp_path))
+    pool = ConnectionPool()
+    params = dict(wave_server.params, start_time=window_start, end_time=window_start + 60)
+    fetch_waveforms(params, pool=pool, cache=cache)
+    stream = fetch_waveforms(dict(params, end_time=window_start + 120), pool=pool, cache=cache)
+    pool.close_all()
+    assert cache.get_stats()["partial_hits"] == 1
+    assert [trace.stats.npts for trace in stream] == [12001] * 3
+
+
+def test_cache_keeps_wave_servers_apart(window_start, tmp_path):
+    # Same NSLC on two servers with different signals.
+    cache = WaveformCache(str(tmp_path))
+    pool = ConnectionPool()
+    with SyntheticWaveServer(signal=SyntheticSignal(seed=1)) as first, \
+            SyntheticWaveServer(signal=SyntheticSignal(seed=2)) as second:
+        streams = []
+        for server in (first, second):
+            params = dict(server.params, cha="EHZ", start_time=window_start, end_time=window_start + 30)
+            streams.append(fetch_waveforms(params, pool=pool, cache=cache))
+    pool.close_all()
+    assert cache.get_stats()["misses"] == 2
+    expected = SyntheticSignal(seed=2).samples("EHZ", int(window_start.timestamp * 100),
+                                              int(window_start.timestamp * 100) + 3001)
+    np.testing.assert_array_equal(streams[1][0].data, expected)
+    assert not np.array_equal(streams[0][0].data, streams[1][0].data)
+
+
+def test_cache_refetches_gaps_and_missing_channels(wave_server, window_start, tmp_path):
+    cache = WaveformCache(str(tmp_path))
+    pool = ConnectionPool()
+    params = dict(wave_server.params, start_time=window_start, end_time=window_start + 60)
+    wave_server.outages = [(float(window_start) + 20, float(window_start) + 40, "EHN"),
+                           (float(window_start) - 60, float(window_start) + 120, "EHE")]
+    stream = fetch_waveforms(params, pool=pool, cache=cache)
+    assert sorted(trace.stats.channel for trace in stream) == ["EHN", "EHN", "EHZ"]
+    assert cache.missing_intervals(cache.key(params, "EHN"), window_start, window_start + 60) == \
+        [(float(window_start) + 20, float(window_start) + 40)]
+
+    # The Shake has the data again; only the holes are fetched.
+    wave_server.outages = []
+    requests_before = wave_server.stats["requests"]
+    stream = fetch_waveforms(params, pool=pool, cache=cache)
+    pool.close_all()
+    assert wave_server.stats["requests"] - requests_before == 2
+    assert (cache.get_stats()["hits"], cache.get_stats()["partial_hits"]) == (0, 1)
+    assert sorted((trace.stats.channel, trace.stats.npts) for trace in stream) == \
+        [("EHE", 6001), ("EHN", 6001), ("EHZ", 6001)]
+    assert fetch_waveforms(params, pool=pool, cache=cache) and cache.get_stats()["hits"] == 1
+
+
+def test_evict_leaves_segments_a_fetch_is_reading(wave_server, window_start, tmp_path):
+    cache = WaveformCache(str(tmp_path))
+    pool = ConnectionPool()
+    params = dict(wave_server.params, cha="EHZ", start_time=window_start, end_time=window_start + 60)
+    fetch_waveforms(params, pool=pool, cache=cache)
+    cache.max_bytes = 0
+
+    def fetch_while_evicting(gap_params):
+        # Another Multifetch worker sharing the cache evicts while this fetch runs.
+        cache.evict()
+        return fetch_waveforms(gap_params, pool=pool)
+    stream = cache.fetch(dict(params, end_time=window_start + 120), fetch_while_evicting)
+    pool.close_all()
+    assert [trace.stats.npts for trace in stream] == [12001]
+    assert cache.get_stats()["segments"] == 0
+
+
+def test_cache_drops_segments_of_older_index(tmp_path):
+    segment = tmp_path / "old.mseed"
+    segment.write_bytes(b"")
+    (tmp_path / "index.json").write_text(json.dumps(
+        {"127.0.0.1:16032/AM.R0000.00.EH?": [{"start": 0, "end": 60, "file": "old.mseed", "bytes": 0,
+                                              "last_access": 0}]}))
+    cache = WaveformCache(str(tmp_path))
+    assert cache.index == {}
+    assert not segment.exists()